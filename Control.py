@@ -1,10 +1,14 @@
 # Control.py
 
+import os
 import serial
+import threading
 import time
 
 # --- シリアルポートの基本設定 ---
 SERIAL_PORT = 'COM4'  # Windowsの場合。'COM4', 'COM5'など環境に合わせて変更
+# 環境変数で上書き可能 (servo_simulator.py の疑似端末など)
+SERIAL_PORT = os.environ.get("SERVO_SERIAL_PORT", SERIAL_PORT)
 
 BAUDRATE = 1250000  # ICSサーボのボーレート
 
@@ -43,48 +47,362 @@ def angle_to_position(angle):
     # 念のため、ICSの限界値内に収める
     return int(max(3500, min(position, 11500)))
 
+def position_to_angle(position):
+    """angle_to_position の逆変換。ICSサーボの位置を角度に戻します。"""
+    return (position - 7500) / 2000.0 * 60.0
+
+# ICS位置コマンド1つ分のバイト数
+FRAME_SIZE = 3
+
+def pack_position_frame(buffer, offset, physical_id, position):
+    """
+    ICS位置コマンド(3バイト)を buffer の offset 位置に直接書き込みます。
+    1バイト目: コマンド (0x80) + サーボID
+    2バイト目: 位置データの上位7bit
+    3バイト目: 位置データの下位7bit
+    """
+    buffer[offset] = 0x80 | physical_id
+    buffer[offset + 1] = (position >> 7) & 0x7F
+    buffer[offset + 2] = position & 0x7F
+
+
+class IcsResponseParser:
+    """
+    シリアルポートから読んだバイト列をICSの応答に分解するクラス。
+    ICSは1線式のため、送信したコマンド (先頭バイトの最上位bitが1) がエコーとして
+    返ってくる場合があります。エコーは読み飛ばし、位置コマンドへの応答
+    (先頭バイト = サーボID, 続く2バイト = 現在位置の上位/下位7bit) だけを取り出します。
+    """
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def feed(self, data):
+        """受信データを追加し、[(physical_id, position), ...] を返します。"""
+        self._buffer.extend(data)
+        buf = self._buffer
+        results = []
+        i = 0
+        while len(buf) - i >= FRAME_SIZE:
+            head = buf[i]
+            if head & 0x80:
+                # 自分が送ったコマンドのエコー
+                i += FRAME_SIZE
+            elif head & 0x60 == 0:
+                # 位置コマンドへの応答
+                position = (buf[i + 1] << 7) | buf[i + 2]
+                results.append((head & 0x1F, position))
+                i += FRAME_SIZE
+            else:
+                # 想定外のバイト: 1バイトずらして同期を取り直す
+                i += 1
+        del buf[:i]
+        return results
+
+
+# フレームキャッシュの角度刻みと範囲 (度)
+ANGLE_RESOLUTION = 0.1
+ANGLE_LIMIT = 60.0
+
+class FrameCache:
+    """
+    サーボIDと量子化した角度をキーに、送信可能なICS位置フレーム (bytes) を保持する表。
+    angle_to_position の浮動小数点計算とビット詰めを、表引き1回に置き換えます。
+    表はサーボIDごとに初回参照時に作成します。
+    """
+    def __init__(self, resolution=ANGLE_RESOLUTION, limit=ANGLE_LIMIT):
+        self.resolution = resolution
+        self.limit = limit
+        self._steps = int(round(limit / resolution))
+        self._scale = 1.0 / resolution
+        # 四捨五入用のオフセット (表の中央 + 0.5)
+        self._offset = self._steps + 0.5
+        self._tables = {}  # {physical_id: [bytes, ...]}
+
+    def _build(self, physical_id):
+        table = []
+        for i in range(-self._steps, self._steps + 1):
+            frame = bytearray(FRAME_SIZE)
+            pack_position_frame(frame, 0, physical_id, angle_to_position(i * self.resolution))
+            table.append(bytes(frame))
+        self._tables[physical_id] = table
+        return table
+
+    def lookup(self, physical_id, angle):
+        """角度を resolution 単位に丸めたフレームを返します。"""
+        table = self._tables.get(physical_id)
+        if table is None:
+            table = self._build(physical_id)
+        index = angle * self._scale + self._offset
+        if 0.0 <= index < len(table):
+            return table[int(index)]
+        # 表の範囲外はその場で組み立てる
+        frame = bytearray(FRAME_SIZE)
+        pack_position_frame(frame, 0, physical_id, angle_to_position(angle))
+        return bytes(frame)
+
+# 全サーボで共有するフレームキャッシュ
+frame_cache = FrameCache()
+
+
+class ServoBus:
+    """
+    1本のシリアルバス (ポート) への書き込みをまとめるクラス。
+    1ティック分の全サーボの位置フレームを事前確保したバッファに集め、
+    flush() で1回の write として送信します。
+    commit() を使うとポートごとの書き込みスレッドが送信と応答の受信を行うため、
+    複数ポートへの送信が並行して進み、制御ループはシリアルI/Oを待ちません。
+    port が None の場合は、従来どおりグローバルな ser (SERIAL_PORT) を使います。
+    """
+    def __init__(self, port=None, max_servos=16):
+        self.port = port
+        self.serial = None
+        self.max_servos = max_servos
+        self._buffer = bytearray(FRAME_SIZE * max_servos)
+        self._length = 0
+        self._slots = {}  # {physical_id: バッファ内のオフセット}
+        self._lock = threading.Lock()      # 送信待ちバッファ用
+        self._io_lock = threading.Lock()   # シリアルポート用
+        self._ready = threading.Event()
+        self._writer = None
+        # 応答から読み取った実際の位置 {physical_id: (位置, 受信時刻 monotonic)}
+        self.measured = {}
+        # 各サーボのフレームを最後にシリアルへ書き込んだ時刻 {physical_id: monotonic}
+        self.last_written = {}
+        # 送信に失敗して捨てたフレームのサーボID (スケジューラが take_dropped() で取り出して送り直す)
+        self._dropped = set()
+        self._parser = IcsResponseParser()
+
+    @property
+    def name(self):
+        return self.port if self.port is not None else SERIAL_PORT
+
+    def open(self):
+        """バスのシリアルポートを開きます。"""
+        if self.port is None:
+            init_serial()
+            return
+        if self.serial is not None and self.serial.is_open:
+            return
+        try:
+            self.serial = serial.Serial(
+                port=self.port,
+                baudrate=BAUDRATE,
+                bytesize=8,
+                parity=serial.PARITY_EVEN,
+                timeout=0.1
+            )
+            print(f"シリアルポート {self.port} を開きました。")
+        except serial.SerialException as e:
+            print(f"エラー: シリアルポート {self.port} を開けませんでした。")
+            print(f"詳細: {e}")
+            self.serial = None
+
+    def _port(self):
+        return self.serial if self.port is not None else ser
+
+    def is_open(self):
+        port = self._port()
+        return port is not None and port.is_open
+
+    def _slot(self, physical_id):
+        """physical_id のフレームを書き込むバッファ内オフセットを返します (ロック取得済みで呼ぶ)。"""
+        offset = self._slots.get(physical_id)
+        if offset is None:
+            if self._length + FRAME_SIZE > len(self._buffer):
+                # 想定より多くのサーボが積まれた場合はバッファを拡張
+                self._buffer.extend(bytes(FRAME_SIZE * self.max_servos))
+            offset = self._length
+            self._slots[physical_id] = offset
+            self._length += FRAME_SIZE
+        return offset
+
+    def add(self, physical_id, position):
+        """
+        サーボの位置フレームをバッファに積みます。
+        同じティック内で同じIDが再度積まれた場合は、最新の位置で上書きします。
+        """
+        with self._lock:
+            offset = self._slot(physical_id)
+            pack_position_frame(self._buffer, offset, physical_id, position)
+
+    def add_frame(self, physical_id, frame):
+        """組み立て済みのフレーム (3バイト) をそのままバッファにコピーします。"""
+        with self._lock:
+            offset = self._slot(physical_id)
+            self._buffer[offset:offset + FRAME_SIZE] = frame
+
+    def submit(self, servo, frame, moving=True):
+        """Control.move(angle, bus) から呼ばれる入口。"""
+        self.add_frame(servo.physical_id, frame)
+
+    def pending(self):
+        """バッファに積まれているフレーム数を返します。"""
+        return self._length // FRAME_SIZE
+
+    def _take(self):
+        """送信待ちのバイト列と、含まれるサーボIDを取り出し、バッファを空にします。"""
+        with self._lock:
+            length = self._length
+            self._length = 0
+            ids = list(self._slots)
+            self._slots.clear()
+            if length == 0:
+                return None, ids
+            return bytes(self._buffer[:length]), ids
+
+    def write_now(self, data):
+        """バイト列をすぐに送信します。送信したバイト数を返します。"""
+        with self._io_lock:
+            port = self._port()
+            if port is None or not port.is_open:
+                return 0
+            try:
+                port.write(data)
+                return len(data)
+            except Exception as e:
+                print(f"エラー: サーボバス {self.name} への送信に失敗しました: {e}")
+                return 0
+
+    def flush(self):
+        """
+        積まれているフレームを1回の write でまとめて送信します。
+        送信したバイト数を返します（ポートが閉じている場合は0）。
+        """
+        data, ids = self._take()
+        if data is None:
+            return 0
+        written = self.write_now(data)
+        if written:
+            now = time.monotonic()
+            for physical_id in ids:
+                self.last_written[physical_id] = now
+        else:
+            self._drop(ids)
+        return written
+
+    def _drop(self, ids):
+        with self._lock:
+            self._dropped.update(ids)
+
+    def take_dropped(self):
+        """前回の呼び出し以降に送信できずに捨てたフレームのサーボIDを返します。"""
+        with self._lock:
+            dropped = self._dropped
+            self._dropped = set()
+        return dropped
+
+    def commit(self):
+        """
+        積まれているフレームの送信を書き込みスレッドに任せます (スレッドは初回に起動)。
+        送信予定のバイト数を返します。ポートが閉じている場合は破棄して0を返します。
+        """
+        if not self.is_open():
+            _, ids = self._take()
+            self._drop(ids)
+            return 0
+        with self._lock:
+            staged = self._length
+        if staged:
+            if self._writer is None:
+                self.start_writer()
+            self._ready.set()
+        return staged
+
+    def start_writer(self):
+        self._writer = threading.Thread(target=self._writer_loop, daemon=True)
+        self._writer.start()
+
+    def _writer_loop(self):
+        while True:
+            self._ready.wait()
+            self._ready.clear()
+            # 前回の送信に対する応答を読んでから、今回の分を送る
+            self.poll_responses()
+            self.flush()
+
+    def poll_responses(self):
+        """
+        前回の flush() に対するサーボの応答を、待たずに読める分だけ読み取ります。
+        送信 → 次のティックまでのスリープ中に応答が届くため、応答待ちでブロックしません。
+        更新された {physical_id: 位置} を返します。
+        """
+        with self._io_lock:
+            port = self._port()
+            if port is None or not port.is_open:
+                return {}
+            try:
+                waiting = port.in_waiting
+                if not waiting:
+                    return {}
+                data = port.read(waiting)
+            except Exception as e:
+                print(f"エラー: サーボ応答の受信に失敗しました: {e}")
+                return {}
+        now = time.monotonic()
+        updated = {}
+        for physical_id, position in self._parser.feed(data):
+            self.measured[physical_id] = (position, now)
+            updated[physical_id] = position
+        return updated
+
+
+# ポート名 → ServoBus (None はデフォルトの SERIAL_PORT)
+_buses = {}
+_buses_lock = threading.Lock()
+
+def get_bus(port=None, connect=True):
+    """ポートごとに1つの ServoBus を返します (connect=True ならポートを開く)。"""
+    with _buses_lock:
+        bus = _buses.get(port)
+        if bus is None:
+            bus = ServoBus(port)
+            _buses[port] = bus
+    if connect:
+        bus.open()
+    return bus
+
+def all_buses():
+    """これまでに作成された全ての ServoBus を返します。"""
+    with _buses_lock:
+        return list(_buses.values())
+
 
 class Control:
     """
     1つのICSサーボモーターをpyserial経由で制御するためのクラス。
     """
-    def __init__(self, physical_id, name="Servo"):
+    def __init__(self, physical_id, name="Servo", port=None, connect=True):
         """
         サーボを初期化します。
+        port を指定すると、そのシリアルポートのバスに接続します (None は SERIAL_PORT)。
+        connect=False の場合はポートを開かず、設定だけを保持します (別プロセスで制御する場合など)。
         """
         self.physical_id = physical_id
         self.name = name
-        init_serial() # クラスのインスタンス作成時にシリアルポートを初期化
-        print(f"{self.name} (ID: {self.physical_id}) を準備しました。")
+        # クラスのインスタンス作成時にシリアルポートを初期化
+        self.bus = get_bus(port, connect)
+        print(f"{self.name} (ID: {self.physical_id}, Port: {self.bus.name}) を準備しました。")
 
-    def move(self, angle):
+    def move(self, angle, bus=None):
         """
         指定された角度にサーボを動かすためのICSコマンドを送信します。
         
         Args:
             angle (float): サーバーから受け取る目標の角度
+            bus (ServoBus / ServoCommandScheduler): 指定された場合は即時送信せず、積むだけにする
         """
-        global ser
-        if ser is None or not ser.is_open:
+        if not self.bus.is_open():
             # print(f"エラー: {self.name}を動かせません。シリアルポートが開いていません。")
             return
 
-        # 角度をICSの位置コマンドに変換
-        position = angle_to_position(angle)
-        
-        # ICSコマンドを作成 (3バイト)
-        # 1バイト目: コマンド (0x80) + サーボID
-        # 2バイト目: 位置データの上位7bit
-        # 3バイト目: 位置データの下位7bit
-        command_byte = 0x80 | self.physical_id
-        pos_high = (position >> 7) & 0x7F
-        pos_low = position & 0x7F
-        
-        data_to_send = bytearray([command_byte, pos_high, pos_low])
-        
-        try:
-            ser.write(data_to_send)
-            # ログ表示（任意）
-            # print(f"Sent to {self.name} (ID: {self.physical_id}): Position {position}")
-        except Exception as e:
-            print(f"エラー: {self.name}へのコマンド送信に失敗しました: {e}")
\ No newline at end of file
+        # 角度を量子化し、組み立て済みのICSコマンド (3バイト) を表から取得
+        data_to_send = frame_cache.lookup(self.physical_id, angle)
+
+        if bus is not None:
+            # 送信は bus 側でまとめて行う
+            bus.submit(self, data_to_send)
+            return
+
+        self.bus.write_now(data_to_send)
+        # ログ表示（任意）
+        # print(f"Sent to {self.name} (ID: {self.physical_id}): Frame {data_to_send.hex()}")
@@ -0,0 +1,188 @@
+# bench_kachaka_session.py
+# kachaka_simulator.py のロボットを使って、実機なしで
+# /ws/kachaka の実験セッション (目的地選択 → 経路選択 → 移動キューの処理 → 到着) を通しで負荷試験します。
+#
+# ロボットごとに2人の操作者 (user_1 / user_2) をつなぎ、交代しながら目的地と経路をランダムに選び続けます。
+# 1回の移動ごとに、経路を選んでから最初の移動コマンドが届くまでの時間と、
+# 到着までの時間のうちシミュレータ上の移動時間以外 (サーバー側のオーバーヘッド) を測ります。
+#
+# 使い方:
+#   python bench_kachaka_session.py [unified_server|server] [移動回数] [ロボット台数] [1区間の秒数 | CSVのglob] [time_scale]
+#   例: python bench_kachaka_session.py server 10 3 "*_metrics_*.csv" 0.05
+
+import asyncio
+import importlib
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+import Control
+from servo_simulator import IcsServoSimulator
+from kachaka_simulator import KachakaSimulator, TravelTimeModel, serve
+from bench_servo_loop import percentile
+
+PORT = 8766
+ROUTES = ["route_left", "route_center", "route_right"]
+
+
+class SessionClient:
+    """1人の操作者。受信したメッセージを溜めておき、条件に合うものを待てるようにする。"""
+    def __init__(self, ws):
+        self.ws = ws
+        self.messages = asyncio.Queue()
+        self.user_id = None
+        self._reader = asyncio.create_task(self._read())
+
+    async def _read(self):
+        async for raw in self.ws:
+            data = json.loads(raw)
+            if data.get("type") == "PING":
+                # 時計合わせの PING には応答しておく
+                await self.ws.send(json.dumps({"action": "PONG", "id": data["id"]}))
+                continue
+            await self.messages.put(data)
+
+    def clear(self):
+        """前の移動のときに届いたメッセージを捨てる"""
+        while not self.messages.empty():
+            self.messages.get_nowait()
+
+    async def send(self, **data):
+        await self.ws.send(json.dumps(data))
+
+    async def wait_for(self, predicate, timeout=120.0):
+        async def _wait():
+            while True:
+                data = await self.messages.get()
+                if predicate(data):
+                    return data
+        return await asyncio.wait_for(_wait(), timeout)
+
+
+async def run_session(robot_id, sim, n_trips, results, seed):
+    import websockets
+    rng = random.Random(seed)
+    url = f"ws://127.0.0.1:{PORT}/ws/kachaka?robot={robot_id}"
+    async with websockets.connect(url) as ws1, websockets.connect(url) as ws2:
+        clients = {}
+        for ws in (ws1, ws2):
+            client = SessionClient(ws)
+            assigned = await client.wait_for(lambda d: d.get("type") == "user_assigned")
+            client.user_id = assigned["user_id"]
+            clients[client.user_id] = client
+        location = assigned["current_location"]
+        selector = assigned["destination_selector"]
+
+        await clients["user_1"].send(action="START_EXPERIMENT")
+        await clients["user_1"].wait_for(lambda d: d.get("type") == "EXPERIMENT_STARTED")
+
+        for _ in range(n_trips):
+            destination = rng.choice([str(i) for i in range(1, 12) if str(i) != location])
+            for client in clients.values():
+                client.clear()
+            await clients[selector].send(action="REQUEST_DESTINATION", location={"name": destination})
+            # 経路を選ぶのは server.py ではパートナー、unified_server.py (ベースライン) では目的地を選んだ本人
+            waiting = await clients[selector].wait_for(lambda d: d.get("type") == "WAITING_FOR_ROUTE" and d.get("target_destination") == destination)
+            chooser = clients[waiting["for_user"]]
+
+            log_start = len(sim.log)
+            selected_at = time.monotonic()
+            await chooser.send(action="SELECT_ROUTE", route=rng.choice(ROUTES))
+            status = await chooser.wait_for(
+                lambda d: d.get("type") == "kachaka_status" and d.get("status") == "idle"
+                and d.get("current_location") == destination
+            )
+            arrived_at = time.monotonic()
+
+            legs = [entry for entry in sim.log[log_start:] if entry[4]]
+            travel = sum(end - start for start, end, _, _, _ in legs)
+            results.append({
+                "robot": robot_id,
+                "legs": len(legs),
+                "dispatch": legs[0][0] - selected_at if legs else None,
+                "total": arrived_at - selected_at,
+                "overhead": arrived_at - selected_at - travel
+            })
+            location = destination
+            selector = status["destination_selector"]
+
+
+async def run_load(server, sims, n_trips):
+    import uvicorn
+    config = uvicorn.Config(server.app, host="127.0.0.1", port=PORT, log_level="warning")
+    uv = uvicorn.Server(config)
+    serving = asyncio.create_task(uv.serve())
+    while not uv.started:
+        await asyncio.sleep(0.05)
+
+    results = []
+    started = time.monotonic()
+    await asyncio.gather(*(
+        run_session(robot.robot_id, sim, n_trips, results, seed=i)
+        for i, (robot, sim) in enumerate(zip(server.fleet, sims))
+    ))
+    elapsed = time.monotonic() - started
+    uv.should_exit = True
+    await serving
+    return results, elapsed
+
+
+def summarize(name, values, unit_scale=1000.0, unit="ms"):
+    values = [v for v in values if v is not None]
+    if not values: return f"{name}: -"
+    return (f"{name} (n={len(values)}): p50 {percentile(values, 50) * unit_scale:.1f} {unit}, "
+            f"p95 {percentile(values, 95) * unit_scale:.1f} {unit}, max {max(values) * unit_scale:.1f} {unit}")
+
+
+async def main():
+    module_name = sys.argv[1] if len(sys.argv) > 1 else "unified_server"
+    n_trips = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    n_robots = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+    source = sys.argv[4] if len(sys.argv) > 4 else "0.5"
+    time_scale = float(sys.argv[5]) if len(sys.argv) > 5 else 1.0
+
+    servo_sim = IcsServoSimulator()
+    os.environ["SERVO_SERIAL_PORT"] = servo_sim.start()
+    Control.SERIAL_PORT = servo_sim.port_name
+
+    sims = []
+    for i in range(n_robots):
+        try:
+            model = TravelTimeModel(travel_time=float(source), jitter=0.2, time_scale=time_scale, seed=i)
+        except ValueError:
+            model = TravelTimeModel.from_csv(source, time_scale=time_scale, seed=i)
+        sim = KachakaSimulator(model)
+        await serve(sim, 0)
+        sims.append(sim)
+    os.environ["KACHAKA_ROBOTS"] = ",".join(f"sim_{i + 1}=127.0.0.1:{sim.port}" for i, sim in enumerate(sims))
+    print(f"🤖 {n_robots} Kachaka simulator(s): {os.environ['KACHAKA_ROBOTS']}")
+
+    server = importlib.import_module(module_name)
+    # 到着後のクールダウンは待たずに次の移動へ
+    server.COOLDOWN_DURATION = 0.0
+    # 実験ログは一時ディレクトリに書き出す
+    log_dir = tempfile.mkdtemp(prefix="kachaka_bench_")
+    os.chdir(log_dir)
+
+    results, elapsed = await run_load(server, sims, n_trips)
+
+    print(f"--- /ws/kachaka セッション負荷試験 ({module_name}, {n_robots}台 x {n_trips}回, 区間 {source}, x{time_scale}) ---")
+    print(f"trips: {len(results)} in {elapsed:.1f} s ({len(results) / elapsed:.2f} trips/s), "
+          f"legs: {sum(r['legs'] for r in results)}")
+    print(summarize("route selected→first move command", [r["dispatch"] for r in results]))
+    print(summarize("route selected→arrival", [r["total"] for r in results], 1.0, "s"))
+    print(summarize("server overhead (arrival time - simulated travel)", [r["overhead"] for r in results]))
+    for robot, sim in zip(server.fleet, sims):
+        print(f"[{robot.robot_id}] {sim.get_stats()}")
+    print(f"logs: {log_dir}")
+    for sim in sims:
+        sim.stop()
+        await sim.server.stop(0)
+    servo_sim.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,87 @@
+# bench_servo_frames.py
+# ICSフレーム生成と送信のマイクロベンチマーク
+# 旧実装 (angle_to_position + ビット詰め + サーボごとの write) と、
+# 現在の公開の送信経路 (Control.move(angle, bus) でフレームキャッシュから積み、ティックごとに bus.flush()) を比較します。
+# 送信先は servo_simulator.py の疑似端末なので、実機やシリアルポートは不要です。
+
+import random
+import timeit
+
+from Control import Control, FrameCache, angle_to_position
+from servo_simulator import IcsServoSimulator
+
+SERVO_IDS = [5, 7, 9, 13]
+N_TICKS = 2500
+REPEAT = 5
+
+def build_frame_legacy(physical_id, angle):
+    """旧 Control.move と同じ手順でフレームを組み立てる"""
+    position = angle_to_position(angle)
+    command_byte = 0x80 | physical_id
+    pos_high = (position >> 7) & 0x7F
+    pos_low = position & 0x7F
+    return bytearray([command_byte, pos_high, pos_low])
+
+def main():
+    random.seed(0)
+    # 1ティック = 全サーボに1フレームずつ
+    ticks = [[random.uniform(-40, 40) for _ in SERVO_IDS] for _ in range(N_TICKS)]
+    n_frames = N_TICKS * len(SERVO_IDS)
+
+    sim = IcsServoSimulator(echo=False, respond=False)
+    port_name = sim.start()
+    servos = [Control(p_id, f"Bench {p_id}", port=port_name) for p_id in SERVO_IDS]
+    bus = servos[0].bus
+    port = bus.serial
+    cache = FrameCache()
+    for p_id in SERVO_IDS:
+        cache.lookup(p_id, 0)  # 表を事前に作っておく
+
+    def run_encode_legacy():
+        for angles in ticks:
+            for p_id, angle in zip(SERVO_IDS, angles):
+                build_frame_legacy(p_id, angle)
+
+    def run_encode_cache():
+        for angles in ticks:
+            for p_id, angle in zip(SERVO_IDS, angles):
+                cache.lookup(p_id, angle)
+
+    def run_send_legacy():
+        # 旧 Control.move: フレームを組み立てて、サーボごとに ser.write
+        for angles in ticks:
+            for p_id, angle in zip(SERVO_IDS, angles):
+                port.write(build_frame_legacy(p_id, angle))
+
+    def run_send_bus_legacy_encode():
+        # まとめ書きはそのままで、フレームだけ旧手順で組み立てる (表引きの効果を切り分ける)
+        for angles in ticks:
+            for p_id, angle in zip(SERVO_IDS, angles):
+                bus.add_frame(p_id, build_frame_legacy(p_id, angle))
+            bus.flush()
+
+    def run_send_bus():
+        # 現在の経路: Control.move(angle, bus) で積み、ティックごとに1回 flush
+        for angles in ticks:
+            for servo, angle in zip(servos, angles):
+                servo.move(angle, bus)
+            bus.flush()
+
+    print(f"--- ICSフレーム生成・送信ベンチマーク ({N_TICKS} ティック x {len(SERVO_IDS)} サーボ x {REPEAT} 回) ---")
+    results = {}
+    for name, func in [
+        ("encode legacy", run_encode_legacy), ("encode cache", run_encode_cache),
+        ("send legacy", run_send_legacy), ("bus+legacy enc", run_send_bus_legacy_encode),
+        ("send bus", run_send_bus)
+    ]:
+        best = min(timeit.repeat(func, number=1, repeat=REPEAT))
+        results[name] = best
+        print(f"{name:>14}: {best / n_frames * 1e9:8.1f} ns/frame")
+
+    print(f"フレーム生成のみ (表引き): x{results['encode legacy'] / results['encode cache']:.2f}")
+    print(f"送信経路全体 (Control.move + flush): x{results['send legacy'] / results['send bus']:.2f}")
+    print(f"うち表引きの分 (まとめ書き同士の比較): x{results['bus+legacy enc'] / results['send bus']:.2f}")
+    sim.stop()
+
+if __name__ == "__main__":
+    main()
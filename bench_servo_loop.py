@@ -0,0 +1,108 @@
+# bench_servo_loop.py
+# servo_simulator.py の疑似端末を使って、実機なしで
+# /ws/servo → servo_thread_loop → シリアル送信 の経路を負荷試験します。
+#
+# 使い方:
+#   python bench_servo_loop.py [unified_server|server] [秒数] [クライアント数] [json|binary]
+
+import asyncio
+import importlib
+import json
+import os
+import sys
+import threading
+import time
+
+import Control
+from servo_simulator import IcsServoSimulator
+from servo_protocol import BINARY_SUBPROTOCOL, encode_command
+
+PORT = 8765
+
+def percentile(values, p):
+    if not values: return 0.0
+    values = sorted(values)
+    k = min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))
+    return values[k]
+
+async def run_client(sim, server, user_id, axis, duration, latencies, binary=False):
+    import websockets
+    servo = server.USER_SERVO_MAP[user_id][axis]
+    # 制御ループ上のIDから、実際にフレームが送られるサーボIDを求める
+    wire_id = server.SERVO_TARGETS[servo.physical_id].physical_id
+
+    def encode(command):
+        if binary:
+            return bytes([encode_command(user_id, axis, command)])
+        return json.dumps({"user_id": user_id, "axis": axis, "command": command})
+
+    subprotocols = [BINARY_SUBPROTOCOL] if binary else None
+    async with websockets.connect(f"ws://127.0.0.1:{PORT}/ws/servo", subprotocols=subprotocols) as ws:
+        end = time.monotonic() + duration
+        command = "increase"
+        while time.monotonic() < end:
+            sent_at = time.monotonic()
+            await ws.send(encode(command))
+            # 押している間に最初のフレームが届くまでの時間を測る
+            while time.monotonic() - sent_at < 0.5:
+                frames = sim.frames_since(sent_at, wire_id)
+                if frames:
+                    latencies.append(frames[0][0] - sent_at)
+                    break
+                await asyncio.sleep(0.001)
+            await asyncio.sleep(0.2)
+            await ws.send(encode("stop"))
+            await asyncio.sleep(0.1)
+            command = "decrease" if command == "increase" else "increase"
+
+async def run_load(sim, server, duration, n_clients, binary=False):
+    targets = [(u, a) for u in ("user_1", "user_2") for a in ("horizontal", "vertical")]
+    latencies = []
+    tasks = [
+        run_client(sim, server, *targets[i % len(targets)], duration, latencies, binary)
+        for i in range(n_clients)
+    ]
+    await asyncio.gather(*tasks)
+    return latencies
+
+def main():
+    module_name = sys.argv[1] if len(sys.argv) > 1 else "unified_server"
+    duration = float(sys.argv[2]) if len(sys.argv) > 2 else 5.0
+    n_clients = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+    binary = len(sys.argv) > 4 and sys.argv[4] == "binary"
+
+    sim = IcsServoSimulator()
+    os.environ["SERVO_SERIAL_PORT"] = sim.start()
+    # Control はシミュレータ経由で既に import 済みなので、ポート名を直接差し替える
+    Control.SERIAL_PORT = sim.port_name
+    print(f"🤖 Simulator on {sim.port_name}")
+
+    server = importlib.import_module(module_name)
+
+    import uvicorn
+    config = uvicorn.Config(server.app, host="127.0.0.1", port=PORT, log_level="warning")
+    uv = uvicorn.Server(config)
+    threading.Thread(target=uv.run, daemon=True).start()
+    while not uv.started:
+        time.sleep(0.05)
+
+    sim.reset_stats()
+    latencies = asyncio.run(run_load(sim, server, duration, n_clients, binary))
+    stats = sim.get_stats()
+
+    print(f"--- /ws/servo 負荷試験 ({module_name}, {duration}秒, {n_clients}クライアント, {'binary' if binary else 'json'}) ---")
+    print(f"frames/sec: {stats['frames_per_sec']}, writes/sec: {stats['writes_per_sec']}, "
+          f"bus utilization: {stats['bus_utilization'] * 100:.2f}%")
+    print(f"bus queue delay: mean {stats['queue_delay_mean_ms']} ms, max {stats['queue_delay_max_ms']} ms")
+    if latencies:
+        print(f"input→serial latency (n={len(latencies)}): "
+              f"p50 {percentile(latencies, 50) * 1000:.2f} ms, "
+              f"p95 {percentile(latencies, 95) * 1000:.2f} ms, "
+              f"p99 {percentile(latencies, 99) * 1000:.2f} ms")
+    print(f"servo loop timing: {server.servo_timer.get_stats()}")
+    print(f"commanded: {server.current_angles}, measured: {server.measured_angles}")
+    uv.should_exit = True
+    sim.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+# clock_sync.py
+# WebSocket クライアントとの往復遅延 (RTT) と時計のずれ (オフセット) を推定するモジュール
+#
+# サーバーが定期的に PING を送り、クライアントは受信時刻と送信時刻を付けて PONG を返します (NTP と同じ4時刻方式)。
+#   サーバー → {"type": "PING", "id": 3, "t0": サーバー送信時刻}
+#   クライアント → {"action": "PONG", "id": 3, "t1": クライアント受信時刻, "t2": クライアント送信時刻}
+# 時刻はすべてエポックからのミリ秒 (JavaScript の Date.now() と同じ)。
+# t1 / t2 を省略した場合は RTT だけを計測します。
+#
+# クライアント側から {"action": "PING", "t0": ...} を送ると、サーバーは {"type": "PONG", "t0", "t1", "t2"} を返します。
+
+import asyncio
+import time
+from collections import deque
+
+
+def now_ms():
+    return time.time() * 1000.0
+
+
+def make_pong(data, received_ms):
+    """クライアントからの PING への応答"""
+    return {"type": "PONG", "t0": data.get("t0"), "t1": received_ms, "t2": now_ms()}
+
+
+class ClockSync:
+    """
+    1つのクライアントの RTT と時計のオフセット (クライアント時刻 - サーバー時刻) を推定します。
+    オフセットは直近の計測のうち RTT が最小のもの (経路の揺らぎが最も小さいもの) を採用します。
+    """
+    def __init__(self, window=8, smoothing=0.2):
+        self.samples = deque(maxlen=window)  # (rtt_ms, offset_ms or None)
+        self.smoothing = smoothing
+        self.rtt_mean_ms = None
+        self._next_id = 0
+        self._sent = {}  # {ping id: t0}
+
+    def make_ping(self):
+        ping_id = self._next_id
+        self._next_id += 1
+        t0 = now_ms()
+        self._sent[ping_id] = t0
+        # 応答のない PING を溜め込まない
+        while len(self._sent) > self.samples.maxlen:
+            self._sent.pop(next(iter(self._sent)))
+        return {"type": "PING", "id": ping_id, "t0": t0}
+
+    def handle_pong(self, data):
+        """PONG を受け取り、RTT (ms) を返します。対応する PING がなければ None。"""
+        t3 = now_ms()
+        t0 = self._sent.pop(data.get("id"), None)
+        if t0 is None:
+            return None
+        t1, t2 = data.get("t1"), data.get("t2")
+        if t1 is not None and t2 is not None:
+            rtt = (t3 - t0) - (t2 - t1)
+            offset = ((t1 - t0) + (t2 - t3)) / 2.0
+        else:
+            rtt = t3 - t0
+            offset = None
+        rtt = max(rtt, 0.0)
+        self.samples.append((rtt, offset))
+        if self.rtt_mean_ms is None:
+            self.rtt_mean_ms = rtt
+        else:
+            self.rtt_mean_ms += self.smoothing * (rtt - self.rtt_mean_ms)
+        return rtt
+
+    @property
+    def rtt_ms(self):
+        return self.samples[-1][0] if self.samples else None
+
+    @property
+    def offset_ms(self):
+        with_offset = [sample for sample in self.samples if sample[1] is not None]
+        if not with_offset:
+            return None
+        return min(with_offset)[1]
+
+    def to_server_time(self, client_ms):
+        """クライアント時刻 (ms) をサーバー時刻 (エポック秒) に換算します。オフセット未推定なら None。"""
+        offset = self.offset_ms
+        if client_ms is None or offset is None:
+            return None
+        return (client_ms - offset) / 1000.0
+
+    def get_stats(self):
+        offset = self.offset_ms
+        return {
+            "rtt_ms": None if self.rtt_ms is None else round(self.rtt_ms, 2),
+            "rtt_min_ms": round(min(s[0] for s in self.samples), 2) if self.samples else None,
+            "rtt_mean_ms": None if self.rtt_mean_ms is None else round(self.rtt_mean_ms, 2),
+            "offset_ms": None if offset is None else round(offset, 2),
+            "samples": len(self.samples)
+        }
+
+
+async def run_pinger(websocket, sync, interval):
+    """接続中、interval 秒ごとに PING を送ります。接続が閉じて送れなくなったら終了します。"""
+    try:
+        while True:
+            await websocket.send_json(sync.make_ping())
+            await asyncio.sleep(interval)
+    except Exception:
+        return
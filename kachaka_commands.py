@@ -0,0 +1,146 @@
+# kachaka_commands.py
+# Kachaka のコマンド状態をストリーミングで受け取り、移動の完了をその場で検知するモジュール
+#
+# is_command_running() を0.5秒ごとにポーリングする代わりに、
+# command_state.stream() (カーソル付きの long polling) で状態が変わった瞬間に通知を受けます。
+# ストリームが切れている間は connected が False になるので、呼び出し側はポーリングに戻れます。
+#
+# 経路の次の地点をロボットのコマンドキューに先に積んでおく (パイプライン) 場合は、
+# 地点の切り替わりで実行中の状態が途切れないため、GetLastCommandResult のストリームで届く完了結果を
+# コマンドIDごとに覚えておき、start_move() が返したコマンドIDの結果が届いたかで各区間の完了を判定します。
+# (届いた結果を数えるだけだと、取り消された前のコマンドや受け付けられなかったコマンドの結果と区別できない)
+
+import asyncio
+import math
+import time
+from collections import OrderedDict
+
+from kachaka_api.aio import ResponseHandler
+from kachaka_api.generated import kachaka_api_pb2 as pb2
+
+BUSY_STATES = (pb2.CommandState.COMMAND_STATE_PENDING, pb2.CommandState.COMMAND_STATE_RUNNING)
+
+# 旧実装 (move_to_location の後に1秒待ち、以降0.5秒ごとにポーリング) の待ち時間
+LEGACY_START_DELAY = 1.0
+LEGACY_POLL_INTERVAL = 0.5
+# 覚えておく完了結果の数 (経路1本の区間数より十分多ければよい)
+RESULT_HISTORY = 64
+
+
+async def start_move(client, location_id, cancel_all=True):
+    """
+    move_to_location と同じコマンドを送り、完了を待たずに (結果, コマンドID) を返します。
+    client.move_to_location() はコマンドIDを返さないので、StartCommand を直接呼びます。
+    """
+    response = await client.stub.StartCommand(pb2.StartCommandRequest(
+        command=pb2.Command(move_to_location_command=pb2.MoveToLocationCommand(target_location_id=location_id)),
+        cancel_all=cancel_all
+    ))
+    return response.result, response.command_id
+
+
+async def get_last_result(client):
+    """最後に終わったコマンドの (結果, コマンドID) を1回だけ問い合わせます。"""
+    response = await client.stub.GetLastCommandResult(pb2.GetRequest())
+    return response.result, response.command_id
+
+
+def legacy_detection_delay(started_at, finished_at):
+    """旧実装のポーリングなら、移動の完了を何秒遅れて検知していたか"""
+    first_poll = started_at + LEGACY_START_DELAY
+    if finished_at <= first_poll:
+        return first_poll - finished_at
+    polls = math.ceil((finished_at - first_poll) / LEGACY_POLL_INTERVAL)
+    return first_poll + polls * LEGACY_POLL_INTERVAL - finished_at
+
+
+class CommandStateWatcher:
+    def __init__(self, reconnect_delay=1.0):
+        self.client = None
+        self.reconnect_delay = reconnect_delay
+        self.busy = False
+        self.connected = False
+        self.version = 0          # 状態の更新を受け取るたびに増える
+        self.updated_at = None    # 最後に更新を受け取った時刻 (monotonic)
+        self.results = OrderedDict()  # {コマンドID: 完了結果} (直近の RESULT_HISTORY 件まで)
+        self.results_connected = False
+        self._cond = asyncio.Condition()
+
+    async def run(self):
+        """コマンド状態と完了結果のストリームを購読し続けます (切れたら再接続)。"""
+        await asyncio.gather(self._watch_state(), self._watch_results())
+
+    async def _watch_state(self):
+        while True:
+            if self.client is None:
+                await asyncio.sleep(self.reconnect_delay)
+                continue
+            try:
+                async for state, command in self.client.command_state.stream():
+                    async with self._cond:
+                        self.busy = state in BUSY_STATES
+                        self.connected = True
+                        self.version += 1
+                        self.updated_at = time.monotonic()
+                        self._cond.notify_all()
+            except Exception as e:
+                print(f"🔥 Command state stream error: {e}")
+            async with self._cond:
+                self.connected = False
+                self._cond.notify_all()
+            await asyncio.sleep(self.reconnect_delay)
+
+    async def _watch_results(self):
+        while True:
+            if self.client is None:
+                await asyncio.sleep(self.reconnect_delay)
+                continue
+            try:
+                stream = ResponseHandler(self.client.stub.GetLastCommandResult, lambda r: (r.result, r.command_id))
+                async for result, command_id in stream.stream():
+                    async with self._cond:
+                        if command_id:
+                            self.results[command_id] = result
+                            self.results.move_to_end(command_id)
+                            while len(self.results) > RESULT_HISTORY:
+                                self.results.popitem(last=False)
+                        self.results_connected = True
+                        self._cond.notify_all()
+            except Exception as e:
+                print(f"🔥 Command result stream error: {e}")
+            async with self._cond:
+                self.results_connected = False
+                self._cond.notify_all()
+            await asyncio.sleep(self.reconnect_delay)
+
+    async def _wait(self, predicate, timeout):
+        try:
+            async with self._cond:
+                await asyncio.wait_for(self._cond.wait_for(predicate), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def wait_idle(self, timeout=None):
+        """実行中のコマンドがなくなるまで待ちます。タイムアウトしたら False。"""
+        return await self._wait(lambda: not self.busy or not self.connected, timeout)
+
+    async def wait_finished(self, since_version, timeout=None):
+        """
+        since_version より後の更新でコマンドが終わるまで待ちます。
+        完了を検知したら True、ストリームが切れた / タイムアウトした場合は False (呼び出し側はポーリングに戻る)。
+        """
+        await self._wait(
+            lambda: (self.version > since_version and not self.busy) or not self.connected,
+            timeout
+        )
+        return self.connected and self.version > since_version and not self.busy
+
+    async def wait_command(self, command_id, timeout=None):
+        """
+        コマンドID command_id の完了結果が届くまで待ち、その結果 (pb2.Result) を返します。
+        後ろにコマンドが積まれていて実行中の状態が途切れない場合も、1コマンドずつ完了を判定できます。
+        ストリームが切れた / タイムアウトした場合は None (呼び出し側はポーリングに戻る)。
+        """
+        await self._wait(lambda: command_id in self.results or not self.results_connected, timeout)
+        return self.results.get(command_id)
@@ -0,0 +1,179 @@
+# kachaka_fleet.py
+# 複数台の Kachaka を1つのサーバープロセスで扱うためのモジュール
+#
+# ロボットごとに、クライアント・移動キュー・地点キャッシュ・コマンド状態のストリーム・現在地と、
+# そのロボットで行う実験セッション (接続中の操作者、目的地選択の担当、クールダウン、ログファイル) を持ちます。
+# 経路の実行 (移動キューの処理) もロボットごとに別のタスクで動くので、1台が移動中でも他の台は止まりません。
+#
+# ロボットは環境変数 KACHAKA_ROBOTS で指定します (省略時は1台だけ)。ポートを省略すると 26400。
+#   KACHAKA_ROBOTS="rig_a=10.40.42.28,rig_b=10.40.5.108"
+#   KACHAKA_ROBOTS="sim_1=127.0.0.1:26400,sim_2=127.0.0.1:26401"   (kachaka_simulator.py)
+# クライアントは /ws/kachaka?robot=rig_b のように接続先のロボットを選びます (省略時は先頭のロボット)。
+
+import asyncio
+import threading
+from collections import deque
+
+import kachaka_api.aio
+
+from kachaka_locations import LocationCache
+from kachaka_commands import CommandStateWatcher
+
+KACHAKA_PORT = 26400
+
+
+def parse_robot_list(text, default_ip):
+    """
+    "id=ip,id=ip" を [(id, ip), ...] にします。空なら [("kachaka", default_ip)]。
+    ID を省略した "ip,ip" の形式なら kachaka_1, kachaka_2, ... と名付けます。
+    """
+    robots = []
+    for i, item in enumerate(part.strip() for part in (text or "").split(",")):
+        if not item: continue
+        robot_id, sep, ip = item.partition("=")
+        if not sep:
+            robot_id, ip = f"kachaka_{i + 1}", item
+        robots.append((robot_id.strip(), ip.strip()))
+    return robots or [("kachaka", default_ip)]
+
+
+class KachakaRobot:
+    """1台のロボットと、そのロボットで行う実験セッションの状態"""
+    def __init__(self, robot_id, ip, call_timeout=3.0, start_location="充電ドック", selector="user_1"):
+        self.robot_id = robot_id
+        self.ip = ip
+        self.call_timeout = call_timeout
+        self.client = None
+
+        # 移動キューと、キューに地点が積まれたことを経路の実行タスクに知らせるイベント
+        self.command_queue = deque()
+        self.lock = threading.Lock()
+        self.queue_event = asyncio.Event()
+        self.location_cache = LocationCache(timeout=call_timeout)
+        self.command_watcher = CommandStateWatcher()
+        self.routes = None               # このロボットのマップでの経路表 (route_engine.RoutePlanner)
+
+        # 現在地と、現在の経路の集計 (区間数・先に積んだ区間数・旧実装と比べて短縮できた時間)
+        self.current_location_name = start_location
+        self.current_moving_location = None
+        self.route_progress = {"legs": 0, "pipelined": 0, "saved": 0.0}
+
+        # 実験セッション
+        self.clients = set()             # 接続中の /ws/kachaka
+        self.user_assignments = {}       # {websocket: user_id}
+        self.destination_requests = {}
+        self.route_selection = None
+        self.destination_selector = selector
+        self.cooldown_end_time = 0.0
+        self.is_experiment_started = False
+        self.log_filename = ""
+        self.metrics = None              # サーバー側の MetricsTracker
+
+        self._tasks = []
+
+    async def call(self, coro, timeout=None):
+        """ロボットへの問い合わせ1回にタイムアウトをかける (応答がなければ asyncio.TimeoutError)"""
+        return await asyncio.wait_for(coro, self.call_timeout if timeout is None else timeout)
+
+    async def busy(self):
+        """ロボットがコマンド実行中か (ストリームが使えればその状態、使えなければ問い合わせる)"""
+        if self.command_watcher.connected:
+            return self.command_watcher.busy
+        return await self.call(self.client.is_command_running())
+
+    async def connect(self):
+        """
+        クライアントを作り、地点を読み込みます。失敗しても例外は出さず False を返します。
+        クライアントは応答を待たずに地点キャッシュとコマンド状態の監視へ渡すので、
+        起動時にロボットが応答しなくても、start() のタスクが後から読み込み・接続し直します。
+        """
+        # "ip:port" の形式ならそのまま使う (kachaka_simulator.py など、26400 以外のポートへの接続用)
+        target = self.ip if ":" in self.ip else f"{self.ip}:{KACHAKA_PORT}"
+        self.client = kachaka_api.aio.KachakaApiClient(target)
+        self.location_cache.client = self.client
+        self.command_watcher.client = self.client
+        try:
+            version = await self.call(self.client.get_robot_version())
+            print(f"✅ Connected to Kachaka '{self.robot_id}' ({self.ip})! Ver: {version}")
+            await self.location_cache.refresh()
+            return True
+        except Exception as e:
+            print(f"🔥 Kachaka '{self.robot_id}' ({self.ip}) connect failed: {e} (retrying in the background)")
+            return False
+
+    def start(self, queue_worker):
+        """経路の実行 (queue_worker(robot)) と、地点キャッシュ・コマンド状態の監視を始めます。"""
+        self._tasks = [
+            asyncio.create_task(queue_worker(self)),
+            asyncio.create_task(self.location_cache.run()),
+            asyncio.create_task(self.command_watcher.run())
+        ]
+
+    def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+    def get_stats(self):
+        with self.lock:
+            queued = [loc["name"] for loc in self.command_queue]
+        return {
+            "robot_id": self.robot_id,
+            "ip": self.ip,
+            "connected": self.client is not None and self.command_watcher.connected,
+            "busy": self.command_watcher.busy,
+            "current_location": self.current_location_name,
+            "moving_to": self.current_moving_location["name"] if self.current_moving_location else None,
+            "queue": queued,
+            "users": sorted(self.user_assignments.values()),
+            "destination_selector": self.destination_selector,
+            "is_experiment_started": self.is_experiment_started,
+            "locations": self.location_cache.get_stats(),
+            "routes": self.routes.get_stats() if self.routes else None
+        }
+
+
+class KachakaFleet:
+    """ロボット ID → KachakaRobot。登録順の先頭がデフォルトのロボット。"""
+    def __init__(self, robots=(), **robot_options):
+        self.robots = {}
+        for robot_id, ip in robots:
+            self.add(robot_id, ip, **robot_options)
+
+    def add(self, robot_id, ip, **robot_options):
+        if robot_id in self.robots:
+            raise ValueError(f"Duplicate robot id: {robot_id}")
+        robot = KachakaRobot(robot_id, ip, **robot_options)
+        self.robots[robot_id] = robot
+        return robot
+
+    @property
+    def default(self):
+        return next(iter(self.robots.values()), None)
+
+    def get(self, robot_id=None):
+        """ID からロボットを返します。ID が空ならデフォルト、見つからなければ None。"""
+        if not robot_id:
+            return self.default
+        return self.robots.get(robot_id)
+
+    def __iter__(self):
+        return iter(list(self.robots.values()))
+
+    def __len__(self):
+        return len(self.robots)
+
+    async def connect_all(self):
+        """全ロボットに並行して接続します (1台が応答しなくても他の台の接続を待たせない)。"""
+        await asyncio.gather(*(robot.connect() for robot in self))
+
+    def start_all(self, queue_worker):
+        for robot in self:
+            robot.start(queue_worker)
+
+    def stop_all(self):
+        for robot in self:
+            robot.stop()
+
+    def get_stats(self):
+        return [robot.get_stats() for robot in self]
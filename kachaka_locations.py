@@ -0,0 +1,95 @@
+# kachaka_locations.py
+# Kachaka の登録地点 (名前 → ID) をメモリに保持するキャッシュ
+#
+# 経路決定のたびに get_locations() (gRPC の往復) を呼ばずに済むよう、
+# 起動時に一度読み込み、バックグラウンドで定期的に更新します。
+# ロボットのマップが切り替わった場合は、その場で読み込み直します。
+# ロボットへの問い合わせは kachaka_api.aio のクライアントで行い、1回ごとにタイムアウトをかけます。
+# 地点の座標も持っておき、内容 (マップ・地点・座標) が変わるたびに version を増やして listeners を呼びます (経路表の作り直しに使う)。
+
+import asyncio
+import time
+
+
+class LocationCache:
+    def __init__(self, check_interval=5.0, refresh_interval=60.0, timeout=3.0):
+        """
+        Args:
+            check_interval: マップIDを確認する間隔 (秒)。マップが変わっていれば地点を読み込み直す
+            refresh_interval: マップが変わらなくても地点を読み込み直す間隔 (秒)。地点の追加・編集に追従するため
+            timeout: ロボットへの問い合わせ1回あたりのタイムアウト (秒)
+        """
+        self.check_interval = check_interval
+        self.refresh_interval = refresh_interval
+        self.timeout = timeout
+        self.client = None
+        self.map_id = None
+        self.locations = {}  # {名前: {"id": ..., "name": ..., "pose": (x, y)}} (更新時は丸ごと差し替える)
+        self.version = 0     # マップ・地点・座標のどれかが変わるたびに増える
+        self.refreshed_at = None
+        self.refresh_count = 0
+        self.listeners = []  # 内容が変わったときに await する、引数なしの async 関数
+        self._refreshing = asyncio.Lock()
+
+    def get(self, name):
+        """地点名から {"id", "name", "pose"} を返します (ネットワークアクセスなし)。見つからなければ None。"""
+        return self.locations.get(name)
+
+    async def refresh(self):
+        """マップIDと地点一覧を読み込み直します。"""
+        client = self.client
+        if client is None: return False
+        async with self._refreshing:
+            map_id = await asyncio.wait_for(client.get_current_map_id(), self.timeout)
+            locations = {
+                loc.name: {"id": loc.id, "name": loc.name, "pose": (loc.pose.x, loc.pose.y)}
+                for loc in await asyncio.wait_for(client.get_locations(), self.timeout)
+            }
+            changed = map_id != self.map_id or locations != self.locations
+            if changed:
+                self.version += 1
+            self.map_id = map_id
+            self.locations = locations
+            self.refreshed_at = time.monotonic()
+            self.refresh_count += 1
+        print(f"🗺️ Location cache refreshed: {len(locations)} locations (map: {map_id})")
+        if changed:
+            for listener in list(self.listeners):
+                try:
+                    await listener()
+                except Exception as e:
+                    print(f"🔥 Location cache listener failed: {e}")
+        return True
+
+    async def check(self):
+        """マップが変わっていないか確認し、変わっていれば (または一定時間たっていれば) 読み込み直します。"""
+        if self.client is None: return False
+        stale = self.refreshed_at is None or time.monotonic() - self.refreshed_at > self.refresh_interval
+        if not stale:
+            map_id = await asyncio.wait_for(self.client.get_current_map_id(), self.timeout)
+            if map_id == self.map_id:
+                return False
+        return await self.refresh()
+
+    async def ensure_loaded(self):
+        """キャッシュが空なら読み込みを待ちます (起動直後にロボットへ接続できなかった場合など)。"""
+        if not self.locations and self.client is not None:
+            await self.refresh()
+
+    async def run(self):
+        """バックグラウンドでマップの変更を監視し、キャッシュを更新し続けます。"""
+        while True:
+            try:
+                await self.check()
+            except Exception as e:
+                print(f"🔥 Location cache refresh failed: {e}")
+            await asyncio.sleep(self.check_interval)
+
+    def get_stats(self):
+        return {
+            "map_id": self.map_id,
+            "version": self.version,
+            "locations": len(self.locations),
+            "refresh_count": self.refresh_count,
+            "age_s": None if self.refreshed_at is None else round(time.monotonic() - self.refreshed_at, 1)
+        }
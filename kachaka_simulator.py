@@ -0,0 +1,351 @@
+# kachaka_simulator.py
+# 実機なしで Kachaka まわりを動かすためのロボットシミュレータ (gRPC サーバー)
+#
+# 本物の Kachaka と同じ gRPC サービス (KachakaApi) のうち、このリポジトリで使う部分を実装します。
+#   GetRobotVersion / GetLocations / GetCurrentMapId / GetPngMap / GetRobotPose
+#   StartCommand (move_to_location) / CancelCommand / GetCommandState / GetLastCommandResult
+# kachaka_api のクライアント (同期版・aio 版とも) からそのまま接続でき、
+# カーソル付きの long polling (command_state.stream() など) も本物と同じように動きます。
+#
+# 移動時間は固定値、または記録済みのメトリクスCSV (START_MOVING → WAYPOINT_ARRIVED / TIME_TRAVEL) から
+# 区間ごとに求めた実測値をランダムに選んで使います。time_scale で全体を縮められます。
+#
+# 使い方:
+#   python kachaka_simulator.py [ポート,ポート,...] [秒数 | CSVのglob] [time_scale]
+#   KACHAKA_ROBOTS="rig_a=127.0.0.1:26400,rig_b=127.0.0.1:26401" python server.py
+
+import asyncio
+import csv
+import glob
+import itertools
+import os
+import random
+import struct
+import sys
+import time
+from datetime import datetime
+
+import grpc
+from kachaka_api.generated import kachaka_api_pb2 as pb2
+from kachaka_api.generated import kachaka_api_pb2_grpc as pb2_grpc
+
+DEFAULT_LOCATIONS = ["充電ドック"] + [str(i) for i in range(1, 12)] + list("abcdef")
+DEFAULT_MAP_PNG = os.path.join(os.path.dirname(os.path.abspath(__file__)), "map_image_default.png")
+MAP_RESOLUTION = 0.05  # m/pixel
+# キャンセルされたコマンドの結果に入れるエラーコード (シミュレータ独自の値)
+CANCELLED_ERROR_CODE = 10001
+
+# 全トピック共通のカーソル。更新のたびに増えるので、異なるトピックのカーソルを混ぜて使っても新旧を比べられる
+_cursor = itertools.count(1)
+
+
+def read_leg_times(paths):
+    """
+    メトリクスCSVから区間ごとの移動時間を取り出します。{(出発地, 到着地): [秒, ...]}
+    START_MOVING の時刻と Robot_Location を出発点とし、WAYPOINT_ARRIVED / TIME_TRAVEL までを1区間とします。
+    (START_MOVING 直後の1秒待ちや到着検知の遅れも含んだ、実験中の実際の値です)
+    """
+    legs = {}
+    for path in paths:
+        with open(path, newline='', encoding='utf-8') as f:
+            previous = None  # (時刻, 地点)
+            for row in csv.DictReader(f):
+                action = row["Action_Type"]
+                if action not in ("START_MOVING", "WAYPOINT_ARRIVED", "TIME_TRAVEL"):
+                    continue
+                at = datetime.strptime(row["Timestamp"], '%Y-%m-%d %H:%M:%S.%f').timestamp()
+                location = row["Robot_Location"]
+                if action != "START_MOVING" and previous is not None:
+                    legs.setdefault((previous[1], location), []).append(at - previous[0])
+                previous = None if action == "TIME_TRAVEL" else (at, location)
+    return legs
+
+
+class TravelTimeModel:
+    """1区間の移動時間を決めます。実測値があればそこから選び、なければ固定値 (± jitter) を使います。"""
+    def __init__(self, travel_time=2.0, jitter=0.0, leg_times=None, time_scale=1.0, seed=None):
+        """
+        Args:
+            travel_time: 実測値がない区間の移動時間 (秒)
+            jitter: travel_time のばらつき (割合。0.2 なら ±20%)
+            leg_times: read_leg_times() の結果。同じ区間の実測値がなければ、全区間の実測値から選ぶ
+            time_scale: すべての移動時間に掛ける係数 (負荷試験で時間を縮める場合は 0.1 など)
+        """
+        self.travel_time = travel_time
+        self.jitter = jitter
+        self.leg_times = leg_times or {}
+        self.all_times = [t for times in self.leg_times.values() for t in times]
+        self.time_scale = time_scale
+        self.random = random.Random(seed)
+
+    @classmethod
+    def from_csv(cls, pattern, **kwargs):
+        paths = sorted(glob.glob(pattern))
+        return cls(leg_times=read_leg_times(paths), **kwargs)
+
+    def sample(self, start, goal):
+        if start == goal:
+            return 0.0
+        times = self.leg_times.get((start, goal)) or self.all_times
+        if times:
+            seconds = self.random.choice(times)
+        else:
+            seconds = self.travel_time * (1.0 + self.random.uniform(-self.jitter, self.jitter))
+        return max(0.0, seconds) * self.time_scale
+
+
+class _Topic:
+    """long polling で配信する値。カーソルより新しい値が来るまで Get を待たせる。"""
+    def __init__(self, value):
+        self.value = value
+        self.cursor = next(_cursor)
+        self._cond = asyncio.Condition()
+
+    async def set(self, value):
+        async with self._cond:
+            self.value = value
+            self.cursor = next(_cursor)
+            self._cond.notify_all()
+
+    async def get(self, cursor):
+        """cursor が 0 ならすぐに、そうでなければ cursor より新しい値が来るまで待って (cursor, 値) を返す"""
+        async with self._cond:
+            if cursor:
+                await self._cond.wait_for(lambda: self.cursor > cursor)
+            return self.cursor, self.value
+
+
+def _png_size(data):
+    """PNG の IHDR から (幅, 高さ) を読みます。"""
+    if data[:8] != b"\x89PNG\r\n\x1a\n":
+        return 0, 0
+    return struct.unpack(">II", data[16:24])
+
+
+class KachakaSimulator(pb2_grpc.KachakaApiServicer):
+    """
+    1台分のロボット。move_to_location はコマンドキューに積まれ、先頭から順に実行されます。
+    cancel_all=True なら実行中・待機中のコマンドを取り消してから積みます (本物と同じ)。
+    """
+    def __init__(self, travel_model=None, locations=DEFAULT_LOCATIONS, start_location="充電ドック",
+                 map_png=DEFAULT_MAP_PNG, map_id="sim-map", version="simulator-3.12.3", rpc_delay=0.0):
+        """
+        Args:
+            travel_model: TravelTimeModel (省略時は1区間2秒)
+            locations: 登録地点の名前 (ID は "L_<名前>")。先頭は充電ドック
+            rpc_delay: すべての RPC の応答に足す遅延 (秒)。無線LANの往復遅延の再現用
+        """
+        self.travel_model = travel_model or TravelTimeModel()
+        self.version = version
+        self.map_id = map_id
+        self.rpc_delay = rpc_delay
+
+        with open(map_png, "rb") as f:
+            png = f.read()
+        width, height = _png_size(png)
+        self.map = pb2.Map(data=png, name=map_id, resolution=MAP_RESOLUTION, width=width, height=height,
+                           origin=pb2.Pose(x=0.0, y=0.0, theta=0.0))
+
+        # 地点はマップ上に格子状に並べる
+        columns = 6
+        self.locations = []
+        for i, name in enumerate(locations):
+            pose = pb2.Pose(x=1.0 + (i % columns) * 1.5, y=1.0 + (i // columns) * 1.5, theta=0.0)
+            location_type = pb2.LocationType.LOCATION_TYPE_CHARGER if i == 0 else pb2.LocationType.LOCATION_TYPE_UNSPECIFIED
+            self.locations.append(pb2.Location(id=f"L_{name}", name=name, pose=pose, type=location_type))
+        self.locations_by_id = {loc.id: loc for loc in self.locations}
+        self.location_name = start_location
+
+        # (command_id, command) の待ち行列と、実行中のコマンド
+        self.pending = []
+        self.running = None
+        self._command_ids = itertools.count(1)
+        self._wakeup = asyncio.Event()
+        self._executor = None
+
+        self.command_state = _Topic((pb2.CommandState.COMMAND_STATE_UNSPECIFIED, None, ""))
+        self.last_result = _Topic((pb2.Result(), None, ""))
+        self.pose = _Topic(self.locations_by_id.get(f"L_{start_location}", self.locations[0]).pose)
+
+        self.rpc_counts = {}
+        self.stats = {"started": 0, "completed": 0, "cancelled": 0, "travel_s": 0.0}
+        self.log = []  # (開始 monotonic, 終了 monotonic, 出発地, 到着地, 成功)
+
+    # --- コマンドの実行 ---------------------------------------------------
+
+    def start(self):
+        self._executor = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._executor:
+            self._executor.cancel()
+
+    async def _publish_state(self):
+        if self.running:
+            command_id, command = self.running
+            await self.command_state.set((pb2.CommandState.COMMAND_STATE_RUNNING, command, command_id))
+        else:
+            await self.command_state.set((pb2.CommandState.COMMAND_STATE_UNSPECIFIED, None, ""))
+
+    async def _run(self):
+        while True:
+            if not self.pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            self.running = self.pending.pop(0)
+            command_id, command = self.running
+            target = self.locations_by_id[command.move_to_location_command.target_location_id]
+            start_name = self.location_name
+            duration = self.travel_model.sample(start_name, target.name)
+            await self._publish_state()
+            started = time.monotonic()
+            try:
+                await asyncio.sleep(duration)
+            except asyncio.CancelledError:
+                # CancelCommand / cancel_all で取り消された (停止した地点は出発地のままとする)
+                self.log.append((started, time.monotonic(), start_name, target.name, False))
+                raise
+            self.location_name = target.name
+            await self.pose.set(target.pose)
+            self.stats["completed"] += 1
+            self.stats["travel_s"] += duration
+            self.log.append((started, time.monotonic(), start_name, target.name, True))
+            self.running = None
+            # 結果を先に出してから状態を更新する。後ろに積まれていれば、実行中のまま次のコマンドに移る
+            await self.last_result.set((pb2.Result(success=True), command, command_id))
+            if not self.pending:
+                await self._publish_state()
+
+    async def _cancel_all(self):
+        cancelled = [self.running] if self.running else []
+        cancelled += self.pending
+        self.pending = []
+        if self.running and self._executor:
+            self._executor.cancel()
+            try:
+                await self._executor
+            except asyncio.CancelledError:
+                pass
+            self.running = None
+            self._executor = asyncio.create_task(self._run())
+        for command_id, command in cancelled:
+            self.stats["cancelled"] += 1
+            await self.last_result.set((pb2.Result(success=False, error_code=CANCELLED_ERROR_CODE), command, command_id))
+        if cancelled:
+            await self._publish_state()
+        return cancelled
+
+    # --- gRPC -------------------------------------------------------------
+
+    async def _rpc(self, name):
+        self.rpc_counts[name] = self.rpc_counts.get(name, 0) + 1
+        if self.rpc_delay > 0:
+            await asyncio.sleep(self.rpc_delay)
+
+    async def GetRobotVersion(self, request, context):
+        await self._rpc("GetRobotVersion")
+        return pb2.GetRobotVersionResponse(metadata=pb2.Metadata(cursor=next(_cursor)), version=self.version)
+
+    async def GetLocations(self, request, context):
+        await self._rpc("GetLocations")
+        return pb2.GetLocationsResponse(
+            metadata=pb2.Metadata(cursor=next(_cursor)),
+            locations=self.locations, default_location_id=self.locations[0].id
+        )
+
+    async def GetCurrentMapId(self, request, context):
+        await self._rpc("GetCurrentMapId")
+        return pb2.GetCurrentMapIdResponse(metadata=pb2.Metadata(cursor=next(_cursor)), id=self.map_id)
+
+    async def GetPngMap(self, request, context):
+        await self._rpc("GetPngMap")
+        return pb2.GetPngMapResponse(metadata=pb2.Metadata(cursor=next(_cursor)), map=self.map)
+
+    async def GetRobotPose(self, request, context):
+        await self._rpc("GetRobotPose")
+        cursor, pose = await self.pose.get(request.metadata.cursor)
+        return pb2.GetRobotPoseResponse(metadata=pb2.Metadata(cursor=cursor), pose=pose)
+
+    async def GetCommandState(self, request, context):
+        await self._rpc("GetCommandState")
+        cursor, (state, command, command_id) = await self.command_state.get(request.metadata.cursor)
+        return pb2.GetCommandStateResponse(metadata=pb2.Metadata(cursor=cursor), state=state, command=command, command_id=command_id)
+
+    async def GetLastCommandResult(self, request, context):
+        await self._rpc("GetLastCommandResult")
+        cursor, (result, command, command_id) = await self.last_result.get(request.metadata.cursor)
+        return pb2.GetLastCommandResultResponse(metadata=pb2.Metadata(cursor=cursor), result=result, command=command, command_id=command_id)
+
+    async def StartCommand(self, request, context):
+        await self._rpc("StartCommand")
+        command = request.command
+        if (not command.HasField("move_to_location_command")
+                or command.move_to_location_command.target_location_id not in self.locations_by_id):
+            return pb2.StartCommandResponse(result=pb2.Result(success=False, error_code=CANCELLED_ERROR_CODE + 1))
+        if request.cancel_all:
+            await self._cancel_all()
+        command_id = f"sim-{next(self._command_ids)}"
+        self.pending.append((command_id, command))
+        self.stats["started"] += 1
+        self._wakeup.set()
+        return pb2.StartCommandResponse(result=pb2.Result(success=True), command_id=command_id)
+
+    async def CancelCommand(self, request, context):
+        await self._rpc("CancelCommand")
+        cancelled = await self._cancel_all()
+        command = cancelled[0][1] if cancelled else None
+        return pb2.CancelCommandResponse(result=pb2.Result(success=bool(cancelled)), command=command)
+
+    def get_stats(self):
+        return {
+            "location": self.location_name,
+            "running": self.running is not None,
+            "pending": len(self.pending),
+            **{key: round(value, 3) if isinstance(value, float) else value for key, value in self.stats.items()},
+            "rpc_counts": dict(self.rpc_counts)
+        }
+
+
+async def serve(simulator, port=26400, host="127.0.0.1"):
+    """シミュレータを gRPC サーバーとして起動し、サーバーを返します (止めるときは await server.stop(0))。"""
+    server = grpc.aio.server()
+    pb2_grpc.add_KachakaApiServicer_to_server(simulator, server)
+    bound = server.add_insecure_port(f"{host}:{port}")
+    await server.start()
+    simulator.start()
+    # サーバーへの参照がなくなると停止してしまうので、シミュレータに持たせておく
+    simulator.server = server
+    simulator.port = bound
+    return server
+
+
+async def main():
+    ports = [int(p) for p in (sys.argv[1] if len(sys.argv) > 1 else "26400").split(",")]
+    source = sys.argv[2] if len(sys.argv) > 2 else "2.0"
+    time_scale = float(sys.argv[3]) if len(sys.argv) > 3 else 1.0
+
+    simulators = []
+    for i, port in enumerate(ports):
+        try:
+            model = TravelTimeModel(travel_time=float(source), jitter=0.2, time_scale=time_scale, seed=i)
+        except ValueError:
+            model = TravelTimeModel.from_csv(source, time_scale=time_scale, seed=i)
+        simulator = KachakaSimulator(model)
+        await serve(simulator, port, host="0.0.0.0")
+        simulators.append(simulator)
+        legs = len(model.leg_times)
+        print(f"🤖 Kachaka シミュレータを起動しました: 0.0.0.0:{port} "
+              f"({f'{legs} 区間の実測値' if legs else f'1区間 {model.travel_time} 秒'}, x{time_scale})")
+    print(f'   サーバー側で KACHAKA_ROBOTS="{",".join(f"sim_{i + 1}=127.0.0.1:{p}" for i, p in enumerate(ports))}" を指定してください。')
+    while True:
+        await asyncio.sleep(5)
+        for port, simulator in zip(ports, simulators):
+            print(f"📊 [{port}] {simulator.get_stats()}")
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,353 @@
+# route_engine.py
+# 地点の座標と経由地のつながりから重み付きグラフを作り、
+# 全ての (出発地, 目的地) の組について左・中央・右の3経路を起動時にまとめて計算しておくモジュール
+#
+# 経由地 (a〜f など) どうしのつながりは、手書きの経路表 (register_routes で登録した経路) の
+# 隣り合う地点から作ります。辺の重みは地点間の直線距離 (座標が分からなければ 1 = 区間数)。
+# 手書きの表にない組は k-最短経路 (Yen) で候補を出し、最短を中央、
+# 出発地→目的地の直線より左側を通るものを左、右側を通るものを右に割り当てます。
+# 手書きの表にある組は実験条件なのでそのまま使い、経路長の見積もりだけを付けます。
+#
+# 新しく登録された地点 (手書きの表にない地点) は、座標が近い経由地につないでから経路を作ります。
+# 経路表は {(出発地, 目的地): {"route_left": [...], ...}} の dict なので、引くのは O(1) のまま。
+#
+# さらに地点キャッシュの内容 (マップ・地点) ごとに、(出発地, 目的地, 経路) → 移動計画 (RoutePlan) をまとめて作っておきます。
+# 移動計画には地点の ID まで解決した移動キューの中身と、STARTING_MOVE で送るメッセージが入っているので、
+# 移動を始めるときは dict を1回引いてキューに積むだけです。作り直すのは地点か経路表が変わったときだけで、
+# 計算は地点キャッシュの更新から別スレッドで行います (リクエストを処理するイベントループでは計算しない)。
+
+import asyncio
+import heapq
+import math
+import time
+
+ROUTE_KEYS = ("route_left", "route_center", "route_right")
+
+
+def empty_route():
+    return {key: [] for key in ROUTE_KEYS}
+
+
+class RouteGraph:
+    """地点をノード、通れる区間を辺とする無向グラフ。経路の途中に通れるのは経由地だけ。"""
+    def __init__(self, poses=None):
+        self.poses = dict(poses or {})   # {名前: (x, y)}
+        self.edges = {}                  # {名前: {隣の地点の名前, ...}}
+        self.waypoints = set()
+
+    def add_edge(self, a, b):
+        if a == b: return
+        self.edges.setdefault(a, set()).add(b)
+        self.edges.setdefault(b, set()).add(a)
+
+    def add_route(self, start, route, goal):
+        """start → route の経由地 → goal を辺として登録します。"""
+        self.waypoints.update(route)
+        nodes = [start] + list(route) + [goal]
+        for a, b in zip(nodes, nodes[1:]):
+            self.add_edge(a, b)
+
+    def weight(self, a, b):
+        if a in self.poses and b in self.poses:
+            (ax, ay), (bx, by) = self.poses[a], self.poses[b]
+            return math.hypot(bx - ax, by - ay)
+        return 1.0
+
+    def path_length(self, path):
+        return sum(self.weight(a, b) for a, b in zip(path, path[1:]))
+
+    def link_to_nearest(self, name, count=2):
+        """座標の近い経由地 count 個とつなぎます (手書きの経路に出てこない地点用)。"""
+        if name not in self.poses: return
+        candidates = [wp for wp in self.waypoints if wp in self.poses]
+        for wp in sorted(candidates, key=lambda wp: self.weight(name, wp))[:count]:
+            self.add_edge(name, wp)
+
+    def shortest_path(self, start, goal, banned_nodes=(), banned_edges=()):
+        """Dijkstra。途中は経由地だけを通ります。見つからなければ None。"""
+        dist = {start: 0.0}
+        prev = {}
+        heap = [(0.0, start)]
+        while heap:
+            d, node = heapq.heappop(heap)
+            if node == goal:
+                path = [goal]
+                while path[-1] != start:
+                    path.append(prev[path[-1]])
+                return path[::-1]
+            if d > dist[node]: continue
+            if node != start and node not in self.waypoints: continue
+            for nxt in self.edges.get(node, ()):
+                if nxt in banned_nodes or (node, nxt) in banned_edges: continue
+                nd = d + self.weight(node, nxt)
+                if nd < dist.get(nxt, math.inf):
+                    dist[nxt] = nd
+                    prev[nxt] = node
+                    heapq.heappush(heap, (nd, nxt))
+        return None
+
+    def k_shortest_paths(self, start, goal, k):
+        """Yen の k-最短経路 (ループなし)。短い順に最大 k 本。"""
+        first = self.shortest_path(start, goal)
+        if first is None: return []
+        paths = [first]
+        seen = {tuple(first)}
+        candidates = []
+        while len(paths) < k:
+            last = paths[-1]
+            for i in range(len(last) - 1):
+                root = last[:i + 1]
+                banned_edges = {(p[i], p[i + 1]) for p in paths if p[:i + 1] == root}
+                spur = self.shortest_path(last[i], goal, set(root[:-1]), banned_edges)
+                if spur is None: continue
+                path = root[:-1] + spur
+                if tuple(path) in seen: continue
+                seen.add(tuple(path))
+                heapq.heappush(candidates, (self.path_length(path), path))
+            if not candidates: break
+            paths.append(heapq.heappop(candidates)[1])
+        return paths
+
+    def side(self, path):
+        """
+        出発地→目的地の直線に対して、経路の経由地が平均してどちら側にあるか。
+        正なら左、負なら右 (マップ座標は右手系)。座標が分からなければ 0。
+        """
+        start, goal = path[0], path[-1]
+        inner = [n for n in path[1:-1] if n in self.poses]
+        if not inner or start not in self.poses or goal not in self.poses: return 0.0
+        (sx, sy), (gx, gy) = self.poses[start], self.poses[goal]
+        dx, dy = gx - sx, gy - sy
+        norm = math.hypot(dx, dy) or 1.0
+        return sum(dx * (self.poses[n][1] - sy) - dy * (self.poses[n][0] - sx) for n in inner) / (len(inner) * norm)
+
+
+def assign_sides(graph, paths):
+    """k-最短経路の候補を左・中央・右に割り当てます。候補が足りなければ中央の経路を使い回します。"""
+    if not paths: return None
+    center = paths[0]
+    rest = paths[1:]
+    left = next((p for p in rest if graph.side(p) > 0), None)
+    right = next((p for p in rest if graph.side(p) < 0 and p is not left), None)
+    # 座標がない・片側にしか候補がない場合は、残りを短い順に埋める
+    unused = [p for p in rest if p is not left and p is not right]
+    if left is None: left = unused.pop(0) if unused else center
+    if right is None: right = unused.pop(0) if unused else center
+    return {"route_left": left, "route_center": center, "route_right": right}
+
+
+class RouteTable:
+    """(出発地, 目的地) → 3経路と、その経路長の見積もり"""
+    def __init__(self):
+        self.patterns = {}   # {(出発地, 目的地): {"route_left": [経由地, ...], ...}}
+        self.lengths = {}    # {(出発地, 目的地): {"route_left": 経路長, ...}}
+        self.generated = 0   # 手書きの表になく、グラフから作った組の数
+
+    @classmethod
+    def build(cls, base_patterns, start_nodes, goal_nodes, poses=None, k=6, link_nearest=2):
+        """
+        Args:
+            base_patterns: 手書きの経路表 {(出発地, 目的地): {"route_left": [...], ...}}
+            start_nodes / goal_nodes: 経路を用意する出発地・目的地
+            poses: {地点名: (x, y)}。座標にあって表にない地点は、出発地・目的地の両方に加える
+            k: 1組あたりに出す候補経路の数
+            link_nearest: 新しい地点をつなぐ経由地の数
+        """
+        graph = RouteGraph(poses)
+        for (start, goal), pattern in base_patterns.items():
+            for key in ROUTE_KEYS:
+                graph.add_route(start, pattern.get(key, []), goal)
+
+        known = set(start_nodes) | set(goal_nodes) | graph.waypoints
+        new_nodes = sorted(name for name in graph.poses if name not in known)
+        for name in new_nodes:
+            graph.link_to_nearest(name, link_nearest)
+
+        table = cls()
+        for start in list(start_nodes) + new_nodes:
+            for goal in list(goal_nodes) + new_nodes:
+                if start == goal: continue
+                key = (start, goal)
+                if key in base_patterns:
+                    pattern = {name: list(base_patterns[key].get(name, [])) for name in ROUTE_KEYS}
+                    paths = {name: [start] + route + [goal] for name, route in pattern.items()}
+                else:
+                    paths = assign_sides(graph, graph.k_shortest_paths(start, goal, k))
+                    if paths is None:
+                        # つながっていなければ従来どおり直接向かう
+                        table.patterns[key] = empty_route()
+                        table.lengths[key] = {name: None for name in ROUTE_KEYS}
+                        continue
+                    pattern = {name: path[1:-1] for name, path in paths.items()}
+                    table.generated += 1
+                table.patterns[key] = pattern
+                table.lengths[key] = {name: round(graph.path_length(path), 2) for name, path in paths.items()}
+        return table
+
+    def get(self, start, goal):
+        return self.patterns.get((start, goal)) or empty_route()
+
+    def get_lengths(self, start, goal):
+        return self.lengths.get((start, goal)) or {name: None for name in ROUTE_KEYS}
+
+
+class RoutePlan:
+    """1つの (出発地, 目的地, 経路) の移動計画。地点の ID まで解決済み。"""
+    __slots__ = ("start", "destination", "route", "locations", "location_ids", "message", "payload", "length")
+
+    def __init__(self, start, destination, route, locations, length=None):
+        self.start = start
+        self.destination = destination
+        self.route = route
+        self.locations = locations  # 移動キューに積む地点 [{"id", "name", "pose"}, ...] (最後が目的地)
+        self.location_ids = [loc["id"] for loc in locations]
+        self.length = length
+        waypoint_names = [loc["name"] for loc in locations[:-1]]
+        if waypoint_names:
+            self.message = f"{' → '.join(waypoint_names)} を経由して {destination} へ向かいます！"
+        else:
+            self.message = f"{destination} へ直接向かいます！"
+        self.payload = {"type": "STARTING_MOVE", "message": self.message}
+
+    @property
+    def legs(self):
+        return len(self.locations)
+
+
+def compile_plans(table, locations):
+    """
+    経路表の全ての経路を、地点キャッシュの内容 {名前: {"id", "name", "pose"}} で移動計画にします。
+    Returns: ({(出発地, 目的地, 経路): RoutePlan}, マップにない地点の名前の set)
+    マップにない経由地は飛ばし、目的地がマップにない組は計画を作りません。
+    """
+    plans = {}
+    missing = set()
+    for (start, goal), pattern in table.patterns.items():
+        destination = locations.get(goal)
+        if destination is None:
+            missing.add(goal)
+            continue
+        lengths = table.lengths.get((start, goal), {})
+        for route, waypoint_names in pattern.items():
+            stops = []
+            for name in waypoint_names:
+                loc = locations.get(name)
+                if loc:
+                    stops.append(loc)
+                else:
+                    missing.add(name)
+            plans[(start, goal, route)] = RoutePlan(start, goal, route, stops + [destination], lengths.get(route))
+    return plans, missing
+
+
+class RoutePlanner:
+    """
+    1台のロボットの経路表。地点キャッシュ (LocationCache) の内容が変わったら、
+    読み込んだ座標で経路表を作り直します (座標が読めるまでは区間数で見積もった表を使う)。
+    作り直し (k-最短経路の計算) はイベントループを止めないよう別スレッドで行い、
+    できあがった経路表と移動計画を一度に差し替えます。それまでは前の表をそのまま引きます。
+    """
+    def __init__(self, base_patterns, start_nodes, goal_nodes, location_cache=None, k=6):
+        self.base_patterns = base_patterns
+        self.start_nodes = list(start_nodes)
+        self.goal_nodes = list(goal_nodes)
+        self.location_cache = location_cache
+        self.k = k
+        self.table = None
+        self.plans = {}      # {(出発地, 目的地, 経路): RoutePlan} (地点が読み込めるまでは空)
+        self.build_ms = 0.0
+        self.build_count = 0
+        self._built_version = None
+        self._dirty = False
+        self._building = asyncio.Lock()
+        self._refresh_task = None
+        self.rebuild()
+        if location_cache is not None:
+            location_cache.listeners.append(self.refresh)
+
+    def _version(self):
+        return None if self.location_cache is None else self.location_cache.version
+
+    def _snapshot(self):
+        # 地点キャッシュは更新時に dict を丸ごと差し替えるので、参照を取っておけば別スレッドから読んでよい
+        locations = {} if self.location_cache is None else self.location_cache.locations
+        return self._version(), locations, dict(self.base_patterns)
+
+    def _build(self, locations, base_patterns):
+        """経路表と移動計画を作ります (別スレッドで呼ばれるので self は書き換えない)。"""
+        poses = {name: loc["pose"] for name, loc in locations.items() if loc.get("pose")}
+        started = time.perf_counter()
+        table = RouteTable.build(base_patterns, self.start_nodes, self.goal_nodes, poses, self.k)
+        plans, missing = compile_plans(table, locations) if locations else ({}, set())
+        return table, plans, missing, len(poses), (time.perf_counter() - started) * 1000.0
+
+    def _apply(self, version, built):
+        table, plans, missing, n_poses, build_ms = built
+        # 経路表と移動計画は同時に差し替える (組み合わせの合わない表と計画を引かせない)
+        self.table, self.plans = table, plans
+        self.build_ms = build_ms
+        self.build_count += 1
+        self._built_version = version
+        print(f"🧭 Route table built: {len(table.patterns)} pairs "
+              f"({table.generated} generated, {n_poses} poses), {len(plans)} plans in {build_ms:.1f} ms")
+        if missing:
+            print(f"⚠️ Not on the current map (skipped in route plans): {', '.join(sorted(missing))}")
+
+    def rebuild(self):
+        """経路表をその場で作り直します (起動時など、イベントループの外で使う)。"""
+        self._dirty = False
+        version, locations, base_patterns = self._snapshot()
+        self._apply(version, self._build(locations, base_patterns))
+
+    async def refresh(self):
+        """地点キャッシュか経路表が更新されていれば、別スレッドで作り直して差し替えます。"""
+        async with self._building:
+            loop = asyncio.get_running_loop()
+            # 作り直している間にまた更新されたら、最新の内容でもう一度作る
+            while self._dirty or self._version() != self._built_version:
+                self._dirty = False
+                version, locations, base_patterns = self._snapshot()
+                built = await loop.run_in_executor(None, self._build, locations, base_patterns)
+                self._apply(version, built)
+
+    def invalidate(self):
+        """経路表 (base_patterns) を書き換えたときに呼ぶと、作り直します (イベントループ上ならバックグラウンドで)。"""
+        self._dirty = True
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.rebuild()
+            return
+        self._refresh_task = loop.create_task(self.refresh())
+
+    def current(self):
+        """今の経路表を返します (作り直しは待たない)。"""
+        return self.table
+
+    def get_plan(self, start, goal, route):
+        """
+        移動計画を返します。目的地がマップになければ None。
+        経路表にない組 (未登録の出発地など) や未知の経路は、目的地へ直接向かう計画にします。
+        この計画は保存しない (キーはクライアントが送ってくる値なので、保存すると際限なく増える)。
+        """
+        plan = self.plans.get((start, goal, route))
+        if plan is None:
+            destination = self.location_cache.get(goal) if self.location_cache else None
+            if destination is None: return None
+            plan = RoutePlan(start, goal, route, [destination])
+        return plan
+
+    def get(self, start, goal):
+        return self.current().get(start, goal)
+
+    def get_lengths(self, start, goal):
+        return self.current().get_lengths(start, goal)
+
+    def get_stats(self):
+        return {
+            "pairs": len(self.table.patterns),
+            "generated": self.table.generated,
+            "plans": len(self.plans),
+            "build_ms": round(self.build_ms, 2),
+            "build_count": self.build_count
+        }
@@ -0,0 +1,112 @@
+# servo_inbound.py
+# /ws/servo の受信側で、接続ごとにコマンドをまとめてから制御ループへ渡すためのキュー
+#
+# キーのオートリピートや再接続の嵐で同じコマンドが大量に届いても、
+#   - 直前と同じコマンドはその場で捨てる
+#   - 1ティックの間に届いたコマンドは軸ごとに最新の1つだけを残す
+#   - 受信キューは上限付きで、あふれたら軸ごとの最新だけを残して古いものを捨てる
+# ので、servo_lock を取る回数は接続あたり最大でティックごとに1回になります。
+
+import asyncio
+import time
+
+# 全接続の合計カウンタのキー
+INBOUND_STAT_FIELDS = ("received", "duplicates", "coalesced", "dropped", "batches", "applied", "errors")
+
+
+def new_inbound_stats():
+    return {field: 0 for field in INBOUND_STAT_FIELDS}
+
+
+class ServoInboundQueue:
+    """
+    1つの WebSocket 接続ぶんの受信キュー。
+    受信ループが put() し、run() のタスクがティックごとにまとめて apply(entries) を呼びます。
+    entries は [(user_id, axis, command, angle, received_at), ...] で、軸ごとに1つだけです。
+    received_at はそのコマンドの受信時刻 (time.monotonic()) で、遅延の計測に使います。
+    """
+    def __init__(self, apply, on_input=None, min_interval=0.01, maxsize=64, totals=None):
+        """
+        Args:
+            apply: まとめたコマンドを制御側に反映する関数 (ロックを取るのはここだけ)
+            on_input: 重複を除いたコマンドごとに呼ぶ軽い関数 (操作回数の集計など)
+            min_interval: apply を呼ぶ最短間隔 (秒)。制御周期に合わせる
+            maxsize: 受信キューの上限
+            totals: 全接続で共有する集計用の dict (new_inbound_stats())
+        """
+        self.apply = apply
+        self.on_input = on_input
+        self.min_interval = min_interval
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.last_received = {}
+        self.stats = new_inbound_stats()
+        self.totals = totals
+
+    def _count(self, field, n=1):
+        self.stats[field] += n
+        if self.totals is not None:
+            self.totals[field] += n
+
+    def put(self, user_id, axis, command, angle=None):
+        """受信したコマンドを1つ積みます。直前と同じなら捨てます。"""
+        received_at = time.monotonic()
+        self._count("received")
+        key = (user_id, axis)
+        value = (command, angle)
+        if self.last_received.get(key) == value:
+            self._count("duplicates")
+            return
+        self.last_received[key] = value
+        if self.on_input and command != "setpoint":
+            self.on_input(user_id, axis, command)
+
+        if self.queue.full():
+            # あふれたら軸ごとに最新の1つだけに詰め直し、上書きされた古いものを捨てる
+            latest = {}
+            size = self.queue.qsize()
+            while not self.queue.empty():
+                k, v = self.queue.get_nowait()
+                latest[k] = v
+            self._count("dropped", size - len(latest))
+            for k, v in latest.items():
+                self.queue.put_nowait((k, v))
+            if self.queue.full():
+                self.queue.get_nowait()
+                self._count("dropped")
+        self.queue.put_nowait((key, (value, received_at)))
+
+    def _drain(self, batch):
+        while not self.queue.empty():
+            key, value = self.queue.get_nowait()
+            if key in batch:
+                self._count("coalesced")
+            batch[key] = value
+        if not batch: return
+        try:
+            self.apply([
+                (user_id, axis, command, angle, received_at)
+                for (user_id, axis), ((command, angle), received_at) in batch.items()
+            ])
+        except Exception as e:
+            # 1つの不正な入力で run() のタスクが止まり、以降の入力がすべて無視されるのを防ぐ
+            print(f"🔥 Servo input apply error: {e}")
+            self._count("errors")
+            return
+        self._count("batches")
+        self._count("applied", len(batch))
+
+    def flush(self):
+        """残っているコマンドをすぐに反映します (切断時に最後の stop を取りこぼさないため)。"""
+        self._drain({})
+
+    async def run(self):
+        """キューを空にしながら、ティックごとに軸ごとの最新状態を apply に渡します。"""
+        while True:
+            key, value = await self.queue.get()
+            started = time.monotonic()
+            self._drain({key: value})
+
+            # 最初のコマンドはすぐに反映し、続きは次のティックまで溜めてまとめる
+            remaining = self.min_interval - (time.monotonic() - started)
+            if remaining > 0:
+                await asyncio.sleep(remaining)
@@ -0,0 +1,114 @@
+# servo_latency.py
+# /ws/servo でコマンドを受信してから、対応するフレームがシリアルに書き込まれるまでの遅延を区間ごとに計測します。
+#
+#   queue  : 受信 → 受信キューから制御側の状態に反映
+#   loop   : 反映 → 制御ループのティックがその状態を読み込む
+#   serial : ティック → そのサーボのフレームがシリアルに書き込まれる
+#   total  : 受信 → シリアル書き込み
+#
+# 軸 (ユーザー・軸) と区間ごとに直近の計測値を保持し、p50 / p95 / p99 を返します。
+
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+LATENCY_STAGES = ("queue", "loop", "serial", "total")
+
+
+class ServoLatencyTracker:
+    def __init__(self, window=1000, timeout=1.0):
+        """
+        Args:
+            window: 軸・区間ごとに保持する計測値の数
+            timeout: この秒数以内にシリアルへ書き込まれなかったコマンドは計測をあきらめる
+                     (停止中の軸への stop など、フレームが出ないコマンドのため)
+        """
+        self.window = window
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._samples = {}   # {(user_id, axis): {stage: deque(秒)}}
+        # {loop_id: [{"key", "received", "applied", "loop"}, ...]}
+        # 同じティックの前に同じ軸へ複数の入力が反映されることがある (複数クライアント) ので、全部を残す
+        self._pending = {}
+        self.expired = 0
+
+    def _record(self, key, stage, seconds):
+        stages = self._samples.get(key)
+        if stages is None:
+            stages = {name: deque(maxlen=self.window) for name in LATENCY_STAGES}
+            self._samples[key] = stages
+        stages[stage].append(seconds)
+
+    def mark_applied(self, loop_id, key, received_at):
+        """受信キューのコマンドを制御側の状態に反映した直後に呼びます。"""
+        now = time.monotonic()
+        with self._lock:
+            self._record(key, "queue", now - received_at)
+            self._pending.setdefault(loop_id, []).append(
+                {"key": key, "received": received_at, "applied": now, "loop": None}
+            )
+
+    def mark_loop(self):
+        """制御ループが状態を読み込んだティックで呼びます (servo_lock の内側)。"""
+        now = time.monotonic()
+        with self._lock:
+            for entries in self._pending.values():
+                for pending in entries:
+                    if pending["loop"] is None:
+                        pending["loop"] = now
+                        self._record(pending["key"], "loop", now - pending["applied"])
+
+    def mark_written(self, last_written):
+        """
+        シリアルへの書き込みを確認します。last_written(loop_id) はそのサーボの最終書き込み時刻を返す関数。
+        書き込みは書き込みスレッドで行われるため、次のティックの先頭で呼びます。
+        """
+        now = time.monotonic()
+        with self._lock:
+            for loop_id, entries in list(self._pending.items()):
+                written = last_written(loop_id)
+                remaining = []
+                for pending in entries:
+                    if pending["loop"] is not None and written is not None and written >= pending["loop"]:
+                        self._record(pending["key"], "serial", written - pending["loop"])
+                        self._record(pending["key"], "total", written - pending["received"])
+                    elif now - pending["received"] > self.timeout:
+                        self.expired += 1
+                    else:
+                        remaining.append(pending)
+                if remaining:
+                    self._pending[loop_id] = remaining
+                else:
+                    del self._pending[loop_id]
+
+    def get_stats(self):
+        """{user_id: {axis: {stage: {count, p50_ms, p95_ms, p99_ms, max_ms}}}} を返します。"""
+        with self._lock:
+            snapshot = {key: {stage: list(values) for stage, values in stages.items()}
+                        for key, stages in self._samples.items()}
+        result = {}
+        for (user_id, axis), stages in snapshot.items():
+            axis_stats = {}
+            for stage, values in stages.items():
+                if not values:
+                    axis_stats[stage] = {"count": 0}
+                    continue
+                ms = np.asarray(values) * 1000.0
+                p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+                axis_stats[stage] = {
+                    "count": len(values),
+                    "p50_ms": round(float(p50), 3),
+                    "p95_ms": round(float(p95), 3),
+                    "p99_ms": round(float(p99), 3),
+                    "max_ms": round(float(ms.max()), 3)
+                }
+            result.setdefault(user_id, {})[axis] = axis_stats
+        return result
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+            self._pending.clear()
+            self.expired = 0
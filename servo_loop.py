@@ -0,0 +1,132 @@
+# servo_loop.py
+
+import threading
+import time
+
+# ジッタのヒストグラムの区切り (ミリ秒)
+JITTER_BUCKETS_MS = (0.5, 1.0, 2.0, 5.0, 10.0, 20.0)
+
+
+class FixedRateTimer:
+    """
+    サーボ制御ループ用の固定周期タイマー。
+    time.monotonic() の締め切り時刻に対してスリープするため、処理時間の分だけ
+    周期が伸びることがありません。締め切りから大きく遅れた場合 (オーバーラン) は
+    取りこぼした周期を飛ばして次の締め切りを取り直します。
+    """
+    def __init__(self, interval=0.01, max_dt=None):
+        self.interval = interval
+        # 1ティックで進める経過時間の上限 (長時間停止後に角度が飛ぶのを防ぐ)
+        self.max_dt = max_dt if max_dt is not None else interval * 5
+        self._lock = threading.Lock()
+        self._next_deadline = None
+        self._last_tick = None
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self._lock:
+            self.ticks = 0
+            self.overruns = 0
+            self.jitter_sum = 0.0
+            self.jitter_max = 0.0
+            # 最後の要素は最大の区切りを超えたもの
+            self.histogram = [0] * (len(JITTER_BUCKETS_MS) + 1)
+            self.idle_count = 0
+            self.idle_time = 0.0
+            self._idle_started = None
+            # 周期の集計は最初に start() してから数える (インポート時に作ったタイマーで起動までの時間を数えない)
+            self._stats_started = time.monotonic() if self._next_deadline is not None else None
+
+    def start(self):
+        """締め切り時刻を現在時刻から取り直します。"""
+        now = time.monotonic()
+        with self._lock:
+            if self._stats_started is None:
+                self._stats_started = now
+        self._next_deadline = now + self.interval
+        self._last_tick = now
+
+    def wait(self):
+        """
+        次の締め切りまでスリープし、前回のティックからの実経過時間 (秒) を返します。
+        """
+        if self._next_deadline is None:
+            self.start()
+
+        remaining = self._next_deadline - time.monotonic()
+        if remaining > 0:
+            time.sleep(remaining)
+
+        now = time.monotonic()
+        lateness = now - self._next_deadline
+        overrun = lateness > self.interval
+
+        if overrun:
+            # 取りこぼした周期は詰めずに、現在時刻から取り直す
+            self._next_deadline = now + self.interval
+        else:
+            self._next_deadline += self.interval
+
+        dt = now - self._last_tick
+        self._last_tick = now
+        self._record(lateness, overrun)
+        return min(dt, self.max_dt)
+
+    def idle_until(self, event, timeout=None):
+        """
+        全軸が停止している間は固定周期をやめ、event がセットされるまでブロックします。
+        起床直後の wait() は待たずに返り、そこから固定周期に戻ります (起床したコマンドを1ティック待たせない)。
+        その dt は1周期分で、待機時間は含みません (起床したティックで1周期分動かし始める)。
+        event がセットされて起床した場合は True を返します。
+        """
+        with self._lock:
+            self._idle_started = time.monotonic()
+        woke = event.wait(timeout)
+        event.clear()
+        now = time.monotonic()
+        with self._lock:
+            self.idle_count += 1
+            self.idle_time += now - self._idle_started
+            self._idle_started = None
+        self._next_deadline = now
+        self._last_tick = now - self.interval
+        return woke
+
+    def _record(self, lateness, overrun):
+        jitter_ms = max(0.0, lateness) * 1000.0
+        index = len(JITTER_BUCKETS_MS)
+        for i, upper in enumerate(JITTER_BUCKETS_MS):
+            if jitter_ms <= upper:
+                index = i
+                break
+        with self._lock:
+            self.ticks += 1
+            if overrun:
+                self.overruns += 1
+            self.jitter_sum += jitter_ms
+            if jitter_ms > self.jitter_max:
+                self.jitter_max = jitter_ms
+            self.histogram[index] += 1
+
+    def get_stats(self):
+        """ジッタとオーバーランの集計を辞書で返します。"""
+        with self._lock:
+            # 待機中の時間を除いた実際の制御時間で周期を計算する
+            now = time.monotonic()
+            idle_time = self.idle_time
+            if self._idle_started is not None:
+                idle_time += now - self._idle_started
+            elapsed = 0.0 if self._stats_started is None else now - self._stats_started - idle_time
+            labels = [f"<={upper}ms" for upper in JITTER_BUCKETS_MS]
+            labels.append(f">{JITTER_BUCKETS_MS[-1]}ms")
+            return {
+                "interval_ms": self.interval * 1000.0,
+                "ticks": self.ticks,
+                "overruns": self.overruns,
+                "actual_rate_hz": round(self.ticks / elapsed, 2) if elapsed > 0 else 0.0,
+                "jitter_mean_ms": round(self.jitter_sum / self.ticks, 3) if self.ticks else 0.0,
+                "jitter_max_ms": round(self.jitter_max, 3),
+                "jitter_histogram": dict(zip(labels, self.histogram)),
+                "idle_count": self.idle_count,
+                "idle_time_s": round(idle_time, 3),
+            }
@@ -0,0 +1,116 @@
+# servo_motion.py
+
+import numpy as np
+
+# movement_states のコマンド → 回転方向
+COMMAND_DIRECTIONS = {"increase": 1.0, "decrease": -1.0, "stop": 0.0}
+
+
+class MotionProfile:
+    """
+    全サーボの台形速度プロファイル (加速 → 巡航 → 減速) を NumPy 配列でまとめて計算するクラス。
+    角度・速度・方向・可動範囲を配列で持ち、step(dt) 1回で全軸の次の目標角度を求めます。
+    サーボごとの if/elif 分岐はなく、軸の違いはすべて配列のパラメータで表現します。
+    """
+    def __init__(self, physical_ids, inverted_ids=(), cruise_velocity=40.0,
+                 acceleration=400.0, deceleration=600.0, min_angle=-40.0, max_angle=40.0,
+                 setpoint_velocity=None):
+        """
+        Args:
+            physical_ids: movement_states のキーとなるサーボIDの並び
+            inverted_ids: "increase" で角度が減る軸 (上下方向の軸)
+            cruise_velocity: 巡航速度 (度/秒)。スカラーまたは軸ごとの配列
+            acceleration: 加速度 (度/秒^2)
+            deceleration: 減速度 (度/秒^2)
+            min_angle, max_angle: 可動範囲 (度)
+            setpoint_velocity: 目標角度モードで目標へ向かうときの最高速度 (度/秒)。省略時は cruise_velocity
+        """
+        self.ids = list(physical_ids)
+        self.index = {p_id: i for i, p_id in enumerate(self.ids)}
+        n = len(self.ids)
+
+        self.angle = np.zeros(n)
+        self.velocity = np.zeros(n)
+        self.direction = np.zeros(n)
+        self.sign = np.array([-1.0 if p_id in inverted_ids else 1.0 for p_id in self.ids])
+
+        self.cruise = np.broadcast_to(np.asarray(cruise_velocity, dtype=float), (n,)).copy()
+        self.accel = np.broadcast_to(np.asarray(acceleration, dtype=float), (n,)).copy()
+        self.decel = np.broadcast_to(np.asarray(deceleration, dtype=float), (n,)).copy()
+        self.min_angle = np.broadcast_to(np.asarray(min_angle, dtype=float), (n,)).copy()
+        self.max_angle = np.broadcast_to(np.asarray(max_angle, dtype=float), (n,)).copy()
+        if setpoint_velocity is None:
+            setpoint_velocity = cruise_velocity
+        self.setpoint_cruise = np.broadcast_to(np.asarray(setpoint_velocity, dtype=float), (n,)).copy()
+
+        # 目標角度モードの目標 (サーボ側の角度)。NaN の軸は increase/decrease/stop で動かす
+        self.setpoint = np.full(n, np.nan)
+
+    def set_commands(self, states):
+        """movement_states ({physical_id: command}) から全軸の方向を更新します。"""
+        self.direction[:] = [COMMAND_DIRECTIONS.get(states.get(p_id), 0.0) for p_id in self.ids]
+
+    def set_directions(self, directions):
+        """方向の配列 (-1.0 / 0.0 / 1.0) をそのまま設定します (共有メモリからの読み込み用)。"""
+        self.direction[:] = directions
+
+    def set_setpoints(self, setpoints):
+        """
+        全軸の目標角度を設定します。None / NaN の軸は目標角度モードを解除します。
+        目標角度は "increase" の向きを正とする操作側の角度で、上下軸はここで符号を反転します。
+        """
+        values = np.array([np.nan if v is None else v for v in setpoints], dtype=float)
+        self.setpoint[:] = np.clip(values * self.sign, self.min_angle, self.max_angle)
+
+    def set_angle(self, physical_id, angle):
+        """外部から角度を設定した場合 (初期化など) に内部状態を合わせます。"""
+        i = self.index[physical_id]
+        self.angle[i] = angle
+        self.velocity[i] = 0.0
+
+    def is_active(self):
+        """動作指令中、減速中、または目標角度に未到達の軸が1つでもあれば True"""
+        return bool(np.any(self.direction != 0.0) or np.any(self.velocity != 0.0)
+                    or np.any(~np.isnan(self.setpoint) & (self.setpoint != self.angle)))
+
+    def step(self, dt):
+        """
+        dt 秒だけ全軸を進めます。
+        Returns:
+            (angle, moving): 更新後の角度配列と、このティックで角度が変化した軸のマスク
+        """
+        # 目標速度: 方向 × 巡航速度 (上下軸は符号反転)
+        target_v = self.direction * self.sign * self.cruise
+
+        # 目標角度モードの軸: 残り距離で止まり切れる速度 (v^2 = 2ad) で目標へ向かう
+        has_setpoint = ~np.isnan(self.setpoint)
+        error = np.where(has_setpoint, self.setpoint - self.angle, 0.0)
+        approach_v = np.sign(error) * np.minimum(self.setpoint_cruise, np.sqrt(2.0 * self.decel * np.abs(error)))
+        target_v = np.where(has_setpoint, approach_v, target_v)
+
+        # 可動範囲の端で止まり切れるよう、残り距離から速度上限をかける (v^2 = 2ad)
+        v_up = np.sqrt(2.0 * self.decel * np.maximum(self.max_angle - self.angle, 0.0))
+        v_down = np.sqrt(2.0 * self.decel * np.maximum(self.angle - self.min_angle, 0.0))
+        target_v = np.clip(target_v, -v_down, v_up)
+
+        # 速さを上げる方向なら加速度、下げる方向なら減速度で速度を目標に近づける
+        speeding_up = (target_v * self.velocity >= 0.0) & (np.abs(target_v) > np.abs(self.velocity))
+        max_dv = np.where(speeding_up, self.accel, self.decel) * dt
+        self.velocity += np.clip(target_v - self.velocity, -max_dv, max_dv)
+
+        previous = self.angle.copy()
+        self.angle += self.velocity * dt
+        np.clip(self.angle, self.min_angle, self.max_angle, out=self.angle)
+
+        # 端に到達した軸は速度を0にする
+        at_limit = ((self.angle >= self.max_angle) & (self.velocity > 0.0)) | \
+                   ((self.angle <= self.min_angle) & (self.velocity < 0.0))
+        self.velocity[at_limit] = 0.0
+
+        # 目標角度に到達した (または通り過ぎた) 軸は目標でぴたりと止める
+        arrived = has_setpoint & ((self.setpoint - previous) * (self.setpoint - self.angle) <= 0.0)
+        self.angle[arrived] = self.setpoint[arrived]
+        self.velocity[arrived] = 0.0
+
+        moving = self.angle != previous
+        return self.angle, moving
@@ -0,0 +1,209 @@
+# servo_process.py
+# サーボ制御ループを別プロセスで動かすためのモジュール
+#
+# FastAPI 側 (親プロセス) とは multiprocessing.shared_memory 上の配列だけで状態をやり取りするため、
+# Web側の処理 (Kachaka の gRPC 呼び出しやログ書き込み) が GIL を握っていても
+# サーボの制御周期は影響を受けません。
+
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from servo_motion import COMMAND_DIRECTIONS
+
+# 共有メモリ末尾に置く制御ループの統計
+STATS_FIELDS = ("ticks", "overruns", "actual_rate_hz", "jitter_mean_ms", "jitter_max_ms", "idle_time_s")
+
+
+class SharedServoState:
+    """
+    共有メモリ上の float64 配列。軸の数を n として
+    [0:n]    コマンド (movement_states を -1.0 / 0.0 / 1.0 に変換したもの) … 親が書き、子が読む
+    [n:2n]   指令角度 (current_angles)                                    … 子が書き、親が読む
+    [2n:3n]  読み戻した実際の角度 (未受信は NaN)                          … 子が書き、親が読む
+    [3n:4n]  目標角度モードの目標 (未設定は NaN)                          … 親が書き、子が読む
+    [4n:]    制御ループの統計 (STATS_FIELDS)                              … 子が書き、親が読む
+    """
+    def __init__(self, n, name=None):
+        size = (4 * n + len(STATS_FIELDS)) * 8
+        self.owner = name is None
+        self.shm = shared_memory.SharedMemory(name=name, create=self.owner, size=size)
+        array = np.ndarray((4 * n + len(STATS_FIELDS),), dtype=np.float64, buffer=self.shm.buf)
+        self.commands = array[0:n]
+        self.angles = array[n:2 * n]
+        self.measured = array[2 * n:3 * n]
+        self.setpoints = array[3 * n:4 * n]
+        self.stats = array[4 * n:]
+        if self.owner:
+            array[:] = 0.0
+            self.measured[:] = np.nan
+            self.setpoints[:] = np.nan
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def close(self):
+        # 配列のビューを先に手放してから共有メモリを閉じる
+        self.commands = self.angles = self.measured = self.setpoints = self.stats = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def servo_process_main(shm_name, spec, wakeup, stop):
+    """子プロセス側の制御ループ。spec の内容でサーボ・プロファイル・タイマーを組み立てます。"""
+    from Control import Control, position_to_angle
+    from servo_loop import FixedRateTimer
+    from servo_motion import MotionProfile
+    from servo_scheduler import ServoCommandScheduler
+
+    ids = spec["ids"]
+    state = SharedServoState(len(ids), name=shm_name)
+
+    # シリアルポートはこのプロセスでだけ開く
+    servos = {
+        entry["loop_id"]: Control(physical_id=entry["servo_id"], name=entry["name"], port=entry["port"])
+        for entry in spec["servos"]
+    }
+    targets = [servos[p_id] for p_id in ids]
+
+    profile = MotionProfile(
+        physical_ids=ids,
+        inverted_ids=spec["inverted_ids"],
+        cruise_velocity=spec["cruise_velocity"],
+        acceleration=spec["acceleration"],
+        deceleration=spec["deceleration"],
+        min_angle=spec["min_angle"],
+        max_angle=spec["max_angle"],
+        setpoint_velocity=spec["setpoint_velocity"]
+    )
+    tick_interval = spec["tick_interval"]
+    readback_every = spec["readback_every"]
+    idle_readback_interval = spec["idle_readback_interval"]
+    scheduler = ServoCommandScheduler(tick_interval=tick_interval)
+    timer = FixedRateTimer(interval=tick_interval)
+
+    print("⚙️ [Servo Process] Initializing Servos to Origin (0)...")
+    for servo in targets:
+        servo.move(0)
+
+    def read_measured():
+        for i, servo in enumerate(targets):
+            reading = servo.bus.measured.get(servo.physical_id)
+            if reading is not None:
+                state.measured[i] = position_to_angle(reading[0])
+
+    timer.start()
+    tick_count = 0
+    idle_polls = 0
+    try:
+        while not stop.is_set():
+            # 全軸が停止中ならコマンドが届くまで眠る (停止要求を見るため一定時間で起きる)
+            wakeup.clear()
+            profile.set_directions(state.commands)
+            profile.set_setpoints(state.setpoints)
+            if not profile.is_active():
+                if not timer.idle_until(wakeup, timeout=idle_readback_interval):
+                    # 眠っている間も一定間隔で1軸ずつ位置を読み戻す
+                    idle_polls += 1
+                    try:
+                        read_measured()
+                        scheduler.poll(targets[idle_polls % len(ids)])
+                        scheduler.dispatch()
+                    except Exception as e:
+                        print(f"Servo Process Loop Error: {e}")
+                continue
+
+            dt = timer.wait()
+            try:
+                profile.set_directions(state.commands)
+                profile.set_setpoints(state.setpoints)
+                angles, moving = profile.step(dt)
+                for i in np.flatnonzero(moving):
+                    targets[i].move(float(angles[i]), scheduler)
+                state.angles[:] = angles
+
+                # 書き込みスレッドが受信済みの応答を反映
+                read_measured()
+
+                tick_count += 1
+                if tick_count % readback_every == 0:
+                    i = (tick_count // readback_every) % len(ids)
+                    if not moving[i]:
+                        scheduler.poll(targets[i])
+
+                scheduler.dispatch()
+
+                if tick_count % 10 == 0:
+                    stats = timer.get_stats()
+                    state.stats[:] = [stats[field] for field in STATS_FIELDS]
+            except Exception as e:
+                print(f"Servo Process Loop Error: {e}")
+    finally:
+        state.close()
+
+
+class ServoProcess:
+    """
+    親プロセス側のハンドル。子プロセスの起動・停止と、共有メモリ経由の読み書きを行います。
+    Windows でも動くよう spawn で起動します。
+    """
+    def __init__(self, spec):
+        self.spec = spec
+        self.ids = list(spec["ids"])
+        self.index = {p_id: i for i, p_id in enumerate(self.ids)}
+        self.state = SharedServoState(len(self.ids))
+        ctx = multiprocessing.get_context("spawn")
+        self.wakeup = ctx.Event()
+        self.stop_event = ctx.Event()
+        self.process = ctx.Process(
+            target=servo_process_main,
+            args=(self.state.name, spec, self.wakeup, self.stop_event),
+            daemon=True
+        )
+
+    def start(self):
+        self.process.start()
+        print(f"✅ Servo control process started (PID: {self.process.pid})")
+
+    def stop(self):
+        self.stop_event.set()
+        self.wakeup.set()
+        self.process.join(timeout=2.0)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.state.close()
+
+    def set_command(self, p_id, command):
+        """movement_states の更新を共有メモリに書き込み、子プロセスを起こします。目標角度モードは解除します。"""
+        i = self.index.get(p_id)
+        if i is None: return
+        self.state.setpoints[i] = np.nan
+        self.state.commands[i] = COMMAND_DIRECTIONS.get(command, 0.0)
+        self.wakeup.set()
+
+    def set_setpoint(self, p_id, angle):
+        """目標角度を共有メモリに書き込み、子プロセスを起こします。"""
+        i = self.index.get(p_id)
+        if i is None: return
+        self.state.commands[i] = 0.0
+        self.state.setpoints[i] = angle
+        self.wakeup.set()
+
+    def read_angles(self):
+        """子プロセスが書いた指令角度を {p_id: 角度} で返します。"""
+        return {p_id: float(angle) for p_id, angle in zip(self.ids, self.state.angles)}
+
+    def read_measured(self):
+        """子プロセスが書いた実際の角度を {p_id: 角度 or None} で返します。"""
+        return {
+            p_id: (None if np.isnan(angle) else float(angle))
+            for p_id, angle in zip(self.ids, self.state.measured)
+        }
+
+    def get_timing_stats(self):
+        stats = {field: float(value) for field, value in zip(STATS_FIELDS, self.state.stats)}
+        stats["pid"] = self.process.pid
+        return stats
@@ -0,0 +1,92 @@
+# servo_protocol.py
+# /ws/servo 用のコンパクトなバイナリ形式
+#
+# JSON ({"user_id": ..., "axis": ..., "command": ...}) の代わりに、1コマンド = 1バイトで送れます。
+# WebSocket のサブプロトコル "servo.bin.v1" で接続すると、サーバーはバイナリ形式を受け付けたことを返します。
+# (サブプロトコルなしで接続しても、バイナリメッセージ自体は受け付けます)
+#
+#   bit 7    : 予約 (0)
+#   bit 3-6  : ユーザー番号 (0 = user_1, 1 = user_2, ...)
+#   bit 2    : 軸 (0 = horizontal, 1 = vertical)
+#   bit 0-1  : コマンド (0 = stop, 1 = increase, 2 = decrease)
+#
+# 1つのメッセージに複数バイトを並べると、押下/解放の連続を1回の送信でまとめて送れます。
+# ブラウザ側の例:
+#   const code = (userIndex << 3) | (axis === "vertical" ? 4 : 0) | {stop: 0, increase: 1, decrease: 2}[command];
+#   socket.send(new Uint8Array([code]));
+#
+# 目標角度 (ゲームパッド・ポインタからの絶対角度) は3バイトで送ります。ICS の位置フレームと同じ 7bit ずつの分割です。
+#   1バイト目: 0x80 | (ユーザー番号 << 3) | (軸 << 2)
+#   2-3バイト目: value = round(角度 * 100) + 8192 (0〜16383, ±81.92度, 0.01度刻み) の上位7bit / 下位7bit
+
+import math
+
+BINARY_SUBPROTOCOL = "servo.bin.v1"
+
+BINARY_USERS = ["user_1", "user_2"]
+BINARY_AXES = ["horizontal", "vertical"]
+BINARY_COMMANDS = ["stop", "increase", "decrease"]
+
+SETPOINT_FLAG = 0x80
+SETPOINT_SCALE = 100.0
+SETPOINT_OFFSET = 8192
+SETPOINT_FRAME_SIZE = 3
+
+def encode_command(user_id, axis, command):
+    """(user_id, axis, command) を1バイトに変換します。"""
+    return (BINARY_USERS.index(user_id) << 3) | (BINARY_AXES.index(axis) << 2) | BINARY_COMMANDS.index(command)
+
+def encode_setpoint(user_id, axis, angle):
+    """目標角度を3バイトに変換します。"""
+    header = SETPOINT_FLAG | (BINARY_USERS.index(user_id) << 3) | (BINARY_AXES.index(axis) << 2)
+    value = max(0, min(0x3FFF, int(round(angle * SETPOINT_SCALE)) + SETPOINT_OFFSET))
+    return bytes([header, (value >> 7) & 0x7F, value & 0x7F])
+
+def parse_setpoint(value):
+    """
+    JSON で届いた目標角度を float にします。数値 (または数値の文字列) でなければ None。
+    bool と NaN / 無限大も受け付けません。
+    """
+    if isinstance(value, bool): return None
+    try:
+        angle = float(value)
+    except (TypeError, ValueError):
+        return None
+    return angle if math.isfinite(angle) else None
+
+def _build_decode_table():
+    table = [None] * 256
+    for u, user_id in enumerate(BINARY_USERS):
+        for a, axis in enumerate(BINARY_AXES):
+            for c, command in enumerate(BINARY_COMMANDS):
+                table[(u << 3) | (a << 2) | c] = (user_id, axis, command, None)
+    return table
+
+# 1バイト → (user_id, axis, command, None)。未定義のコードは None
+DECODE_TABLE = _build_decode_table()
+
+def decode_commands(data):
+    """
+    バイナリメッセージを [(user_id, axis, command, angle), ...] に変換します。
+    目標角度は command = "setpoint" で angle に角度が入り、それ以外の angle は None です。
+    未定義のバイトと、途中で切れた目標角度は無視します。
+    """
+    entries = []
+    i = 0
+    n = len(data)
+    while i < n:
+        code = data[i]
+        if code & SETPOINT_FLAG:
+            if i + SETPOINT_FRAME_SIZE > n: break
+            # コマンドビットを 0 にすると (user_id, axis, "stop", None) が引ける
+            target = DECODE_TABLE[code & 0x7C]
+            if target is not None:
+                value = (data[i + 1] << 7) | data[i + 2]
+                entries.append((target[0], target[1], "setpoint", (value - SETPOINT_OFFSET) / SETPOINT_SCALE))
+            i += SETPOINT_FRAME_SIZE
+        else:
+            entry = DECODE_TABLE[code]
+            if entry is not None:
+                entries.append(entry)
+            i += 1
+    return entries
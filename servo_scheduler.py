@@ -0,0 +1,161 @@
+# servo_scheduler.py
+
+from Control import BAUDRATE, FRAME_SIZE, pack_position_frame
+
+# ICSのシリアル1バイトあたりのビット数
+# スタートビット(1) + データ(8) + パリティ(1) + ストップビット(1)
+BITS_PER_BYTE = 11
+
+def bus_bytes_per_tick(baudrate, tick_interval, utilization=0.8):
+    """
+    ボーレートから1ティックあたりにバスへ流せるバイト数を計算します。
+    utilization はバスを使い切らないための余裕 (0.0 ~ 1.0)。
+    """
+    bytes_per_sec = baudrate / BITS_PER_BYTE
+    return int(bytes_per_sec * tick_interval * utilization)
+
+
+class ServoCommandScheduler:
+    """
+    movement_states とシリアルポートの間に入るスケジューラ。
+    - 量子化後の位置 (フレーム) が前回送信時から変わったサーボだけを送る
+      (ただし止まっていたサーボが動き出したティックのフレームは、変化がなくても送る)
+    - 動作中のサーボを優先し、待たされた時間が長いものから送る
+    - バスごとに1ティックあたりのバイト数上限 (BAUDRATEから算出) を超えた分は次のティックに回す
+    - バスが送信に失敗して捨てたフレームは、次のティックで送り直す (送ったことにしない)
+    サーボは (バス, ID) で区別するため、複数のシリアルポートにまたがるサーボを
+    1つのスケジューラで扱えます。Control.move(angle, bus) の bus としてそのまま渡せます。
+    """
+    def __init__(self, tick_interval=0.01, baudrate=BAUDRATE, utilization=0.8):
+        self.byte_budget = max(FRAME_SIZE, bus_bytes_per_tick(baudrate, tick_interval, utilization))
+        self.last_sent = {}   # {(bus, physical_id): 最後に送信したフレーム}
+        self.pending = {}     # {(bus, physical_id): [フレーム, 動作中フラグ, 待ちティック数]}
+        self._forced = set()  # 変化がなくても送る (位置の読み戻し用) サーボ
+        self._starting = set()     # 動き出したティックのフレームを送る前のサーボ (抑制しない)
+        self._moving_now = set()   # このティックで動作中として登録されたサーボ
+        self._moving_prev = set()  # 前のティックで動作中として登録されたサーボ
+        self._buses = set()   # フレームを積んだことのあるバス (送信失敗の確認用)
+        self.stats = {"sent": 0, "suppressed": 0, "deferred": 0, "dropped": 0}
+
+    def add(self, bus, physical_id, position, moving=True):
+        """位置 (3500 ~ 11500) で送信候補を登録します。"""
+        frame = bytearray(FRAME_SIZE)
+        pack_position_frame(frame, 0, physical_id, position)
+        self.add_frame(bus, physical_id, bytes(frame), moving)
+
+    def add_frame(self, bus, physical_id, frame, moving=True):
+        """送信候補を登録します。同じティック内の再登録は最新のフレームで上書きします。"""
+        key = (bus, physical_id)
+        if moving:
+            # 加速の始めの数ティックは量子化の刻みより動かず前回と同じフレームになるが、
+            # 動き出しの1フレーム目は抑制せずに送る (抑制すると最初の送信がさらに1~2ティック遅れる)
+            if key not in self._moving_prev:
+                self._starting.add(key)
+            self._moving_now.add(key)
+        entry = self.pending.get(key)
+        if entry is None:
+            self.pending[key] = [frame, moving, 0]
+        else:
+            entry[0] = frame
+            entry[1] = moving
+
+    def submit(self, servo, frame, moving=True):
+        """Control.move(angle, bus) から呼ばれる入口。サーボの接続先バスに振り分けます。"""
+        self.add_frame(servo.bus, servo.physical_id, frame, moving)
+
+    def poll(self, servo):
+        """
+        最後に送った位置を再送し、サーボに現在位置を応答させます (読み戻し要求)。
+        動作中のサーボより優先度は低く、予算に空きがあるティックで送られます。
+        ICSは送信と応答が1本の線を共有する半二重なので、まとめ書きの途中のフレームへの応答は
+        後ろに続くフレームとぶつかって読めないことがあります。そのため読み戻し要求は
+        バスごとに1ティック1つまでとし、そのバスの write の最後に置きます (応答がぶつからない位置)。
+        """
+        key = (servo.bus, servo.physical_id)
+        frame = self.last_sent.get(key)
+        if frame is None or key in self.pending:
+            return False
+        self.pending[key] = [frame, False, 0]
+        self._forced.add(key)
+        return True
+
+    def invalidate(self, servo=None):
+        """前回送信位置を忘れ、次回は変化がなくても送信させます。"""
+        if servo is None:
+            self.last_sent.clear()
+        else:
+            self.last_sent.pop((servo.bus, servo.physical_id), None)
+
+    def _requeue_dropped(self):
+        """
+        書き込みスレッドが送信に失敗したフレームを送信済みから外し、同じフレームを送り直す候補に戻します。
+        (送信済みのままだと、角度が変わるまで同じフレームが抑制され、サーボが違う位置で止まったままになる)
+        """
+        for bus in self._buses:
+            for physical_id in bus.take_dropped():
+                key = (bus, physical_id)
+                frame = self.last_sent.pop(key, None)
+                self.stats["dropped"] += 1
+                if frame is not None and key not in self.pending:
+                    self.pending[key] = [frame, False, 0]
+
+    def dispatch(self):
+        """
+        バスごとの予算内で送信すべきフレームを各バスに積み、バスごとに1回の write で送信します。
+        送信を引き受けたバイト数の合計を返します。
+        """
+        self._requeue_dropped()
+        self._moving_prev = self._moving_now
+        self._moving_now = set()
+        if not self.pending:
+            return 0
+
+        # 動作中 → 待ち時間が長い順。読み戻し要求は応答を読めるよう、バスごとの write の最後に置く
+        order = sorted(
+            self.pending.items(),
+            key=lambda item: (item[0] in self._forced, not item[1][1], -item[1][2])
+        )
+
+        used = {}      # {bus: 積んだバイト数}
+        sent_keys = {} # {bus: [key, ...]}
+        polled = set() # このティックで読み戻し要求を積んだバス
+        for key, entry in order:
+            bus, physical_id = key
+            frame = entry[0]
+            if key not in self._forced and key not in self._starting and self.last_sent.get(key) == frame:
+                # 量子化後の位置が変わっていないので送らない
+                del self.pending[key]
+                self.stats["suppressed"] += 1
+                continue
+            bus_used = used.get(bus, 0)
+            if key in self._forced and bus in polled:
+                # 読み戻し要求はバスごとに1ティック1つまで (2つ目の応答は1つ目の後ろでぶつかる)
+                entry[2] += 1
+                continue
+            if bus_used + FRAME_SIZE > self.byte_budget:
+                # このバスは予算オーバー: 次のティックに持ち越し
+                entry[2] += 1
+                self.stats["deferred"] += 1
+                continue
+            bus.add_frame(physical_id, frame)
+            self._buses.add(bus)
+            self.last_sent[key] = frame
+            del self.pending[key]
+            self._starting.discard(key)
+            if key in self._forced:
+                self._forced.discard(key)
+                polled.add(bus)
+            sent_keys.setdefault(bus, []).append(key)
+            used[bus] = bus_used + FRAME_SIZE
+            self.stats["sent"] += 1
+
+        total = 0
+        for bus, keys in sent_keys.items():
+            # 実際の送信は各バスの書き込みスレッドが並行して行う
+            written = bus.commit()
+            if written < used[bus]:
+                # 送信失敗 (ポート未接続など): 次回は必ず送り直す
+                for key in keys:
+                    self.last_sent.pop(key, None)
+            total += written
+        return total
@@ -0,0 +1,198 @@
+# servo_simulator.py
+# 実機なしでサーボ経路の性能を測るための ICS サーボシミュレータ
+#
+# 使い方:
+#   python servo_simulator.py            # 疑似端末のパスが表示される
+#   SERVO_SERIAL_PORT=/dev/pts/N python unified_server.py
+
+import os
+import select
+import threading
+import time
+import tty
+from collections import deque
+
+from Control import BAUDRATE, FRAME_SIZE, position_to_angle
+from servo_scheduler import BITS_PER_BYTE
+
+
+class SimulatedServo:
+    """1つのICSサーボ。指令位置に向かって一定速度で動く"""
+    def __init__(self, physical_id, speed=6000.0):
+        self.physical_id = physical_id
+        self.speed = speed  # 位置単位/秒 (0 なら即座に到達)
+        self.position = 7500.0
+        self.target = 7500
+        self.last_update = time.monotonic()
+        self.frames = 0
+
+    def update(self, now):
+        dt = now - self.last_update
+        self.last_update = now
+        diff = self.target - self.position
+        if self.speed <= 0 or abs(diff) <= self.speed * dt:
+            self.position = float(self.target)
+        else:
+            self.position += self.speed * dt * (1 if diff > 0 else -1)
+
+    def command(self, position, now):
+        self.update(now)
+        # 位置0はフリー (脱力) 指令なので目標は変えない
+        if position != 0:
+            self.target = position
+        self.frames += 1
+        return int(self.position)
+
+
+class IcsServoSimulator:
+    """
+    Linux の疑似端末 (PTY) を開き、ICS位置コマンドを解釈する複数サーボのシミュレータ。
+    - 任意のIDのサーボを受け付ける (初めて届いたIDは自動で作成)
+    - ボーレートから1フレームあたりのバス占有時間を計算し、送信が詰まった場合の待ち時間を記録
+    - 送信のエコーと、現在位置の応答 (読み戻し) を任意で返す
+    """
+    def __init__(self, baudrate=BAUDRATE, echo=True, respond=True, servo_speed=6000.0, log_size=100000):
+        self.baudrate = baudrate
+        self.echo = echo
+        self.respond = respond
+        self.servo_speed = servo_speed
+        self.frame_time = FRAME_SIZE * BITS_PER_BYTE / baudrate
+
+        self.master_fd, self.slave_fd = os.openpty()
+        tty.setraw(self.slave_fd)
+        self.port_name = os.ttyname(self.slave_fd)
+
+        self.servos = {}
+        # 受信ログ (受信時刻 monotonic, ID, 位置)
+        self.frame_log = deque(maxlen=log_size)
+        self._lock = threading.Lock()
+        self._buffer = bytearray()
+        self._running = False
+        self._thread = None
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self._lock:
+            self.started = time.monotonic()
+            self.total_frames = 0
+            self.total_bytes = 0
+            self.writes = 0
+            self.bus_free_at = 0.0
+            self.queue_delay_sum = 0.0
+            self.queue_delay_max = 0.0
+            self.frame_log.clear()
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self.port_name
+
+    def stop(self):
+        self._running = False
+        if self._thread:
+            self._thread.join(timeout=1.0)
+        os.close(self.master_fd)
+        os.close(self.slave_fd)
+
+    def get_servo(self, physical_id):
+        servo = self.servos.get(physical_id)
+        if servo is None:
+            servo = SimulatedServo(physical_id, speed=self.servo_speed)
+            self.servos[physical_id] = servo
+        return servo
+
+    def _run(self):
+        while self._running:
+            try:
+                ready, _, _ = select.select([self.master_fd], [], [], 0.1)
+                if not ready:
+                    continue
+                data = os.read(self.master_fd, 4096)
+            except OSError:
+                break
+            now = time.monotonic()
+            replies = self._handle(data, now)
+            if replies:
+                os.write(self.master_fd, bytes(replies))
+
+    def _handle(self, data, now):
+        """受信データをフレームに分解し、返信するバイト列を返します。"""
+        self._buffer.extend(data)
+        buf = self._buffer
+        replies = bytearray()
+        i = 0
+        with self._lock:
+            self.writes += 1
+            self.total_bytes += len(data)
+            while len(buf) - i >= FRAME_SIZE:
+                head = buf[i]
+                if not head & 0x80:
+                    # コマンドの先頭ではないので同期を取り直す
+                    i += 1
+                    continue
+                physical_id = head & 0x1F
+                position = (buf[i + 1] << 7) | buf[i + 2]
+                frame = bytes(buf[i:i + FRAME_SIZE])
+                i += FRAME_SIZE
+
+                # バスのタイミング: 前のフレームの送信が終わるまで待たされる
+                start = max(now, self.bus_free_at)
+                delay = start - now
+                self.bus_free_at = start + self.frame_time
+                self.queue_delay_sum += delay
+                self.queue_delay_max = max(self.queue_delay_max, delay)
+
+                current = self.get_servo(physical_id).command(position, now)
+                self.total_frames += 1
+                self.frame_log.append((now, physical_id, position))
+
+                if self.echo:
+                    replies.extend(frame)
+                if self.respond:
+                    replies.extend((physical_id, (current >> 7) & 0x7F, current & 0x7F))
+            del buf[:i]
+        return replies
+
+    def frames_since(self, since, physical_id=None):
+        """since (monotonic) 以降に受信したフレームを返します。"""
+        with self._lock:
+            return [
+                entry for entry in self.frame_log
+                if entry[0] >= since and (physical_id is None or entry[1] == physical_id)
+            ]
+
+    def get_stats(self):
+        with self._lock:
+            elapsed = time.monotonic() - self.started
+            return {
+                "port": self.port_name,
+                "elapsed_s": round(elapsed, 3),
+                "frames": self.total_frames,
+                "bytes": self.total_bytes,
+                "writes": self.writes,
+                "frames_per_sec": round(self.total_frames / elapsed, 1) if elapsed > 0 else 0.0,
+                "writes_per_sec": round(self.writes / elapsed, 1) if elapsed > 0 else 0.0,
+                "bus_utilization": round(self.total_frames * self.frame_time / elapsed, 4) if elapsed > 0 else 0.0,
+                "queue_delay_mean_ms": round(self.queue_delay_sum / self.total_frames * 1000, 3) if self.total_frames else 0.0,
+                "queue_delay_max_ms": round(self.queue_delay_max * 1000, 3),
+                "servos": {
+                    p_id: {"frames": s.frames, "angle": round(position_to_angle(s.position), 2)}
+                    for p_id, s in self.servos.items()
+                },
+            }
+
+
+if __name__ == "__main__":
+    sim = IcsServoSimulator()
+    port = sim.start()
+    print(f"🤖 ICSサーボシミュレータを起動しました: {port}")
+    print(f"   サーバー側で SERVO_SERIAL_PORT={port} を指定してください。")
+    try:
+        while True:
+            time.sleep(5)
+            stats = sim.get_stats()
+            print(f"📊 {stats['frames_per_sec']} frames/s, {stats['writes_per_sec']} writes/s, "
+                  f"bus {stats['bus_utilization'] * 100:.2f}%, servos: {stats['servos']}")
+    except KeyboardInterrupt:
+        sim.stop()
@@ -0,0 +1,90 @@
+# tests/test_clock_sync.py
+
+import pytest
+
+import clock_sync
+from clock_sync import ClockSync, make_pong
+
+
+class FakeClock:
+    def __init__(self, ms=1000.0):
+        self.ms = ms
+
+    def __call__(self):
+        return self.ms
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(clock_sync, "now_ms", fake)
+    return fake
+
+
+def exchange(sync, clock, up_ms, down_ms, offset_ms, hold_ms=0.0, timestamps=True):
+    """PING を1往復させます。クライアントの時計はサーバーより offset_ms 進んでいる。"""
+    ping = sync.make_ping()
+    t1 = ping["t0"] + up_ms + offset_ms
+    t2 = t1 + hold_ms
+    clock.ms = ping["t0"] + up_ms + hold_ms + down_ms
+    pong = {"action": "PONG", "id": ping["id"]}
+    if timestamps:
+        pong.update(t1=t1, t2=t2)
+    rtt = sync.handle_pong(pong)
+    clock.ms += 100.0
+    return rtt
+
+
+def test_rtt_and_offset_from_four_timestamps(clock):
+    sync = ClockSync()
+    # クライアント側の処理時間 (t2 - t1) は RTT に含めない
+    assert exchange(sync, clock, 10.0, 10.0, 500.0, hold_ms=2.0) == pytest.approx(20.0)
+    assert sync.offset_ms == pytest.approx(500.0)
+    assert sync.to_server_time(clock.ms + 500.0) == pytest.approx(clock.ms / 1000.0)
+
+
+def test_offset_comes_from_lowest_rtt_sample(clock):
+    sync = ClockSync()
+    # 非対称な遅い往復はオフセットの誤差が大きい (誤差は片道の差の半分)
+    exchange(sync, clock, 50.0, 10.0, 500.0)
+    assert sync.offset_ms == pytest.approx(520.0)
+    exchange(sync, clock, 5.0, 5.0, 500.0)
+    exchange(sync, clock, 40.0, 10.0, 500.0)
+    assert sync.offset_ms == pytest.approx(500.0)
+    assert sync.rtt_ms == pytest.approx(50.0)
+    assert sync.get_stats()["rtt_min_ms"] == pytest.approx(10.0)
+
+
+def test_rtt_only_without_client_timestamps(clock):
+    sync = ClockSync()
+    assert exchange(sync, clock, 15.0, 15.0, 0.0, timestamps=False) == pytest.approx(30.0)
+    assert sync.offset_ms is None
+    assert sync.to_server_time(clock.ms) is None
+
+
+def test_unknown_or_repeated_pong_is_ignored(clock):
+    sync = ClockSync()
+    ping = sync.make_ping()
+    assert sync.handle_pong({"id": ping["id"] + 1}) is None
+    assert sync.handle_pong({"id": ping["id"]}) is not None
+    assert sync.handle_pong({"id": ping["id"]}) is None
+    assert sync.get_stats()["samples"] == 1
+
+
+def test_unanswered_pings_are_bounded(clock):
+    sync = ClockSync(window=4)
+    pings = [sync.make_ping() for _ in range(10)]
+    assert sync.handle_pong({"id": pings[0]["id"]}) is None
+    assert sync.handle_pong({"id": pings[-1]["id"]}) is not None
+
+
+def test_rtt_mean_is_smoothed(clock):
+    sync = ClockSync(smoothing=0.5)
+    exchange(sync, clock, 10.0, 10.0, 0.0)
+    exchange(sync, clock, 20.0, 20.0, 0.0)
+    assert sync.rtt_mean_ms == pytest.approx(30.0)
+
+
+def test_make_pong_echoes_client_t0(clock):
+    pong = make_pong({"action": "PING", "t0": 123.0}, received_ms=990.0)
+    assert pong == {"type": "PONG", "t0": 123.0, "t1": 990.0, "t2": clock.ms}
@@ -0,0 +1,76 @@
+# tests/test_control_frames.py
+
+import math
+import random
+
+from Control import FRAME_SIZE, FrameCache, IcsResponseParser, angle_to_position, pack_position_frame, position_to_angle
+
+
+def build_frame(physical_id, angle):
+    frame = bytearray(FRAME_SIZE)
+    pack_position_frame(frame, 0, physical_id, angle_to_position(angle))
+    return bytes(frame)
+
+
+def test_pack_position_frame():
+    assert build_frame(3, 0.0) == bytes([0x83, 7500 >> 7, 7500 & 0x7F])
+
+
+def test_lookup_rounds_to_resolution():
+    cache = FrameCache()
+    assert cache.lookup(1, 0.04) == build_frame(1, 0.0)
+    assert cache.lookup(1, 0.06) == build_frame(1, 0.1)
+    assert cache.lookup(1, -0.04) == build_frame(1, 0.0)
+    assert cache.lookup(1, -0.06) == build_frame(1, -0.1)
+    assert cache.lookup(1, 60.0) == build_frame(1, 60.0)
+    assert cache.lookup(1, -60.0) == build_frame(1, -60.0)
+
+
+def test_lookup_matches_direct_computation():
+    cache = FrameCache()
+    rng = random.Random(0)
+    for _ in range(2000):
+        angle = rng.uniform(-60.0, 60.0)
+        steps = math.floor(angle / cache.resolution + 0.5)
+        assert cache.lookup(5, angle) == build_frame(5, steps * cache.resolution)
+
+
+def test_lookup_out_of_range_is_computed():
+    cache = FrameCache()
+    assert cache.lookup(1, 75.0) == build_frame(1, 75.0)
+    assert cache.lookup(1, -75.0) == build_frame(1, -75.0)
+
+
+def test_tables_are_per_servo():
+    cache = FrameCache()
+    assert cache.lookup(1, 10.0)[0] == 0x81
+    assert cache.lookup(2, 10.0)[0] == 0x82
+    assert cache.lookup(1, 10.0)[1:] == cache.lookup(2, 10.0)[1:]
+
+
+def response(physical_id, position):
+    return bytes([physical_id, (position >> 7) & 0x7F, position & 0x7F])
+
+
+def test_parser_skips_echo():
+    parser = IcsResponseParser()
+    data = build_frame(1, 10.0) + response(1, 7833) + build_frame(2, 0.0) + response(2, 7500)
+    assert parser.feed(data) == [(1, 7833), (2, 7500)]
+
+
+def test_parser_keeps_partial_frames():
+    parser = IcsResponseParser()
+    data = build_frame(1, 0.0) + response(1, 8000)
+    assert parser.feed(data[:4]) == []
+    assert parser.feed(data[4:]) == [(1, 8000)]
+    assert parser.feed(b"") == []
+
+
+def test_parser_resyncs_on_unexpected_bytes():
+    parser = IcsResponseParser()
+    assert parser.feed(b"\x7f\x60" + response(3, 7000)) == [(3, 7000)]
+
+
+def test_position_to_angle_inverts_angle_to_position():
+    for angle in (-60.0, -12.3, 0.0, 30.0, 60.0):
+        assert abs(position_to_angle(angle_to_position(angle)) - angle) < 0.05
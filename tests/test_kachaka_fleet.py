@@ -0,0 +1,28 @@
+# tests/test_kachaka_fleet.py
+
+from kachaka_fleet import parse_robot_list
+
+DEFAULT_IP = "10.40.42.28"
+
+
+def test_empty_list_uses_default_robot():
+    assert parse_robot_list("", DEFAULT_IP) == [("kachaka", DEFAULT_IP)]
+    assert parse_robot_list(None, DEFAULT_IP) == [("kachaka", DEFAULT_IP)]
+    assert parse_robot_list(" , ", DEFAULT_IP) == [("kachaka", DEFAULT_IP)]
+
+
+def test_named_robots():
+    text = "rig_a=10.40.42.28, rig_b = 10.40.5.108"
+    assert parse_robot_list(text, DEFAULT_IP) == [("rig_a", "10.40.42.28"), ("rig_b", "10.40.5.108")]
+
+
+def test_ports_are_kept():
+    text = "sim_1=127.0.0.1:26400,sim_2=127.0.0.1:26401"
+    assert parse_robot_list(text, DEFAULT_IP) == [("sim_1", "127.0.0.1:26400"), ("sim_2", "127.0.0.1:26401")]
+
+
+def test_unnamed_robots_are_numbered():
+    assert parse_robot_list("127.0.0.1:26400,127.0.0.1:26401", DEFAULT_IP) == [
+        ("kachaka_1", "127.0.0.1:26400"),
+        ("kachaka_2", "127.0.0.1:26401"),
+    ]
@@ -0,0 +1,169 @@
+# tests/test_route_engine.py
+
+import asyncio
+import math
+
+import pytest
+
+from route_engine import (ROUTE_KEYS, RouteGraph, RoutePlanner, RouteTable, assign_sides, compile_plans,
+                          empty_route)
+
+# S → G の直線 (x 軸) に対して a が左、b が右、c が真ん中
+POSES = {
+    "S": (0.0, 0.0), "G": (10.0, 0.0),
+    "X": (10.0, 8.0), "Y": (0.0, 8.0),
+    "a": (5.0, 3.0), "b": (5.0, -3.0), "c": (5.0, 0.0),
+}
+BASE_PATTERNS = {
+    ("S", "X"): {"route_left": ["a"], "route_center": ["c"], "route_right": ["b"]},
+    ("Y", "G"): {"route_left": ["a"], "route_center": ["c"], "route_right": ["b"]},
+}
+
+
+def build_graph(poses=POSES):
+    graph = RouteGraph(poses)
+    for (start, goal), pattern in BASE_PATTERNS.items():
+        for key in ROUTE_KEYS:
+            graph.add_route(start, pattern[key], goal)
+    return graph
+
+
+def test_shortest_path_passes_only_through_waypoints():
+    graph = build_graph()
+    assert graph.shortest_path("S", "G") == ["S", "c", "G"]
+    # X は経由地ではないので S → X → ... とは通らない
+    assert graph.shortest_path("S", "Y") == ["S", "a", "Y"]
+    assert graph.shortest_path("S", "nowhere") is None
+
+
+def test_k_shortest_paths_are_sorted_unique_and_loopless():
+    graph = build_graph()
+    paths = graph.k_shortest_paths("S", "G", 6)
+    assert paths[0] == ["S", "c", "G"]
+    assert sorted(map(tuple, paths)) == [("S", "a", "G"), ("S", "b", "G"), ("S", "c", "G")]
+    lengths = [graph.path_length(path) for path in paths]
+    assert lengths == sorted(lengths)
+    assert all(len(set(path)) == len(path) for path in paths)
+    assert graph.k_shortest_paths("S", "G", 1) == [["S", "c", "G"]]
+    assert graph.k_shortest_paths("S", "nowhere", 3) == []
+
+
+def test_weights_fall_back_to_leg_count_without_poses():
+    graph = build_graph(poses={})
+    assert graph.path_length(["S", "a", "G"]) == 2.0
+    assert graph.path_length(["S", "a", "Y", "a"]) == 3.0
+
+
+def test_assign_sides_by_position():
+    graph = build_graph()
+    sides = assign_sides(graph, graph.k_shortest_paths("S", "G", 6))
+    assert sides == {
+        "route_left": ["S", "a", "G"],
+        "route_center": ["S", "c", "G"],
+        "route_right": ["S", "b", "G"],
+    }
+    assert assign_sides(graph, []) is None
+
+
+def test_assign_sides_reuses_center_when_short_of_candidates():
+    graph = build_graph()
+    sides = assign_sides(graph, [["S", "c", "G"]])
+    assert sides["route_left"] == sides["route_center"] == sides["route_right"] == ["S", "c", "G"]
+
+
+def test_build_keeps_hand_written_routes_and_generates_the_rest():
+    table = RouteTable.build(BASE_PATTERNS, ["S", "Y"], ["X", "G"], POSES)
+
+    # 手書きの表にある組はそのまま (実験条件)
+    assert table.get("S", "X") == BASE_PATTERNS[("S", "X")]
+    assert table.get("S", "G") == {"route_left": ["a"], "route_center": ["c"], "route_right": ["b"]}
+    assert table.get_lengths("S", "G")["route_center"] == 10.0
+    assert table.get_lengths("S", "G")["route_left"] == round(2 * math.hypot(5.0, 3.0), 2)
+    assert table.generated == 2  # (S, G) と (Y, X)
+
+
+def test_build_links_new_locations_to_nearest_waypoints():
+    poses = dict(POSES, N=(5.0, 10.0))
+    table = RouteTable.build(BASE_PATTERNS, ["S", "Y"], ["X", "G"], poses, link_nearest=1)
+    # 新しい地点 N は一番近い経由地 a につながり、出発地にも目的地にもなる
+    assert table.get("S", "N")["route_center"] == ["a"]
+    assert table.get("N", "G")["route_center"] == ["a"]
+    assert table.get_lengths("N", "X")["route_center"] == pytest.approx(7.0 + math.hypot(5.0, 5.0), abs=0.01)
+
+
+def test_unreachable_and_unknown_pairs_go_direct():
+    # Z は座標も経路もないので、どこにもつながらない
+    table = RouteTable.build(BASE_PATTERNS, ["S", "Z"], ["G"], POSES)
+    assert table.get("Z", "G") == empty_route()
+    assert table.get_lengths("Z", "G") == {key: None for key in ROUTE_KEYS}
+    assert table.get("nowhere", "G") == empty_route()
+
+
+def make_locations(names):
+    return {name: {"id": f"L{name}", "name": name, "pose": POSES.get(name)} for name in names}
+
+
+class FakeLocationCache:
+    """LocationCache の代わり。地点を差し替えるたびに version を上げます。"""
+    def __init__(self, locations):
+        self.locations = locations
+        self.version = 1
+        self.listeners = []
+
+    def replace(self, locations):
+        self.locations = locations
+        self.version += 1
+
+    def get(self, name):
+        return self.locations.get(name)
+
+
+def test_compile_plans_resolves_location_ids():
+    table = RouteTable.build(BASE_PATTERNS, ["S", "Y"], ["X", "G"], POSES)
+    plans, missing = compile_plans(table, make_locations(POSES))
+    assert missing == set()
+    assert len(plans) == len(table.patterns) * len(ROUTE_KEYS)
+
+    plan = plans[("S", "G", "route_left")]
+    assert plan.location_ids == ["La", "LG"]
+    assert plan.legs == 2
+    assert plan.length == table.get_lengths("S", "G")["route_left"]
+    assert plan.payload == {"type": "STARTING_MOVE", "message": "a を経由して G へ向かいます！"}
+
+
+def test_compile_plans_skips_locations_missing_from_the_map():
+    table = RouteTable.build(BASE_PATTERNS, ["S", "Y"], ["X", "G"], POSES)
+    plans, missing = compile_plans(table, make_locations(["S", "Y", "G", "b", "c"]))
+    assert missing == {"a", "X"}
+    # 経由地がマップになければ飛ばし、目的地がなければ計画を作らない
+    assert plans[("S", "G", "route_left")].location_ids == ["LG"]
+    assert plans[("S", "G", "route_left")].message == "G へ直接向かいます！"
+    assert ("S", "X", "route_left") not in plans
+
+
+def test_planner_rebuilds_when_locations_change():
+    cache = FakeLocationCache(make_locations(["S", "G", "a", "b", "c"]))
+    planner = RoutePlanner(BASE_PATTERNS, ["S"], ["G"], cache)
+    assert cache.listeners == [planner.refresh]
+    assert planner.get_plan("S", "G", "route_left").location_ids == ["La", "LG"]
+
+    cache.replace(dict(make_locations(["S", "G", "b", "c"]), a={"id": "La2", "name": "a", "pose": (5.0, 3.0)}))
+    asyncio.run(planner.refresh())
+    assert planner.build_count == 2
+    assert planner.get_plan("S", "G", "route_left").location_ids == ["La2", "LG"]
+
+    # 何も変わっていなければ作り直さない
+    asyncio.run(planner.refresh())
+    assert planner.build_count == 2
+
+
+def test_planner_fallback_plan_is_not_cached():
+    cache = FakeLocationCache(make_locations(["S", "G", "a", "b", "c"]))
+    planner = RoutePlanner(BASE_PATTERNS, ["S"], ["G"], cache)
+    plans = len(planner.plans)
+
+    plan = planner.get_plan("unknown", "G", "route_left")
+    assert plan.location_ids == ["LG"]
+    assert planner.get_plan("S", "G", "no_such_route").location_ids == ["LG"]
+    assert planner.get_plan("S", "nowhere", "route_left") is None
+    assert len(planner.plans) == plans
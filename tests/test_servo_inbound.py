@@ -0,0 +1,145 @@
+# tests/test_servo_inbound.py
+
+import asyncio
+
+from servo_inbound import ServoInboundQueue, new_inbound_stats
+
+
+class Recorder:
+    def __init__(self):
+        self.batches = []
+        self.inputs = []
+
+    def apply(self, entries):
+        self.batches.append([entry[:4] for entry in entries])
+
+    def on_input(self, user_id, axis, command):
+        self.inputs.append((user_id, axis, command))
+
+
+def test_duplicates_are_dropped_on_receive():
+    recorder = Recorder()
+    inbound = ServoInboundQueue(recorder.apply, recorder.on_input)
+    inbound.put("user_1", "horizontal", "increase")
+    inbound.put("user_1", "horizontal", "increase")
+    inbound.put("user_1", "vertical", "increase")
+
+    assert inbound.stats["received"] == 3
+    assert inbound.stats["duplicates"] == 1
+    assert inbound.queue.qsize() == 2
+    # 重複は操作回数にも数えない
+    assert recorder.inputs == [("user_1", "horizontal", "increase"), ("user_1", "vertical", "increase")]
+
+
+def test_flush_keeps_latest_command_per_axis():
+    recorder = Recorder()
+    inbound = ServoInboundQueue(recorder.apply)
+    inbound.put("user_1", "horizontal", "increase")
+    inbound.put("user_1", "vertical", "decrease")
+    inbound.put("user_1", "horizontal", "stop")
+    inbound.flush()
+
+    assert recorder.batches == [[
+        ("user_1", "horizontal", "stop", None),
+        ("user_1", "vertical", "decrease", None),
+    ]]
+    assert inbound.stats["coalesced"] == 1
+    assert inbound.stats["batches"] == 1
+    assert inbound.stats["applied"] == 2
+
+    inbound.flush()
+    assert len(recorder.batches) == 1
+
+
+def test_setpoints_are_deduplicated_by_angle():
+    recorder = Recorder()
+    inbound = ServoInboundQueue(recorder.apply, recorder.on_input)
+    inbound.put("user_1", "horizontal", "setpoint", 10.0)
+    inbound.put("user_1", "horizontal", "setpoint", 10.0)
+    inbound.put("user_1", "horizontal", "setpoint", 12.0)
+    inbound.flush()
+
+    assert inbound.stats["duplicates"] == 1
+    assert recorder.batches == [[("user_1", "horizontal", "setpoint", 12.0)]]
+    # 目標角度は操作回数に数えない
+    assert recorder.inputs == []
+
+
+def test_overflow_coalesces_per_axis():
+    recorder = Recorder()
+    inbound = ServoInboundQueue(recorder.apply, maxsize=4)
+    for command in ("increase", "stop", "increase", "stop"):
+        inbound.put("user_1", "horizontal", command)
+    assert inbound.queue.full()
+
+    # あふれたら軸ごとの最新だけに詰め直してから積む
+    inbound.put("user_1", "vertical", "increase")
+    assert inbound.stats["dropped"] == 3
+    assert inbound.queue.qsize() == 2
+
+    inbound.flush()
+    assert recorder.batches == [[
+        ("user_1", "horizontal", "stop", None),
+        ("user_1", "vertical", "increase", None),
+    ]]
+
+
+def test_overflow_with_distinct_axes_drops_oldest():
+    recorder = Recorder()
+    inbound = ServoInboundQueue(recorder.apply, maxsize=2)
+    inbound.put("user_1", "horizontal", "increase")
+    inbound.put("user_1", "vertical", "increase")
+    inbound.put("user_2", "horizontal", "increase")
+
+    assert inbound.stats["dropped"] == 1
+    inbound.flush()
+    assert recorder.batches == [[
+        ("user_1", "vertical", "increase", None),
+        ("user_2", "horizontal", "increase", None),
+    ]]
+
+
+def test_apply_error_is_counted_not_raised():
+    def apply(entries):
+        raise ValueError("bad input")
+
+    inbound = ServoInboundQueue(apply)
+    inbound.put("user_1", "horizontal", "increase")
+    inbound.flush()
+    assert inbound.stats["errors"] == 1
+    assert inbound.stats["batches"] == 0
+
+
+def test_totals_are_shared_between_connections():
+    totals = new_inbound_stats()
+    first = ServoInboundQueue(lambda entries: None, totals=totals)
+    second = ServoInboundQueue(lambda entries: None, totals=totals)
+    first.put("user_1", "horizontal", "increase")
+    second.put("user_2", "horizontal", "increase")
+    second.put("user_2", "horizontal", "increase")
+
+    assert totals["received"] == 3
+    assert totals["duplicates"] == 1
+    assert first.stats["received"] == 1
+
+
+def test_run_applies_first_command_immediately_then_batches():
+    recorder = Recorder()
+
+    async def scenario():
+        inbound = ServoInboundQueue(recorder.apply, min_interval=0.05)
+        task = asyncio.create_task(inbound.run())
+        inbound.put("user_1", "horizontal", "increase")
+        await asyncio.sleep(0.01)
+        assert recorder.batches == [[("user_1", "horizontal", "increase", None)]]
+
+        # 次のティックまでに届いたものは軸ごとに1つにまとめる
+        inbound.put("user_1", "horizontal", "stop")
+        inbound.put("user_1", "horizontal", "decrease")
+        await asyncio.sleep(0.1)
+        task.cancel()
+        return inbound
+
+    inbound = asyncio.run(scenario())
+    assert recorder.batches[1:] == [[("user_1", "horizontal", "decrease", None)]]
+    assert inbound.stats["coalesced"] == 1
@@ -0,0 +1,57 @@
+# tests/test_servo_latency.py
+
+import time
+
+from servo_latency import ServoLatencyTracker
+
+
+def test_records_every_stage():
+    tracker = ServoLatencyTracker()
+    received = time.monotonic()
+    tracker.mark_applied(1, ("user_1", "horizontal"), received)
+    tracker.mark_loop()
+    tracker.mark_written(lambda loop_id: time.monotonic())
+
+    stats = tracker.get_stats()["user_1"]["horizontal"]
+    assert all(stats[stage]["count"] == 1 for stage in ("queue", "loop", "serial", "total"))
+    assert stats["total"]["p50_ms"] >= stats["serial"]["p50_ms"]
+
+
+def test_keeps_every_input_applied_before_a_tick():
+    tracker = ServoLatencyTracker()
+    received = time.monotonic()
+    # 同じサーボへの2人分の入力が、同じティックの前に反映された
+    tracker.mark_applied(1, ("user_1", "horizontal"), received)
+    tracker.mark_applied(1, ("user_2", "horizontal"), received)
+    tracker.mark_loop()
+    tracker.mark_written(lambda loop_id: time.monotonic())
+
+    stats = tracker.get_stats()
+    assert stats["user_1"]["horizontal"]["total"]["count"] == 1
+    assert stats["user_2"]["horizontal"]["total"]["count"] == 1
+
+
+def test_waits_for_write_after_the_tick():
+    tracker = ServoLatencyTracker()
+    before = time.monotonic()
+    tracker.mark_applied(1, ("user_1", "vertical"), before)
+    tracker.mark_loop()
+
+    # ティックより前の書き込みはこの入力のフレームではない
+    tracker.mark_written(lambda loop_id: before)
+    assert tracker.get_stats()["user_1"]["vertical"]["total"] == {"count": 0}
+
+    tracker.mark_written(lambda loop_id: time.monotonic())
+    assert tracker.get_stats()["user_1"]["vertical"]["total"]["count"] == 1
+
+
+def test_unwritten_inputs_expire():
+    tracker = ServoLatencyTracker(timeout=0.0)
+    tracker.mark_applied(1, ("user_1", "horizontal"), time.monotonic() - 1.0)
+    tracker.mark_loop()
+    tracker.mark_written(lambda loop_id: None)
+    assert tracker.expired == 1
+
+    # あきらめた入力は、あとで書き込まれても計測しない
+    tracker.mark_written(lambda loop_id: time.monotonic())
+    assert tracker.get_stats()["user_1"]["horizontal"]["total"] == {"count": 0}
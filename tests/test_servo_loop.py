@@ -0,0 +1,77 @@
+# tests/test_servo_loop.py
+
+import threading
+import time
+
+import pytest
+
+from servo_loop import FixedRateTimer
+
+
+def test_wait_keeps_fixed_rate():
+    timer = FixedRateTimer(interval=0.01)
+    timer.start()
+    started = time.monotonic()
+    for _ in range(10):
+        dt = timer.wait()
+        assert 0.0 < dt <= timer.max_dt
+    # 締め切り基準なので、処理時間があっても10ティックで約100ms
+    assert time.monotonic() - started < 0.2
+    assert timer.get_stats()["ticks"] == 10
+
+
+def test_rate_is_counted_from_first_start():
+    timer = FixedRateTimer(interval=0.01)
+    assert timer.get_stats()["actual_rate_hz"] == 0.0
+
+    # 作ってから start() までの時間は周期の集計に入れない
+    time.sleep(0.1)
+    timer.start()
+    for _ in range(10):
+        timer.wait()
+    assert timer.get_stats()["actual_rate_hz"] > 50.0
+
+
+def test_overrun_resets_deadline():
+    timer = FixedRateTimer(interval=0.01)
+    timer.start()
+    time.sleep(0.05)
+    dt = timer.wait()
+    assert dt == timer.max_dt
+    assert timer.get_stats()["overruns"] == 1
+
+
+def test_idle_until_times_out_without_event():
+    timer = FixedRateTimer(interval=0.01)
+    timer.start()
+    assert timer.idle_until(threading.Event(), timeout=0.02) is False
+    stats = timer.get_stats()
+    assert stats["idle_count"] == 1
+    assert stats["idle_time_s"] >= 0.02
+
+
+def test_first_tick_after_wake_runs_immediately():
+    timer = FixedRateTimer(interval=0.01)
+    timer.start()
+    event = threading.Event()
+    event.set()
+    assert timer.idle_until(event) is True
+    assert not event.is_set()
+
+    # 起床直後のティックは待たず、dt は待機時間を含まない1周期分
+    started = time.monotonic()
+    dt = timer.wait()
+    assert time.monotonic() - started < 0.005
+    assert dt == pytest.approx(timer.interval, abs=0.005)
+    assert timer.wait() <= timer.interval * 2
+
+
+def test_idle_time_is_excluded_from_rate():
+    timer = FixedRateTimer(interval=0.01)
+    timer.start()
+    for _ in range(5):
+        timer.wait()
+    timer.idle_until(threading.Event(), timeout=0.2)
+    for _ in range(5):
+        timer.wait()
+    assert timer.get_stats()["actual_rate_hz"] > 50.0
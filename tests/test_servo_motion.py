@@ -0,0 +1,97 @@
+# tests/test_servo_motion.py
+
+import numpy as np
+import pytest
+
+from servo_motion import MotionProfile
+
+DT = 0.01
+
+
+def run_until_idle(profile, max_ticks=1000):
+    angles = []
+    for _ in range(max_ticks):
+        if not profile.is_active(): break
+        angle, _ = profile.step(DT)
+        angles.append(angle.copy())
+    assert not profile.is_active()
+    return np.array(angles)
+
+
+def test_accelerates_to_cruise_velocity():
+    profile = MotionProfile([1], cruise_velocity=40.0, acceleration=400.0)
+    assert not profile.is_active()
+    profile.set_commands({1: "increase"})
+
+    angle, moving = profile.step(DT)
+    assert profile.velocity[0] == pytest.approx(4.0)
+    assert angle[0] == pytest.approx(0.04)
+    assert moving[0]
+
+    for _ in range(20):
+        profile.step(DT)
+    assert profile.velocity[0] == pytest.approx(40.0)
+
+
+def test_inverted_axis_moves_the_other_way():
+    profile = MotionProfile([1, 2], inverted_ids=(2,))
+    profile.set_commands({1: "increase", 2: "increase"})
+    angle, _ = profile.step(DT)
+    assert angle[0] > 0.0
+    assert angle[1] == pytest.approx(-angle[0])
+
+
+def test_stop_decelerates_without_reversing():
+    profile = MotionProfile([1], cruise_velocity=40.0, acceleration=400.0, deceleration=600.0)
+    profile.set_commands({1: "increase"})
+    for _ in range(20):
+        profile.step(DT)
+
+    profile.set_commands({1: "stop"})
+    profile.step(DT)
+    assert profile.velocity[0] == pytest.approx(34.0)
+    angles = run_until_idle(profile)
+    # 40度/秒 から 600度/秒^2 で止まるまで約7ティック、角度は戻らない
+    assert len(angles) <= 7
+    assert np.all(np.diff(angles[:, 0]) >= 0.0)
+    assert profile.velocity[0] == 0.0
+
+
+def test_stops_at_range_limit():
+    profile = MotionProfile([1], min_angle=-5.0, max_angle=5.0)
+    profile.set_commands({1: "increase"})
+    angles = []
+    for _ in range(200):
+        angle, _ = profile.step(DT)
+        angles.append(angle[0])
+    assert max(angles) <= 5.0
+    assert angles[-1] == 5.0
+    assert profile.velocity[0] == 0.0
+
+
+def test_setpoint_arrives_exactly_without_overshoot():
+    profile = MotionProfile([1, 2], inverted_ids=(2,), setpoint_velocity=60.0)
+    profile.set_setpoints([10.0, 10.0])
+    angles = run_until_idle(profile)
+    assert profile.angle[0] == 10.0
+    # 上下軸は操作側の角度と符号が逆
+    assert profile.angle[1] == -10.0
+    assert angles[:, 0].max() == 10.0
+    assert np.all(np.abs(np.diff(angles, axis=0)) <= 60.0 * DT + 1e-9)
+
+
+def test_setpoint_is_clipped_to_range_and_can_be_cleared():
+    profile = MotionProfile([1], min_angle=-40.0, max_angle=40.0)
+    profile.set_setpoints([100.0])
+    assert profile.setpoint[0] == 40.0
+
+    profile.set_setpoints([None])
+    assert np.isnan(profile.setpoint[0])
+    assert not profile.is_active()
+
+
+def test_moving_mask_only_marks_changed_axes():
+    profile = MotionProfile([1, 2])
+    profile.set_commands({1: "decrease"})
+    _, moving = profile.step(DT)
+    assert moving.tolist() == [True, False]
@@ -0,0 +1,93 @@
+# tests/test_servo_protocol.py
+
+import pytest
+
+from servo_protocol import (BINARY_AXES, BINARY_COMMANDS, BINARY_USERS, SETPOINT_FRAME_SIZE,
+                            decode_commands, encode_command, encode_setpoint, parse_setpoint)
+
+
+def test_command_round_trip():
+    for user_id in BINARY_USERS:
+        for axis in BINARY_AXES:
+            for command in BINARY_COMMANDS:
+                code = encode_command(user_id, axis, command)
+                assert code < 0x80
+                assert decode_commands(bytes([code])) == [(user_id, axis, command, None)]
+
+
+def test_encoding_matches_documented_layout():
+    # (ユーザー番号 << 3) | (軸 << 2) | コマンド
+    assert encode_command("user_1", "horizontal", "stop") == 0b0000
+    assert encode_command("user_1", "vertical", "increase") == 0b0101
+    assert encode_command("user_2", "horizontal", "decrease") == 0b1010
+
+
+def test_several_commands_in_one_message():
+    data = bytes([
+        encode_command("user_1", "horizontal", "increase"),
+        encode_command("user_1", "horizontal", "stop"),
+        encode_command("user_2", "vertical", "decrease"),
+    ])
+    assert decode_commands(data) == [
+        ("user_1", "horizontal", "increase", None),
+        ("user_1", "horizontal", "stop", None),
+        ("user_2", "vertical", "decrease", None),
+    ]
+
+
+def test_undefined_bytes_are_ignored():
+    valid = encode_command("user_1", "vertical", "increase")
+    # コマンド 3 と未登録のユーザー番号は未定義
+    data = bytes([0b0011, valid, 0b1111000])
+    assert decode_commands(data) == [("user_1", "vertical", "increase", None)]
+    assert decode_commands(b"") == []
+    assert decode_commands(bytearray([valid])) == [("user_1", "vertical", "increase", None)]
+
+
+@pytest.mark.parametrize("angle", [-81.92, -40.0, -0.01, 0.0, 12.34, 40.0, 81.91])
+def test_setpoint_round_trip(angle):
+    data = encode_setpoint("user_2", "vertical", angle)
+    assert len(data) == SETPOINT_FRAME_SIZE
+    assert data[0] & 0x80 and not data[1] & 0x80 and not data[2] & 0x80
+    (entry,) = decode_commands(data)
+    assert entry[:3] == ("user_2", "vertical", "setpoint")
+    assert entry[3] == pytest.approx(angle)
+
+
+def test_setpoint_is_clamped_to_encodable_range():
+    assert decode_commands(encode_setpoint("user_1", "horizontal", 500.0))[0][3] == pytest.approx(81.91)
+    assert decode_commands(encode_setpoint("user_1", "horizontal", -500.0))[0][3] == pytest.approx(-81.92)
+
+
+def test_setpoints_mix_with_commands():
+    data = (encode_setpoint("user_1", "horizontal", 10.0)
+            + bytes([encode_command("user_1", "vertical", "stop")])
+            + encode_setpoint("user_1", "vertical", -5.5))
+    assert decode_commands(data) == [
+        ("user_1", "horizontal", "setpoint", 10.0),
+        ("user_1", "vertical", "stop", None),
+        ("user_1", "vertical", "setpoint", -5.5),
+    ]
+
+
+def test_truncated_setpoint_is_ignored():
+    stop = bytes([encode_command("user_1", "horizontal", "stop")])
+    data = stop + encode_setpoint("user_1", "horizontal", 10.0)[:2]
+    assert decode_commands(data) == [("user_1", "horizontal", "stop", None)]
+
+
+def test_setpoint_with_undefined_user_is_skipped_whole():
+    # 未登録のユーザー番号の目標角度は3バイトまとめて読み飛ばす (値のバイトをコマンドとして読まない)
+    undefined = bytes([0x80 | (7 << 3), 0x01, 0x01])
+    data = undefined + encode_setpoint("user_1", "horizontal", 1.0)
+    assert decode_commands(data) == [("user_1", "horizontal", "setpoint", 1.0)]
+
+
+@pytest.mark.parametrize("value, expected", [(12.5, 12.5), (-3, -3.0), ("7.25", 7.25), (0, 0.0)])
+def test_parse_setpoint_accepts_numbers(value, expected):
+    assert parse_setpoint(value) == expected
+
+
+@pytest.mark.parametrize("value", [None, True, False, "abc", "", [1.0], {"angle": 1}, "nan", float("nan"), float("inf"), "-inf"])
+def test_parse_setpoint_rejects_malformed(value):
+    assert parse_setpoint(value) is None
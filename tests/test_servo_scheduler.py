@@ -0,0 +1,227 @@
+# tests/test_servo_scheduler.py
+
+from Control import FRAME_SIZE
+from servo_scheduler import ServoCommandScheduler, bus_bytes_per_tick
+
+
+class FakeBus:
+    """ServoBus の代わり。積まれたフレームを記録し、commit() で書き込んだことにします。"""
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.frames = []
+        self.writes = []
+        self.dropped = set()
+
+    def add_frame(self, physical_id, frame):
+        self.frames.append((physical_id, frame))
+
+    def commit(self):
+        written = [] if self.fail else self.frames
+        self.writes.append(self.frames)
+        self.frames = []
+        return len(written) * FRAME_SIZE
+
+    def take_dropped(self):
+        dropped, self.dropped = self.dropped, set()
+        return dropped
+
+
+def frame(physical_id, value):
+    return bytes([0x80 | physical_id, value >> 7, value & 0x7F])
+
+
+def sent_ids(bus):
+    return [physical_id for physical_id, _ in bus.writes[-1]]
+
+
+def test_bus_bytes_per_tick():
+    # 115200bps / 11bit = 10472 バイト/秒 → 10ms で 104 バイト、8割で 83 バイト
+    assert bus_bytes_per_tick(115200, 0.01) == 83
+    assert bus_bytes_per_tick(115200, 0.01, utilization=1.0) == 104
+
+
+def test_unchanged_frame_is_suppressed():
+    scheduler = ServoCommandScheduler()
+    bus = FakeBus()
+    scheduler.add_frame(bus, 1, frame(1, 7500), moving=False)
+    assert scheduler.dispatch() == FRAME_SIZE
+
+    scheduler.add_frame(bus, 1, frame(1, 7500), moving=False)
+    assert scheduler.dispatch() == 0
+    assert scheduler.stats["suppressed"] == 1
+    assert len(bus.writes) == 1
+
+    scheduler.add_frame(bus, 1, frame(1, 7510), moving=False)
+    assert scheduler.dispatch() == FRAME_SIZE
+    assert scheduler.stats["sent"] == 2
+
+
+def test_reregistering_in_one_tick_keeps_latest_frame():
+    scheduler = ServoCommandScheduler()
+    bus = FakeBus()
+    scheduler.add_frame(bus, 1, frame(1, 7500))
+    scheduler.add_frame(bus, 1, frame(1, 7600))
+    scheduler.dispatch()
+    assert bus.writes == [[(1, frame(1, 7600))]]
+
+
+def test_byte_budget_defers_and_prioritizes_moving():
+    scheduler = ServoCommandScheduler()
+    scheduler.byte_budget = 2 * FRAME_SIZE
+    bus = FakeBus()
+    scheduler.add_frame(bus, 1, frame(1, 7500), moving=False)
+    scheduler.add_frame(bus, 2, frame(2, 7500), moving=True)
+    scheduler.add_frame(bus, 3, frame(3, 7500), moving=True)
+
+    assert scheduler.dispatch() == 2 * FRAME_SIZE
+    assert sorted(sent_ids(bus)) == [2, 3]
+    assert scheduler.stats["deferred"] == 1
+
+    # 持ち越したフレームは次のティックで送る
+    assert scheduler.dispatch() == FRAME_SIZE
+    assert sent_ids(bus) == [1]
+
+
+def test_deferred_frames_are_sent_oldest_first():
+    scheduler = ServoCommandScheduler()
+    scheduler.byte_budget = FRAME_SIZE
+    bus = FakeBus()
+    scheduler.add_frame(bus, 1, frame(1, 7500), moving=False)
+    scheduler.add_frame(bus, 2, frame(2, 7500), moving=False)
+    scheduler.dispatch()
+    assert sent_ids(bus) == [1]
+
+    # 持ち越した方が新しく登録されたものより先に送られる
+    scheduler.add_frame(bus, 3, frame(3, 7500), moving=False)
+    scheduler.dispatch()
+    assert sent_ids(bus) == [2]
+    scheduler.dispatch()
+    assert sent_ids(bus) == [3]
+
+
+def test_budget_is_per_bus():
+    scheduler = ServoCommandScheduler()
+    scheduler.byte_budget = FRAME_SIZE
+    bus_a, bus_b = FakeBus(), FakeBus()
+    scheduler.add_frame(bus_a, 1, frame(1, 7500))
+    scheduler.add_frame(bus_b, 1, frame(1, 7500))
+    assert scheduler.dispatch() == 2 * FRAME_SIZE
+    assert sent_ids(bus_a) == [1] and sent_ids(bus_b) == [1]
+
+
+def test_failed_commit_is_not_remembered_as_sent():
+    scheduler = ServoCommandScheduler()
+    bus = FakeBus(fail=True)
+    scheduler.add_frame(bus, 1, frame(1, 7500), moving=False)
+    assert scheduler.dispatch() == 0
+
+    bus.fail = False
+    scheduler.add_frame(bus, 1, frame(1, 7500), moving=False)
+    assert scheduler.dispatch() == FRAME_SIZE
+
+
+def test_dropped_frame_is_resent_next_tick():
+    scheduler = ServoCommandScheduler()
+    bus = FakeBus()
+    scheduler.add_frame(bus, 1, frame(1, 7500), moving=False)
+    scheduler.dispatch()
+
+    # 書き込みスレッドが送信に失敗した: 同じフレームを登録しなくても送り直す
+    bus.dropped.add(1)
+    assert scheduler.dispatch() == FRAME_SIZE
+    assert bus.writes[-1] == [(1, frame(1, 7500))]
+    assert scheduler.stats["dropped"] == 1
+
+
+def test_dropped_frame_yields_to_newer_frame():
+    scheduler = ServoCommandScheduler()
+    bus = FakeBus()
+    scheduler.add_frame(bus, 1, frame(1, 7500), moving=False)
+    scheduler.dispatch()
+
+    bus.dropped.add(1)
+    scheduler.add_frame(bus, 1, frame(1, 7600), moving=False)
+    scheduler.dispatch()
+    assert bus.writes[-1] == [(1, frame(1, 7600))]
+
+
+def test_first_frame_of_motion_start_is_not_suppressed():
+    scheduler = ServoCommandScheduler()
+    bus = FakeBus()
+    scheduler.add_frame(bus, 1, frame(1, 7500), moving=False)
+    scheduler.dispatch()
+
+    # 動き出したティックは量子化後の位置が同じでも送る
+    scheduler.add_frame(bus, 1, frame(1, 7500), moving=True)
+    assert scheduler.dispatch() == FRAME_SIZE
+
+    # 動作中の2ティック目以降は、変化がなければ抑制する
+    scheduler.add_frame(bus, 1, frame(1, 7500), moving=True)
+    assert scheduler.dispatch() == 0
+    assert scheduler.stats["suppressed"] == 1
+
+
+def test_motion_start_edge_survives_deferral():
+    scheduler = ServoCommandScheduler()
+    scheduler.byte_budget = FRAME_SIZE
+    bus = FakeBus()
+    scheduler.add_frame(bus, 1, frame(1, 7500), moving=False)
+    scheduler.add_frame(bus, 2, frame(2, 7500), moving=False)
+    scheduler.dispatch()
+    scheduler.dispatch()
+
+    scheduler.add_frame(bus, 1, frame(1, 7500), moving=True)
+    scheduler.add_frame(bus, 2, frame(2, 7500), moving=True)
+    scheduler.dispatch()
+    # 予算で持ち越した方も、次のティックで動作中として再登録されたら送る
+    scheduler.add_frame(bus, 1, frame(1, 7500), moving=True)
+    scheduler.add_frame(bus, 2, frame(2, 7500), moving=True)
+    assert scheduler.dispatch() == FRAME_SIZE
+    assert sorted(physical_id for write in bus.writes[-2:] for physical_id, _ in write) == [1, 2]
+
+
+class FakeServo:
+    def __init__(self, bus, physical_id):
+        self.bus = bus
+        self.physical_id = physical_id
+
+
+def test_poll_resends_last_frame():
+    scheduler = ServoCommandScheduler()
+    bus = FakeBus()
+    servo = FakeServo(bus, 1)
+    # 一度も送っていないサーボは読み戻せない
+    assert scheduler.poll(servo) is False
+
+    scheduler.add_frame(bus, 1, frame(1, 7500), moving=False)
+    scheduler.dispatch()
+    assert scheduler.poll(servo) is True
+    assert scheduler.dispatch() == FRAME_SIZE
+    assert bus.writes[-1] == [(1, frame(1, 7500))]
+
+
+def test_poll_is_skipped_while_frame_is_pending():
+    scheduler = ServoCommandScheduler()
+    bus = FakeBus()
+    scheduler.add_frame(bus, 1, frame(1, 7500), moving=False)
+    scheduler.dispatch()
+    scheduler.add_frame(bus, 1, frame(1, 7600), moving=False)
+    assert scheduler.poll(FakeServo(bus, 1)) is False
+
+
+def test_poll_is_last_and_one_per_bus():
+    scheduler = ServoCommandScheduler()
+    bus = FakeBus()
+    for physical_id in (1, 2, 3):
+        scheduler.add_frame(bus, physical_id, frame(physical_id, 7500), moving=False)
+    scheduler.dispatch()
+
+    scheduler.poll(FakeServo(bus, 1))
+    scheduler.poll(FakeServo(bus, 2))
+    scheduler.add_frame(bus, 3, frame(3, 7600), moving=True)
+    scheduler.dispatch()
+    # 応答が後ろのフレームとぶつからないよう、読み戻し要求は write の最後に1つだけ
+    assert sent_ids(bus) == [3, 1]
+
+    scheduler.dispatch()
+    assert sent_ids(bus) == [2]
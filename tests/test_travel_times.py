@@ -0,0 +1,132 @@
+# tests/test_travel_times.py
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from travel_times import TravelTimeEstimator
+
+HEADER = "Timestamp,User_ID,Action_Type,Value_1,Value_2,Current_Selector,Robot_Location\n"
+STARTED = datetime(2025, 12, 26, 14, 0, 0)
+
+
+def row(seconds, action, value_1, value_2, location):
+    at = (STARTED + timedelta(seconds=seconds)).strftime('%Y-%m-%d %H:%M:%S.%f')
+    return f"{at},SYSTEM,{action},{value_1},{value_2},user_1,{location}\n"
+
+
+def trip(at, start, destination, route, waypoints, seconds_per_leg=10.0):
+    """start から waypoints を経由して destination へ向かう移動1回分の行"""
+    rows = [row(at, "START_MOVING", f"To: {destination}", f"Route: {route}", start)]
+    for i, waypoint in enumerate(waypoints, 1):
+        rows.append(row(at + i * seconds_per_leg, "WAYPOINT_ARRIVED", f"At: {waypoint}", "", waypoint))
+    total = (len(waypoints) + 1) * seconds_per_leg
+    rows.append(row(at + total, "TIME_TRAVEL", total, f"To: {destination}", destination))
+    return "".join(rows)
+
+
+def test_ingest_reads_trips_and_legs(tmp_path):
+    path = tmp_path / "baseline_metrics_1.csv"
+    path.write_text(HEADER + trip(0, "dock", "10", "route_center", ["b", "d"]), encoding="utf-8")
+    estimator = TravelTimeEstimator()
+
+    assert estimator.ingest([str(path)]) == 1
+    assert estimator.routes[("dock", "10", "route_center")].mean == pytest.approx(30.0)
+    assert estimator.total_legs == 3
+    assert estimator.legs[("dock", "b")].mean == pytest.approx(10.0)
+    assert estimator.legs[("d", "10")].mean == pytest.approx(10.0)
+
+
+def test_ingest_reads_only_appended_rows(tmp_path):
+    path = tmp_path / "log.csv"
+    path.write_text(HEADER + trip(0, "dock", "10", "route_left", ["a"]), encoding="utf-8")
+    estimator = TravelTimeEstimator()
+    assert estimator.ingest([str(path)]) == 1
+    assert estimator.ingest([str(path)]) == 0
+
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(trip(100, "10", "5", "route_right", ["e", "c"]))
+    assert estimator.ingest([str(path)]) == 1
+    assert estimator.get_stats()["trips"] == 2
+
+
+def test_partial_last_line_waits_for_the_rest(tmp_path):
+    path = tmp_path / "log.csv"
+    text = HEADER + trip(0, "dock", "10", "route_left", ["a"])
+    path.write_text(text[:-5], encoding="utf-8")
+    estimator = TravelTimeEstimator()
+    assert estimator.ingest([str(path)]) == 0
+
+    path.write_text(text, encoding="utf-8")
+    assert estimator.ingest([str(path)]) == 1
+
+
+def test_truncated_file_is_read_from_the_start(tmp_path):
+    path = tmp_path / "log.csv"
+    path.write_text(HEADER + trip(0, "dock", "10", "route_left", ["a"]) + trip(100, "10", "dock", "route_left", ["a"]),
+                    encoding="utf-8")
+    estimator = TravelTimeEstimator()
+    assert estimator.ingest([str(path)]) == 2
+
+    path.write_text(HEADER + trip(500, "dock", "5", "route_center", []), encoding="utf-8")
+    assert estimator.ingest([str(path)]) == 1
+    assert ("dock", "5", "route_center") in estimator.routes
+
+
+def test_rewritten_file_is_read_again(tmp_path):
+    path = tmp_path / "log.csv"
+    path.write_text(HEADER + trip(0, "dock", "10", "route_left", ["a"]), encoding="utf-8")
+    estimator = TravelTimeEstimator()
+    assert estimator.ingest([str(path)]) == 1
+
+    # 同じ名前で作り直され (最初の行の時刻が違う)、前より長くなったファイル
+    path.write_text(HEADER + trip(3600, "dock", "10", "route_left", ["a"]) + trip(3700, "10", "3", "route_right", []),
+                    encoding="utf-8")
+    assert estimator.ingest([str(path)]) == 2
+    assert estimator.get_stats()["trips"] == 3
+
+
+def test_time_travel_for_another_destination_is_ignored(tmp_path):
+    path = tmp_path / "log.csv"
+    text = (HEADER + row(0, "START_MOVING", "To: 10", "Route: route_left", "dock")
+            + row(20, "TIME_TRAVEL", 20.0, "To: 5", "5"))
+    path.write_text(text, encoding="utf-8")
+    estimator = TravelTimeEstimator()
+    assert estimator.ingest([str(path)]) == 0
+
+
+def test_missing_file_is_reported_not_raised(tmp_path):
+    estimator = TravelTimeEstimator()
+    assert estimator.ingest([str(tmp_path / "missing.csv")]) == 0
+
+
+def test_estimate_shrinks_toward_per_leg_prior():
+    estimator = TravelTimeEstimator(prior_weight=2.0)
+    estimator.add_trip("A", "B", "route_left", 30.0, legs=3)
+    estimator.add_trip("A", "C", "route_center", 10.0, legs=1)
+    # 全体の1区間あたりの平均: 40秒 / 4区間 = 10秒
+
+    assert estimator.estimate("A", "B", "route_left", legs=3) == pytest.approx(30.0)
+    assert estimator.estimate("A", "B", "route_left", legs=1) == pytest.approx((30.0 + 2 * 10.0) / 3)
+    # 記録がない組は区間数だけで見積もる
+    assert estimator.estimate("X", "Y", "route_right", legs=2) == pytest.approx(20.0)
+    # 区間数が分からなければ、その組 (なければ全体) の平均に向けて縮める
+    assert estimator.estimate("A", "B", "route_right") == pytest.approx(30.0)
+    assert estimator.estimate("X", "Y", "route_right") == pytest.approx(20.0)
+    assert TravelTimeEstimator().estimate("A", "B", "route_left") is None
+
+
+def test_estimate_routes_counts_legs_from_waypoints():
+    estimator = TravelTimeEstimator()
+    estimator.add_trip("A", "B", "route_center", 20.0, legs=2)
+    etas = estimator.estimate_routes("A", "C", {"route_left": ["a", "b"], "route_center": [], "route_right": ["c"]})
+    assert etas == {"route_left": 30.0, "route_center": 10.0, "route_right": 20.0}
+
+
+def test_estimate_leg_shrinks_toward_mean_leg():
+    estimator = TravelTimeEstimator(prior_weight=2.0)
+    assert estimator.estimate_leg("a", "b") is None
+    estimator.add_trip("A", "B", "route_center", 40.0, legs=4)
+    estimator.add_leg("a", "b", 25.0)
+    assert estimator.estimate_leg("a", "b") == pytest.approx((25.0 + 2 * 10.0) / 3)
+    assert estimator.estimate_leg("b", "c") == pytest.approx(10.0)
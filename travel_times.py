@@ -0,0 +1,213 @@
+# travel_times.py
+# 記録済みのメトリクスCSV (baseline_metrics_*.csv / experiment_metrics_*.csv) から
+# (出発地, 目的地, 経路) ごとの移動時間を学習し、経路の選択肢に到着までの見込み時間 (ETA) を付けるモジュール
+#
+# 1回の移動は START_MOVING (出発地 = Robot_Location, "To: 目的地", "Route: 経路") から
+# TIME_TRAVEL (Value_1 = 移動時間の秒数) までで、その間の WAYPOINT_ARRIVED の数から区間数も数えます。
+# CSVはファイルごとに読み終えた位置を覚えておき、2回目以降は追記された行だけを読みます。
+# 読み終えた位置はファイルの実体 (デバイス, inode) と先頭の数百バイトと組にしておき、
+# 同じ名前で作り直されたファイルや切り詰められたファイルは最初から読み直します
+# (inode は削除後に使い回されることがあるので、最初の行の時刻を含む先頭部分も比べる)。
+# 実験中も、移動が終わるたびに自分のログファイルを読み足せば見込み時間がその場で更新されます。
+# ingest() はファイルを読むので、サーバーからは別スレッド (run_in_executor) で呼びます (呼び出しどうしはロックで順番に)。
+#
+# 区間 (START_MOVING / WAYPOINT_ARRIVED の地点から次の WAYPOINT_ARRIVED / TIME_TRAVEL の地点まで) ごとの
+# 所要時間も行の時刻から求めておき、移動中の1区間の待ち時間の上限を決めるのに使います。
+#
+# 見込み時間は、その (出発地, 目的地, 経路) の平均を、区間数 × 全体の1区間あたりの平均時間に向けて
+# 縮めた値です (記録が少ない組でも極端な値にならないように)。記録がない組は後者だけで見積もります。
+
+import csv
+import glob
+import io
+import os
+import threading
+from datetime import datetime
+
+HEAD_BYTES = 256  # ファイルが入れ替わっていないか確かめるために覚えておく先頭のバイト数
+COLUMNS = ["Timestamp", "User_ID", "Action_Type", "Value_1", "Value_2", "Current_Selector", "Robot_Location"]
+
+
+def _strip_prefix(text, prefix):
+    text = (text or "").strip()
+    return text[len(prefix):].strip() if text.startswith(prefix) else text
+
+
+class _Mean:
+    """件数と平均 (1件ずつ更新)"""
+    __slots__ = ("count", "mean")
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+
+    def add(self, value):
+        self.count += 1
+        self.mean += (value - self.mean) / self.count
+
+
+class TravelTimeEstimator:
+    def __init__(self, prior_weight=2.0):
+        """
+        Args:
+            prior_weight: 区間数からの見積もりを何件分の記録として扱うか (大きいほど記録の少ない組の平均を信用しない)
+        """
+        self.prior_weight = prior_weight
+        self.routes = {}          # {(出発地, 目的地, 経路): _Mean}
+        self.pairs = {}           # {(出発地, 目的地): _Mean} (経路を問わない)
+        self.legs = {}            # {(区間の出発地, 到着地): _Mean}
+        self.overall = _Mean()
+        self.total_seconds = 0.0  # 区間数が分かっている移動の合計時間と合計区間数
+        self.total_legs = 0
+        self._offsets = {}        # {ファイル: ((デバイス, inode), 先頭のバイト列, 読み終えたバイト位置)}
+        self._columns = {}        # {ファイル: 列名 → 列番号}
+        self._pending = {}        # {ファイル: 移動中の START_MOVING}
+        self._ingesting = threading.Lock()
+
+    def add_trip(self, start, destination, route, seconds, legs=None):
+        """移動1回分の記録を加えます。"""
+        if seconds <= 0: return
+        self.routes.setdefault((start, destination, route), _Mean()).add(seconds)
+        self.pairs.setdefault((start, destination), _Mean()).add(seconds)
+        self.overall.add(seconds)
+        if legs:
+            self.total_seconds += seconds
+            self.total_legs += legs
+
+    def add_leg(self, start, goal, seconds):
+        """1区間分の記録を加えます。"""
+        if seconds <= 0 or start == goal: return
+        self.legs.setdefault((start, goal), _Mean()).add(seconds)
+
+    def ingest(self, paths):
+        """CSVを読み、前回から追記された移動を加えます。加えた移動の数を返します。"""
+        added = 0
+        with self._ingesting:
+            for path in paths:
+                try:
+                    added += self._ingest_file(path)
+                except (OSError, ValueError) as e:
+                    print(f"🔥 Travel time log read failed ({path}): {e}")
+        return added
+
+    def ingest_glob(self, pattern):
+        return self.ingest(sorted(glob.glob(pattern)))
+
+    def _ingest_file(self, path):
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            identity = (stat.st_dev, stat.st_ino)
+            head = f.read(HEAD_BYTES)
+            known_identity, known_head, offset = self._offsets.get(path, (identity, b"", 0))
+            if known_identity != identity or offset > stat.st_size or not head.startswith(known_head):
+                # 同じ名前の別のファイル (作り直された・切り詰められた) なので、最初から読み直す
+                offset = 0
+                self._columns.pop(path, None)
+                self._pending.pop(path, None)
+            f.seek(offset)
+            data = f.read()
+        # 書きかけの行は次回に回す
+        end = data.rfind(b"\n") + 1
+        self._offsets[path] = (identity, head, offset + end)
+        if end == 0: return 0
+
+        added = 0
+        for row in csv.reader(io.StringIO(data[:end].decode('utf-8-sig'), newline='')):
+            if not row: continue
+            if row[0] == "Timestamp":
+                self._columns[path] = {name: i for i, name in enumerate(row)}
+                continue
+            columns = self._columns.setdefault(path, {name: i for i, name in enumerate(COLUMNS)})
+            record = {name: row[i] if i < len(row) else "" for name, i in columns.items()}
+            added += self._feed(path, record)
+        return added
+
+    def _feed_leg(self, trip, record):
+        """直前の地点から、この行の地点までを1区間として記録します。"""
+        try:
+            at = datetime.strptime(record.get("Timestamp", ""), '%Y-%m-%d %H:%M:%S.%f').timestamp()
+        except ValueError:
+            trip["leg_from"] = None
+            return
+        location = record.get("Robot_Location", "")
+        if trip.get("leg_from") is not None:
+            start, started_at = trip["leg_from"]
+            self.add_leg(start, location, at - started_at)
+        trip["leg_from"] = (location, at)
+
+    def _feed(self, path, record):
+        action = record.get("Action_Type")
+        if action == "START_MOVING":
+            trip = self._pending[path] = {
+                "start": record.get("Robot_Location", ""),
+                "destination": _strip_prefix(record.get("Value_1"), "To:"),
+                "route": _strip_prefix(record.get("Value_2"), "Route:"),
+                "legs": 1,
+                "leg_from": None
+            }
+            self._feed_leg(trip, record)
+        elif action == "WAYPOINT_ARRIVED" and path in self._pending:
+            self._pending[path]["legs"] += 1
+            self._feed_leg(self._pending[path], record)
+        elif action == "TIME_TRAVEL":
+            trip = self._pending.pop(path, None)
+            if trip is None or _strip_prefix(record.get("Value_2"), "To:") != trip["destination"]:
+                return 0
+            self._feed_leg(trip, record)
+            try:
+                seconds = float(record.get("Value_1"))
+            except (TypeError, ValueError):
+                return 0
+            self.add_trip(trip["start"], trip["destination"], trip["route"], seconds, trip["legs"])
+            return 1
+        return 0
+
+    def estimate(self, start, destination, route, legs=None):
+        """
+        到着までの見込み時間 (秒) を返します。見積もれなければ None。
+        legs: その経路の区間数 (経由地の数 + 1)。分かれば記録のない組も見積もれる
+        """
+        prior = None
+        if legs and self.total_legs:
+            prior = legs * self.total_seconds / self.total_legs
+        else:
+            fallback = self.pairs.get((start, destination)) or self.overall
+            if fallback.count: prior = fallback.mean
+
+        stats = self.routes.get((start, destination, route))
+        if stats is None or not stats.count:
+            return prior
+        if prior is None:
+            return stats.mean
+        return (stats.count * stats.mean + self.prior_weight * prior) / (stats.count + self.prior_weight)
+
+    def estimate_leg(self, start, goal):
+        """
+        1区間 (start → goal) の見込み時間 (秒)。その区間の平均を、全体の1区間あたりの平均に向けて縮めた値。
+        見積もれなければ None。
+        """
+        prior = self.total_seconds / self.total_legs if self.total_legs else None
+        stats = self.legs.get((start, goal))
+        if stats is None or not stats.count:
+            return prior
+        if prior is None:
+            return stats.mean
+        return (stats.count * stats.mean + self.prior_weight * prior) / (stats.count + self.prior_weight)
+
+    def estimate_routes(self, start, destination, route_pattern):
+        """経路の選択肢 {"route_left": [経由地, ...], ...} それぞれの見込み時間 {経路: 秒}"""
+        etas = {}
+        for route, waypoints in route_pattern.items():
+            eta = self.estimate(start, destination, route, legs=len(waypoints) + 1)
+            etas[route] = None if eta is None else round(eta, 1)
+        return etas
+
+    def get_stats(self):
+        return {
+            "trips": self.overall.count,
+            "routes": len(self.routes),
+            "pairs": len(self.pairs),
+            "legs": len(self.legs),
+            "seconds_per_leg": round(self.total_seconds / self.total_legs, 2) if self.total_legs else None,
+            "files": len(self._offsets)
+        }
@@ -1,12 +1,23 @@
 import asyncio
 import json
-from collections import deque
+import math
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
-from Control import Control
-import kachaka_api
+from Control import Control, position_to_angle
+from servo_scheduler import ServoCommandScheduler
+from servo_loop import FixedRateTimer
+from servo_motion import MotionProfile
+from servo_process import ServoProcess
+from servo_protocol import BINARY_SUBPROTOCOL, decode_commands, encode_setpoint, parse_setpoint
+from servo_inbound import ServoInboundQueue, new_inbound_stats
+from servo_latency import ServoLatencyTracker, LATENCY_STAGES
+from clock_sync import ClockSync, make_pong, now_ms, run_pinger
+from kachaka_commands import legacy_detection_delay, start_move, get_last_result
+from kachaka_fleet import KachakaFleet, parse_robot_list
+from route_engine import RoutePlanner
+from travel_times import TravelTimeEstimator
+import numpy as np
 import threading
 import time
-from concurrent.futures import ThreadPoolExecutor
 import csv
 import os
 from datetime import datetime
@@ -15,19 +26,17 @@ from datetime import datetime
 # カチャカのIPアドレス(H509) 10.40.42.28
 KACHAKA_IP = "10.40.42.28"
 app = FastAPI()
-kachaka_client: kachaka_api.KachakaApiClient = None
 
 # =================================================================
 # ★★★ METRICS & LOGGING SETUP (ユーザー別集計に対応) ★★★
 # =================================================================
 log_lock = threading.Lock()
 
-# ★変更: 初期状態では空にしておく（開始ボタンで設定）
-LOG_FILENAME = "" 
-is_experiment_started = False
+# ログファイル名と実験の開始状態はロボット (実験セッション) ごとに持つ (KachakaRobot.log_filename)
 
 class MetricsTracker:
-    def __init__(self):
+    def __init__(self, robot):
+        self.robot = robot
         # 時間計測用
         self.t_start_selection = time.time()
         self.t_dest_selected = None
@@ -92,7 +101,8 @@ class MetricsTracker:
                     user_id, # User_IDカラムに記録
                     f"SERVO_SUMMARY_{self.current_phase}", 
                     str(stats["count"]), 
-                    str(round(stats["duration"], 3))
+                    str(round(stats["duration"], 3)),
+                    robot=self.robot
                 )
                 print(f"📊 Summary ({self.current_phase}) [{user_id}]: {stats['count']} clicks, {stats['duration']:.2f} sec")
                 
@@ -100,6 +110,8 @@ class MetricsTracker:
                 stats["count"] = 0
                 stats["duration"] = 0.0
 
+        if SERVO_LATENCY_CSV:
+            log_servo_latency(self.robot)
         self.current_phase = new_phase
 
     def record_servo_input(self, user_id, axis, command):
@@ -125,17 +137,22 @@ class MetricsTracker:
                 duration = now - start_time
                 stats["duration"] += duration
 
-metrics = MetricsTracker()
-
 # ★変更: 呼び出された瞬間の時刻でファイルを作成する
-def init_log_file():
-    global LOG_FILENAME
+def init_log_file(robot):
     current_time_str = datetime.now().strftime('%Y%m%d_%H%M%S')
-    LOG_FILENAME = f"baseline_metrics_{current_time_str}.csv"
+    # 複数台で同時に実験する場合は、ファイル名にロボットIDを入れて分ける
+    robot_tag = f"{robot.robot_id}_" if len(fleet) > 1 else ""
+    base_name = f"baseline_metrics_{robot_tag}{current_time_str}"
+    # 同じ秒に実験を始め直した場合も、前のログを上書きしないよう番号を付けて分ける
+    robot.log_filename = f"{base_name}.csv"
+    suffix = 1
+    while os.path.exists(robot.log_filename):
+        suffix += 1
+        robot.log_filename = f"{base_name}_{suffix}.csv"
     
-    print(f"📝 New Log File Created: {LOG_FILENAME}")
+    print(f"📝 New Log File Created: {robot.log_filename}")
 
-    with open(LOG_FILENAME, 'w', newline='', encoding='utf-8') as f:
+    with open(robot.log_filename, 'w', newline='', encoding='utf-8') as f:
         writer = csv.writer(f)
         writer.writerow([
             "Timestamp", "User_ID", "Action_Type", 
@@ -143,17 +160,19 @@ def init_log_file():
             "Current_Selector", "Robot_Location"
         ])
 
-def log_event(user_id, action_type, val1="", val2=""):
+def log_event(user_id, action_type, val1="", val2="", robot=None):
+    # robot を省略したらデフォルトのロボット (サーボの操作卓がつながっている実験) に記録する
+    robot = robot or fleet.default
     # ファイル名が決まっていない（実験開始前）ならログしない
-    if not LOG_FILENAME: return
+    if not robot.log_filename: return
     try:
         timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')
         with log_lock:
-            with open(LOG_FILENAME, 'a', newline='', encoding='utf-8') as f:
+            with open(robot.log_filename, 'a', newline='', encoding='utf-8') as f:
                 writer = csv.writer(f)
                 writer.writerow([
                     timestamp, user_id, action_type, val1, val2,
-                    current_destination_selector, current_location_name
+                    robot.destination_selector, robot.current_location_name
                 ])
     except Exception as e:
         print(f"🔥 Log Error: {e}")
@@ -163,32 +182,33 @@ def log_event(user_id, action_type, val1="", val2=""):
 # =================================================================
 # Section 1: Kachaka ロボット制御関連
 # =================================================================
-kachaka_command_queue = deque()
-kachaka_clients = set()
-kachaka_lock = threading.Lock()
-executor = ThreadPoolExecutor(max_workers=1)
-
-# 状態管理変数
-user_assignments = {}
-destination_requests = {}
-route_selection = None
-
-# 現在地管理
-current_location_name = "充電ドック" 
-current_moving_location = None
+# ロボットへの問い合わせ1回あたりのタイムアウト (秒)
+# Kachaka とのやり取りはすべて kachaka_api.aio のクライアントで行い、イベントループを止めない
+KACHAKA_CALL_TIMEOUT = 3.0
+# 移動中に経路の次の地点をロボットのコマンドキューへ先に積み、地点ごとの停止待ちをなくす
+KACHAKA_PIPELINE = os.environ.get("KACHAKA_PIPELINE", "1") == "1"
+# 1区間の完了を待つ上限 (秒): 過去のログから見積もった区間の移動時間の KACHAKA_LEG_TIMEOUT_FACTOR 倍
+# (KACHAKA_LEG_TIMEOUT_MIN 秒以上)。見積もれない区間は KACHAKA_LEG_TIMEOUT_DEFAULT 秒
+KACHAKA_LEG_TIMEOUT_FACTOR = 3.0
+KACHAKA_LEG_TIMEOUT_MIN = 30.0
+KACHAKA_LEG_TIMEOUT_DEFAULT = 180.0
+
+# ロボットごとに移動キュー・地点キャッシュ・コマンド状態のストリーム・現在地・実験セッションを持つ
+# (KACHAKA_ROBOTS="rig_a=10.40.42.28,rig_b=10.40.5.108" で複数台。省略時は KACHAKA_IP の1台)
+fleet = KachakaFleet(
+    parse_robot_list(os.environ.get("KACHAKA_ROBOTS"), KACHAKA_IP),
+    call_timeout=KACHAKA_CALL_TIMEOUT
+)
+for fleet_robot in fleet:
+    fleet_robot.metrics = MetricsTracker(fleet_robot)
 
 # クールダウン管理 (Unix Timestamp)
-cooldown_end_time = 0.0
 COOLDOWN_DURATION = 30.0  # 秒
 
-# 現在の目的地選択権を持つユーザーID (初期値: user_1)
-current_destination_selector = "user_1" 
-
 # =================================================================
 # 経路定義 (ROUTE_PATTERNS)
 # =================================================================
 ROUTE_PATTERNS = {}
-DEFAULT_ROUTE = {"route_left": [], "route_center": [], "route_right": []}
 
 def register_routes(start_node, target_nodes, left, center, right):
     """
@@ -421,33 +441,43 @@ register_routes("11", ["10"],
     right=["f", "d", "b", "a", "c", "e"])
 
 
-# 未定義の経路を自動生成してフォールバックを用意
+# 未定義の経路 (新しく登録した地点など) は、経由地のつながりと地点の座標から自動生成
+# (ロボットごとに、地点キャッシュが更新されたら作り直す)
 ALL_NODES = [str(i) for i in range(1, 12)]
 START_NODES = ["充電ドック"] + ALL_NODES
 
-for start in START_NODES:
-    for end in ALL_NODES:
-        if start == end:
-            continue
-        if (start, end) not in ROUTE_PATTERNS:
-            # マップ形状が不明なため、汎用的なパターン（空）を設定
-            ROUTE_PATTERNS[(start, end)] = DEFAULT_ROUTE.copy()
+for fleet_robot in fleet:
+    fleet_robot.routes = RoutePlanner(ROUTE_PATTERNS, START_NODES, ALL_NODES, fleet_robot.location_cache)
+
+# 過去のメトリクスCSVから学習した移動時間。経路の選択肢と移動開始の通知に見込み時間 (ETA) を付ける
+# (移動が終わるたびに、そのロボットのログファイルに追記された分を読み足す)
+TRAVEL_TIME_LOGS = os.environ.get("TRAVEL_TIME_LOGS", "*_metrics_*.csv")
+travel_times = TravelTimeEstimator()
+
+async def ingest_travel_times(paths=None):
+    """メトリクスCSVを別スレッドで読み足す (イベントループを止めない)。paths を省略したら TRAVEL_TIME_LOGS 全体。"""
+    loop = asyncio.get_running_loop()
+    if paths is None:
+        await loop.run_in_executor(None, travel_times.ingest_glob, TRAVEL_TIME_LOGS)
+        print(f"⏱️ Travel time model: {travel_times.get_stats()}")
+    else:
+        await loop.run_in_executor(None, travel_times.ingest, paths)
 
 
-async def send_status_to_all_clients(status_data):
-    if not kachaka_clients: return
+async def send_status_to_all_clients(robot, status_data):
+    if not robot.clients: return
     disconnected_clients = []
-    for client in list(kachaka_clients):
+    for client in list(robot.clients):
         try:
             await client.send_json(status_data)
         except Exception:
             disconnected_clients.append(client)
     for client in disconnected_clients:
-        kachaka_clients.discard(client)
+        robot.clients.discard(client)
 
-async def broadcast_connection_status():
-    is_user1_present = "user_1" in user_assignments.values()
-    is_user2_present = "user_2" in user_assignments.values()
+async def broadcast_connection_status(robot):
+    is_user1_present = "user_1" in robot.user_assignments.values()
+    is_user2_present = "user_2" in robot.user_assignments.values()
     is_ready = is_user1_present and is_user2_present
 
     message = {
@@ -455,191 +485,351 @@ async def broadcast_connection_status():
         "ready": is_ready,
         "user1": is_user1_present,
         "user2": is_user2_present,
-        "destination_selector": current_destination_selector,
-        "cooldown_until": cooldown_end_time,
-        "is_experiment_started": is_experiment_started # ★追加: 開始状態を通知
+        "destination_selector": robot.destination_selector,
+        "cooldown_until": robot.cooldown_end_time,
+        "is_experiment_started": robot.is_experiment_started # ★追加: 開始状態を通知
     }
-    await send_status_to_all_clients(message)
+    await send_status_to_all_clients(robot, message)
 
-async def process_destination_and_route():
-    global destination_requests, route_selection, kachaka_client
-    
-    if current_destination_selector not in destination_requests:
+async def process_destination_and_route(robot):
+    if robot.destination_selector not in robot.destination_requests:
         return
-    if route_selection is None:
+    if robot.route_selection is None:
         return
     
-    current_location = current_location_name 
-    final_destination = destination_requests[current_destination_selector]["location"]
+    current_location = robot.current_location_name 
+    final_destination = robot.destination_requests[robot.destination_selector]["location"]
     destination_name = final_destination["name"]
     
-    print(f"🧐 [Plan] START: '{current_location}' -> GOAL: '{destination_name}' (Via: {route_selection})")
-    
-    route_key = (current_location, destination_name)
-    route_pattern = ROUTE_PATTERNS.get(route_key, DEFAULT_ROUTE)
-    waypoint_names = route_pattern.get(route_selection, [])
-    
     try:
-        if not kachaka_client: return
+        if not robot.client: return
 
-        locations = kachaka_client.get_locations()
-        location_dict = {loc.name: loc for loc in locations}
-        
-        waypoints = []
-        for wp_name in waypoint_names:
-            if wp_name in location_dict:
-                loc = location_dict[wp_name]
-                waypoints.append({"id": loc.id, "name": loc.name})
-            else:
-                print(f"⚠️ Waypoint '{wp_name}' not found. Skipping.")
-        
-        if destination_name in location_dict:
-             dest_loc = location_dict[destination_name]
-             final_dest_data = {"id": dest_loc.id, "name": dest_loc.name}
-        else:
+        # 移動計画は地点キャッシュ (マップ) ごとに作ってあるので、dict を1回引くだけ (ロボットへの問い合わせなし)
+        await robot.location_cache.ensure_loaded()
+        plan = robot.routes.get_plan(current_location, destination_name, robot.route_selection)
+        if plan is None:
              print(f"🔥 Destination '{destination_name}' not found!")
-             destination_requests.clear(); route_selection = None; return
+             robot.destination_requests.clear(); robot.route_selection = None; return
 
-        if waypoints:
-            waypoint_text = " → ".join([wp["name"] for wp in waypoints])
-            message = f"{waypoint_text} を経由して {destination_name} へ向かいます！"
-        else:
-            message = f"{destination_name} へ直接向かいます！"
+        print(f"🧐 [Plan:{robot.robot_id}] START: '{current_location}' -> GOAL: '{destination_name}' (Via: {robot.route_selection}, est. {plan.length})")
         
         # ★ METRICS: 移動開始
-        metrics.start_travel()
-        log_event("SYSTEM", "START_MOVING", f"To: {destination_name}", f"Route: {route_selection}")
-        
-        await send_status_to_all_clients({"type": "STARTING_MOVE", "message": message})
+        robot.metrics.start_travel()
+        log_event("SYSTEM", "START_MOVING", f"To: {destination_name}", f"Route: {robot.route_selection}", robot=robot)
+
+        eta = travel_times.estimate(current_location, destination_name, robot.route_selection, legs=plan.legs)
+        await send_status_to_all_clients(robot, dict(plan.payload, eta=None if eta is None else round(eta, 1)))
         await asyncio.sleep(1)
         
-        with kachaka_lock:
-            for waypoint in waypoints:
-                kachaka_command_queue.append(waypoint)
-            kachaka_command_queue.append(final_dest_data)
+        with robot.lock:
+            robot.command_queue.extend(plan.locations)
+        robot.queue_event.set()
         
-        destination_requests.clear()
-        route_selection = None
+        robot.destination_requests.clear()
+        robot.route_selection = None
         
     except Exception as e:
         print(f"🔥 Process Error: {e}")
-        destination_requests.clear()
-        route_selection = None
-
-def kachaka_move_sync(location_id, location_name):
-    global kachaka_client
+        robot.destination_requests.clear()
+        robot.route_selection = None
+
+def leg_timeout(start, goal):
+    """1区間 (start → goal) の完了を待つ上限 (秒)"""
+    estimate = travel_times.estimate_leg(start, goal)
+    if estimate is None:
+        return KACHAKA_LEG_TIMEOUT_DEFAULT
+    return max(KACHAKA_LEG_TIMEOUT_MIN, estimate * KACHAKA_LEG_TIMEOUT_FACTOR)
+
+def log_move_failure(robot, location_name, reason):
+    print(f"🔥 [Move:{robot.robot_id}] Leg to '{location_name}' failed: {reason}")
+    log_event("SYSTEM", "MOVE_FAILED", f"To: {location_name}", reason, robot=robot)
+    return False
+
+async def kachaka_move(robot, location_id, location_name, sent_event, command_id=None):
+    """
+    1区間の移動。ロボットがコマンドを受け付けたら sent_event をセットする。
+    command_id を渡した区間はロボットのコマンドキューに積み済みなので、そのコマンドの完了を待つだけ。
+    到着したら True。ロボットが受け付けなかった・失敗した・時間内に終わらなかった (取り消す) 場合は False。
+    """
+    limit = leg_timeout(robot.current_location_name, location_name)
     try:
-        print(f"🤖 [Move] Trying to go to '{location_name}'...")
-        
-        timeout = 0
-        while kachaka_client.is_command_running():
-            time.sleep(0.5)
-            timeout += 1
-            if timeout > 10: 
-                print("⚠️ Force starting new command...")
-                break
-
-        kachaka_client.move_to_location(location_id)
+        if command_id:
+            sent_event.set()
+            print(f"🤖 [Move:{robot.robot_id}] Continuing to queued '{location_name}'...")
+        else:
+            print(f"🤖 [Move:{robot.robot_id}] Trying to go to '{location_name}'...")
+            # 前のコマンドが終わるのを最大5秒待つ
+            if robot.command_watcher.connected:
+                if not await robot.command_watcher.wait_idle(timeout=5.0):
+                    print("⚠️ Force starting new command...")
+            else:
+                timeout = 0
+                while await robot.call(robot.client.is_command_running()):
+                    await asyncio.sleep(0.5)
+                    timeout += 1
+                    if timeout > 10: 
+                        print("⚠️ Force starting new command...")
+                        break
+
+        started_at = time.monotonic()
+        deadline = started_at + limit
+        if not command_id:
+            result, command_id = await robot.call(start_move(robot.client, location_id))
+            if not result.success:
+                # 地点IDが古い・削除された、ロボットが受け付けない状態など。状態は何も変わらないので待たない
+                return log_move_failure(robot, location_name, f"rejected (error {result.error_code})")
+            sent_event.set()
         
-        time.sleep(1) 
-        while kachaka_client.is_command_running():
-            time.sleep(0.5)
+        # 後ろに次の区間が積まれていると実行中の状態が途切れないので、このコマンドIDの完了結果で判定する
+        result = None
+        if robot.command_watcher.results_connected:
+            result = await robot.command_watcher.wait_command(command_id, limit)
+        robot.route_progress["legs"] += 1
+        if result is not None:
+            # ストリームで完了を検知。旧実装のポーリングより何秒早く次に進めたかを記録する
+            saved = legacy_detection_delay(started_at, time.monotonic())
+            robot.route_progress["saved"] += saved
+            log_event("SYSTEM", "LEG_LATENCY_SAVED", f"To: {location_name}", str(round(saved, 3)), robot=robot)
+        else:
+            # ストリームが使えない (途中で切れた) 場合は、締め切りまでこのコマンドIDの結果をポーリングで待つ
+            while time.monotonic() < deadline:
+                last_result, last_id = await robot.call(get_last_result(robot.client))
+                if last_id == command_id:
+                    result = last_result
+                    break
+                await asyncio.sleep(0.5)
+            if result is None:
+                # 時間内に終わらなかった区間は取り消し、到着したことにはしない
+                await robot.call(robot.client.cancel_command())
+                return log_move_failure(robot, location_name, f"timeout ({limit:.0f} s)")
+        if not result.success:
+            # 障害物で止まった・取り消されたなど
+            return log_move_failure(robot, location_name, f"failed (error {result.error_code})")
             
-        print(f"✅ [Move] Finished command for '{location_name}'.")
+        print(f"✅ [Move:{robot.robot_id}] Finished command for '{location_name}'.")
         return True 
 
     except Exception as e:
-        print(f"🔥 [Move] Exception: {e}")
-        return True 
+        return log_move_failure(robot, location_name, f"exception ({e})")
 
-async def process_kachaka_queue():
-    global kachaka_client, current_location_name, current_moving_location, current_destination_selector, cooldown_end_time
+async def process_kachaka_queue(robot):
     current_move_future = None
+    current_leg_sent = asyncio.Event()
+    pipelined_leg = None  # ロボットのコマンドキューに先に積んだ次の区間
+    pipelined_command_id = None
 
     while True:
         try:
-            if not kachaka_client:
+            if not robot.client:
                 await asyncio.sleep(1); continue
             
             if current_move_future and current_move_future.done():
-                if current_moving_location:
-                    old_loc = current_location_name
-                    new_loc = current_moving_location.get("name")
-                    current_location_name = new_loc
-                    print(f"📍 [Update] Location changed: '{old_loc}' -> '{new_loc}'")
+                arrived = current_move_future.result()
+                failed_leg = None
+                if robot.current_moving_location:
+                    old_loc = robot.current_location_name
+                    new_loc = robot.current_moving_location.get("name")
+                    if arrived:
+                        robot.current_location_name = new_loc
+                        print(f"📍 [Update:{robot.robot_id}] Location changed: '{old_loc}' -> '{new_loc}'")
+                    else:
+                        failed_leg = new_loc
+                        print(f"⚠️ [Update:{robot.robot_id}] Skipped '{new_loc}', still at '{old_loc}'")
                 
-                current_moving_location = None
+                robot.current_moving_location = None
+
+                if not arrived and pipelined_leg:
+                    # 前の区間が失敗したので、先に積んだ区間がロボット側で走っているとは限らない。キューに戻して送り直す
+                    with robot.lock:
+                        robot.command_queue.appendleft(pipelined_leg)
+                    pipelined_leg = None
 
                 # ★ METRICS: 最終到着判定（キュー空）
-                if not kachaka_command_queue:
-                    travel_time = metrics.end_travel()
-                    log_event("SYSTEM", "TIME_TRAVEL", str(travel_time), f"To: {current_location_name}")
+                if not robot.command_queue and pipelined_leg is None:
+                    travel_time = robot.metrics.end_travel()
+                    if arrived:
+                        log_event("SYSTEM", "TIME_TRAVEL", str(travel_time), f"To: {robot.current_location_name}", robot=robot)
+                        if robot.log_filename:
+                            asyncio.create_task(
+                                ingest_travel_times([robot.log_filename]), name="travel time ingest"
+                            ).add_done_callback(log_task_error)
+                    else:
+                        # 目的地に着けなかった移動は移動時間として記録しない (見込み時間の学習に混ぜない)
+                        log_event("SYSTEM", "ROUTE_FAILED", str(travel_time), f"To: {failed_leg}", robot=robot)
+                    # 旧実装 (区間ごとに1秒待ち + 0.5秒ポーリング) と比べて、少なくともこれだけ早く着いた
+                    log_event(
+                        "SYSTEM", "TIME_TRAVEL_SAVED", str(round(robot.route_progress["saved"], 3)),
+                        f"Legs: {robot.route_progress['legs']}, Pipelined: {robot.route_progress['pipelined']}",
+                        robot=robot
+                    )
+                    robot.route_progress.update(legs=0, pipelined=0, saved=0.0)
                 
                 # ★ 役割交代地点の定義 (1~11)
                 swap_triggers = [str(i) for i in range(1, 12)]
                 
-                if current_location_name in swap_triggers:
-                    prev_selector = current_destination_selector
-                    current_destination_selector = "user_2" if current_destination_selector == "user_1" else "user_1"
-                    print(f"🔄 [Role Swap] Arrived at {current_location_name}. Destination Selector is now: {current_destination_selector}")
+                if not arrived:
+                    pass  # 着けなかった区間では役割交代も経由地の到着記録もしない (MOVE_FAILED は記録済み)
+                elif robot.current_location_name in swap_triggers:
+                    prev_selector = robot.destination_selector
+                    robot.destination_selector = "user_2" if robot.destination_selector == "user_1" else "user_1"
+                    print(f"🔄 [Role Swap] Arrived at {robot.current_location_name}. Destination Selector is now: {robot.destination_selector}")
                     
                     # ★ クールダウン開始: 到着から60秒間操作不能にする
-                    cooldown_end_time = time.time() + COOLDOWN_DURATION
-                    print(f"⏳ Cooldown started until {datetime.fromtimestamp(cooldown_end_time).strftime('%H:%M:%S')}")
+                    robot.cooldown_end_time = time.time() + COOLDOWN_DURATION
+                    print(f"⏳ Cooldown started until {datetime.fromtimestamp(robot.cooldown_end_time).strftime('%H:%M:%S')}")
 
                     # ★ LOG: 役割交代
-                    log_event("SYSTEM", "ROLE_SWAP", f"At: {current_location_name}", f"{prev_selector}->{current_destination_selector}")
+                    log_event("SYSTEM", "ROLE_SWAP", f"At: {robot.current_location_name}", f"{prev_selector}->{robot.destination_selector}", robot=robot)
                 else:
-                    print(f"➡️ [Continue] Arrived at {current_location_name} (Waypoint). No role swap.")
-                    log_event("SYSTEM", "WAYPOINT_ARRIVED", f"At: {current_location_name}", "")
+                    print(f"➡️ [Continue] Arrived at {robot.current_location_name} (Waypoint). No role swap.")
+                    log_event("SYSTEM", "WAYPOINT_ARRIVED", f"At: {robot.current_location_name}", "", robot=robot)
 
-                await send_status_to_all_clients({
+                await send_status_to_all_clients(robot, {
                     "type": "kachaka_status", 
                     "status": "idle", 
-                    "message": "",
-                    "current_location": current_location_name,
-                    "destination_selector": current_destination_selector,
-                    "cooldown_until": cooldown_end_time  # クールダウン情報を送信
+                    "message": f"{failed_leg} へ移動できませんでした" if failed_leg else "",
+                    "current_location": robot.current_location_name,
+                    "destination_selector": robot.destination_selector,
+                    "cooldown_until": robot.cooldown_end_time  # クールダウン情報を送信
                 })
                 current_move_future = None
 
-            if not current_move_future and not kachaka_client.is_command_running():
-                with kachaka_lock:
-                    if kachaka_command_queue:
-                        location_data = kachaka_command_queue.popleft()
-                        current_moving_location = location_data
+                # 先に積んでおいた次の区間は、ロボット側ですでに走り出している
+                if pipelined_leg:
+                    robot.current_moving_location = pipelined_leg
+                    pipelined_leg = None
+                    await send_status_to_all_clients(robot, {"type": "kachaka_status", "status": "moving", "destination": robot.current_moving_location["name"]})
+                    current_leg_sent = asyncio.Event()
+                    current_move_future = asyncio.create_task(kachaka_move(
+                        robot, robot.current_moving_location["id"], robot.current_moving_location["name"], current_leg_sent,
+                        command_id=pipelined_command_id
+                    ))
+
+            if not current_move_future and not await robot.busy():
+                with robot.lock:
+                    if robot.command_queue:
+                        location_data = robot.command_queue.popleft()
+                        robot.current_moving_location = location_data
                         
-                        await send_status_to_all_clients({"type": "kachaka_status", "status": "moving", "destination": location_data["name"]})
+                        await send_status_to_all_clients(robot, {"type": "kachaka_status", "status": "moving", "destination": location_data["name"]})
                         
-                        loop = asyncio.get_event_loop()
-                        current_move_future = loop.run_in_executor(executor, kachaka_move_sync, location_data["id"], location_data["name"])
+                        current_leg_sent = asyncio.Event()
+                        current_move_future = asyncio.create_task(kachaka_move(robot, location_data["id"], location_data["name"], current_leg_sent))
+
+            # 今の区間のコマンドを送り終えたら、次の地点をロボットのコマンドキューに積んでおく
+            # (cancel_all=False で積むと、ロボットは今の区間が終わった瞬間に次へ向かう)
+            if (KACHAKA_PIPELINE and current_move_future and not current_move_future.done()
+                    and current_leg_sent.is_set() and pipelined_leg is None and robot.command_watcher.results_connected):
+                with robot.lock:
+                    next_leg = robot.command_queue.popleft() if robot.command_queue else None
+                if next_leg:
+                    try:
+                        result, command_id = await robot.call(start_move(robot.client, next_leg["id"], cancel_all=False))
+                    except Exception:
+                        with robot.lock:
+                            robot.command_queue.appendleft(next_leg)
+                        raise
+                    if not result.success:
+                        # 受け付けられなかった区間は飛ばし、次のループで残りの区間を積み直す
+                        log_move_failure(robot, next_leg["name"], f"rejected (error {result.error_code})")
+                        continue
+                    pipelined_leg = next_leg
+                    pipelined_command_id = command_id
+                    robot.route_progress["pipelined"] += 1
+                    print(f"⏩ [Pipeline:{robot.robot_id}] Queued '{next_leg['name']}' on the robot")
 
         except Exception as e:
             print(f"🔥 Queue Error: {e}")
             await asyncio.sleep(5)
-        await asyncio.sleep(0.5)
+
+        # 移動中は完了した瞬間に、待機中はキューに地点が積まれた瞬間に次へ進む (最大0.5秒ごとに再確認)
+        if current_move_future:
+            waiters = {current_move_future}
+            if not current_leg_sent.is_set():
+                waiters.add(asyncio.ensure_future(current_leg_sent.wait()))
+            done, pending = await asyncio.wait(waiters, timeout=0.5, return_when=asyncio.FIRST_COMPLETED)
+            for waiter in pending:
+                if waiter is not current_move_future:
+                    waiter.cancel()
+        else:
+            try:
+                await asyncio.wait_for(robot.queue_event.wait(), 0.5)
+            except asyncio.TimeoutError:
+                pass
+            robot.queue_event.clear()
+
+# =================================================================
+# クライアントごとの往復遅延 (RTT) と時計のずれの推定
+# =================================================================
+CLOCK_PING_INTERVAL = 2.0  # PING を送る間隔 (秒)
+client_clocks = {}  # {websocket: {"endpoint", "user_id", "robot", "clock": ClockSync}}
+
+def register_client_clock(websocket, endpoint, user_id=None, robot=None):
+    clock = ClockSync()
+    client_clocks[websocket] = {"endpoint": endpoint, "user_id": user_id, "robot": robot, "clock": clock}
+    return clock
+
+def unregister_client_clock(websocket):
+    """切断時に RTT とオフセットの推定値をログに残す"""
+    entry = client_clocks.pop(websocket, None)
+    if entry and entry["clock"].samples:
+        stats = entry["clock"].get_stats()
+        log_event(entry["user_id"] or entry["endpoint"], "CLIENT_RTT", str(stats["rtt_mean_ms"]), str(stats["offset_ms"]), robot=entry["robot"])
+
+def log_client_decision(robot, user_id, action_type, server_duration, client_ts, received_ms, clock):
+    """
+    クライアントが操作した時刻 (client_ts, クライアント時計の ms) が付いていれば、
+    上りの通信遅延 (実測) と画面表示までの下りの遅延 (RTT/2 で推定) を除いた判断時間も記録する
+    """
+    event_time = clock.to_server_time(client_ts)
+    if event_time is None: return
+    uplink = max(0.0, received_ms / 1000.0 - event_time)
+    downlink = (clock.rtt_mean_ms or 0.0) / 2000.0
+    log_event(user_id, action_type, str(round(server_duration - uplink - downlink, 3)), str(round(uplink * 1000.0, 1)), robot=robot)
+
+@app.get("/clients/clock")
+async def client_clock_endpoint():
+    """接続中のクライアントごとの RTT と時計のオフセット (クライアント - サーバー, ms)"""
+    return [
+        {
+            "endpoint": entry["endpoint"], "user_id": entry["user_id"],
+            "robot": entry["robot"].robot_id if entry["robot"] else None,
+            **entry["clock"].get_stats()
+        }
+        for entry in client_clocks.values()
+    ]
+
+@app.get("/fleet")
+async def fleet_endpoint():
+    """ロボットごとの接続状態・現在地・移動キュー・接続中の操作者"""
+    return fleet.get_stats()
 
 @app.websocket("/ws/kachaka")
 async def websocket_kachaka_endpoint(websocket: WebSocket):
-    global route_selection, is_experiment_started, metrics # ★global追加
     await websocket.accept()
-    kachaka_clients.add(websocket)
+    # 接続先のロボット (/ws/kachaka?robot=rig_b)。省略時は先頭のロボット
+    robot = fleet.get(websocket.query_params.get("robot"))
+    if robot is None:
+        await websocket.send_json({"type": "ERROR", "message": f"ロボット「{websocket.query_params.get('robot')}」は登録されていません。"})
+        await websocket.close()
+        return
+    robot.clients.add(websocket)
     user_id = None
 
-    with kachaka_lock:
-        if "user_1" not in user_assignments.values(): user_id = "user_1"
-        elif "user_2" not in user_assignments.values(): user_id = "user_2"
+    with robot.lock:
+        if "user_1" not in robot.user_assignments.values(): user_id = "user_1"
+        elif "user_2" not in robot.user_assignments.values(): user_id = "user_2"
         else: user_id = "spectator"
-        user_assignments[websocket] = user_id
+        robot.user_assignments[websocket] = user_id
     
     # ★ METRICS: 接続時タイマーリセット
-    metrics.reset_selection_timer()
-    log_event(user_id, "CONNECT", "Kachaka WS", "")
+    robot.metrics.reset_selection_timer()
+    log_event(user_id, "CONNECT", "Kachaka WS", "", robot=robot)
 
-    print(f"✅ [Connect] {user_id}. Sending Location: {current_location_name}")
+    print(f"✅ [Connect] {user_id}. Sending Location: {robot.current_location_name}")
     
     init_msg = ""
-    if user_id == current_destination_selector:
+    if user_id == robot.destination_selector:
         init_msg = "どこに行きますか？"
     else:
         init_msg = "パートナーが目的地を選ぶのを待っています..."
@@ -647,18 +837,30 @@ async def websocket_kachaka_endpoint(websocket: WebSocket):
     await websocket.send_json({
         "type": "user_assigned", 
         "user_id": user_id,
+        "robot_id": robot.robot_id,
         "message": init_msg,
-        "current_location": current_location_name,
-        "destination_selector": current_destination_selector,
-        "cooldown_until": cooldown_end_time,
-        "is_experiment_started": is_experiment_started # ★ 追加
+        "current_location": robot.current_location_name,
+        "destination_selector": robot.destination_selector,
+        "cooldown_until": robot.cooldown_end_time,
+        "is_experiment_started": robot.is_experiment_started # ★ 追加
     })
 
-    await broadcast_connection_status()
+    await broadcast_connection_status(robot)
+
+    # 往復遅延と時計のずれを接続中ずっと推定する
+    clock = register_client_clock(websocket, "kachaka", user_id, robot)
+    pinger = asyncio.create_task(run_pinger(websocket, clock, CLOCK_PING_INTERVAL))
 
     try:
         while True:
             data = await websocket.receive_json()
+            received_ms = now_ms()
+            if data.get("action") == "PONG":
+                clock.handle_pong(data)
+                continue
+            if data.get("action") == "PING":
+                await websocket.send_json(make_pong(data, received_ms))
+                continue
             print(f"📨 [{user_id}] Received: {data}")
             action = data.get("action")
 
@@ -668,110 +870,129 @@ async def websocket_kachaka_endpoint(websocket: WebSocket):
                     print("🎬 Experiment START Triggered by User 1")
                     
                     # 1. メトリクスのリセット
-                    metrics = MetricsTracker()
+                    robot.metrics = MetricsTracker(robot)
                     
                     # 2. ログファイルの新規作成（ここで時刻が確定）
-                    init_log_file()
+                    init_log_file(robot)
                     
                     # 3. フラグ更新
-                    is_experiment_started = True
+                    robot.is_experiment_started = True
                     
                     # 4. 全員に通知
-                    await send_status_to_all_clients({
+                    await send_status_to_all_clients(robot, {
                         "type": "EXPERIMENT_STARTED",
                         "message": "実験が開始されました！"
                     })
                     
-                    log_event("SYSTEM", "EXPERIMENT_START", "Button Pressed", "")
+                    log_event("SYSTEM", "EXPERIMENT_START", "Button Pressed", "", robot=robot)
                 continue
 
             # ★ 追加: 実験開始前は操作を受け付けない
-            if not is_experiment_started and action in ["REQUEST_DESTINATION", "SELECT_ROUTE"]:
+            if not robot.is_experiment_started and action in ["REQUEST_DESTINATION", "SELECT_ROUTE"]:
                  await websocket.send_json({"type": "ERROR", "message": "User 1 の開始ボタン待機中です。"})
                  continue
 
             if action == "REQUEST_DESTINATION":
                 # ★ クールダウンチェック
-                if time.time() < cooldown_end_time:
-                     remaining = int(cooldown_end_time - time.time())
+                if time.time() < robot.cooldown_end_time:
+                     remaining = int(robot.cooldown_end_time - time.time())
                      await websocket.send_json({"type": "ERROR", "message": f"準備中です。あと{remaining}秒お待ちください。"})
                      continue
 
-                if user_id != current_destination_selector:
+                if user_id != robot.destination_selector:
                      await websocket.send_json({"type": "ERROR", "message": "現在あなたのターンではありません。"})
                      continue
 
                 partner_id = "user_2" if user_id == "user_1" else "user_1"
-                if partner_id not in user_assignments.values():
+                if partner_id not in robot.user_assignments.values():
                      await websocket.send_json({"type": "ERROR", "message": "パートナーがいません。"})
                      continue
 
-                if current_moving_location or destination_requests:
+                if robot.current_moving_location or robot.destination_requests:
                     await websocket.send_json({"type": "ERROR", "message": "処理中です。"})
                     continue
                 
                 dest_name = data.get("location")["name"]
                 
                 # ★ METRICS: 目的地選択時間
-                dest_time = metrics.mark_dest_selected()
-                log_event(user_id, "TIME_DEST_SELECT", str(dest_time), dest_name)
+                dest_time = robot.metrics.mark_dest_selected()
+                log_event(user_id, "TIME_DEST_SELECT", str(dest_time), dest_name, robot=robot)
+                log_client_decision(robot, user_id, "TIME_DEST_SELECT_CLIENT", dest_time, data.get("client_ts"), received_ms, clock)
                 
-                destination_requests[user_id] = {"location": data.get("location")}
+                robot.destination_requests[user_id] = {"location": data.get("location")}
                 
-                route_key = (current_location_name, dest_name)
-                available_routes = ROUTE_PATTERNS.get(route_key, DEFAULT_ROUTE)
+                available_routes = robot.routes.get(robot.current_location_name, dest_name)
+                route_lengths = robot.routes.get_lengths(robot.current_location_name, dest_name)
 
                 # Baselineでは自分自身に経路選択を求める
-                await send_status_to_all_clients({
+                await send_status_to_all_clients(robot, {
                     "type": "WAITING_FOR_ROUTE", 
                     "message": f"目的地「{dest_name}」選択済。経路を選択してください。", 
                     "for_user": user_id, 
                     "route_options": available_routes,
+                    "route_lengths": route_lengths,
+                    "route_etas": travel_times.estimate_routes(robot.current_location_name, dest_name, available_routes),
                     "target_destination": dest_name 
                 })
                 await websocket.send_json({"type": "WAITING_FOR_ROUTE", "message": "経路を選択してください。"})
 
             elif action == "SELECT_ROUTE":
-                if user_id != current_destination_selector:
+                if user_id != robot.destination_selector:
                     await websocket.send_json({"type": "ERROR", "message": "あなたは経路選択の担当ではありません。"})
                     continue
 
-                if current_moving_location:
+                if robot.current_moving_location:
                     await websocket.send_json({"type": "ERROR", "message": "移動中です。"})
                     continue
                 
-                if current_destination_selector not in destination_requests:
+                if robot.destination_selector not in robot.destination_requests:
                     await websocket.send_json({"type": "ERROR", "message": "先に目的地を選んでください。"})
                     continue
 
-                route_selection = data.get("route")
+                robot.route_selection = data.get("route")
                 
                 # ★ METRICS: 経路選択時間 & 合計選択時間
-                route_time, total_time = metrics.mark_route_selected()
-                log_event(user_id, "TIME_ROUTE_SELECT", str(route_time), route_selection)
-                log_event("SYSTEM", "TIME_TOTAL_SELECT", str(total_time), "")
+                route_time, total_time = robot.metrics.mark_route_selected()
+                log_event(user_id, "TIME_ROUTE_SELECT", str(route_time), robot.route_selection, robot=robot)
+                log_client_decision(robot, user_id, "TIME_ROUTE_SELECT_CLIENT", route_time, data.get("client_ts"), received_ms, clock)
+                log_event("SYSTEM", "TIME_TOTAL_SELECT", str(total_time), "", robot=robot)
                 
-                await process_destination_and_route()
+                await process_destination_and_route(robot)
 
     except WebSocketDisconnect:
-        u_id = user_assignments.pop(websocket, None)
-        kachaka_clients.discard(websocket)
+        u_id = robot.user_assignments.pop(websocket, None)
+        robot.clients.discard(websocket)
         if u_id:
-            destination_requests.clear(); route_selection = None
-            log_event(u_id, "DISCONNECT", "Kachaka WS", "")
+            robot.destination_requests.clear(); robot.route_selection = None
+            log_event(u_id, "DISCONNECT", "Kachaka WS", "", robot=robot)
             print(f"❌ [Disconnect] {u_id}")
-            await send_status_to_all_clients({"type": "user_disconnected", "message": "リセットされました"})
-            await broadcast_connection_status()
+            await send_status_to_all_clients(robot, {"type": "user_disconnected", "message": "リセットされました"})
+            await broadcast_connection_status(robot)
+    finally:
+        pinger.cancel()
+        unregister_client_clock(websocket)
 
 # =================================================================
 # Section 2: Servo Motor Control
 # =================================================================
 
+# サーボ制御ループを別プロセスで動かすモード (SERVO_PROCESS_MODE=1)
+# このプロセスではシリアルポートを開かず、共有メモリ経由で子プロセスとやり取りする
+SERVO_PROCESS_MODE = os.environ.get("SERVO_PROCESS_MODE") == "1"
+servo_process = None
+
 # 定義
-servoHorizontalRight = Control(physical_id=5, name="HRight Servo")
-servoVerticalRight = Control(physical_id=7, name="VRight Servo")
-servoHorizontalLeft = Control(physical_id=13, name="HLeft Servo")
-servoVerticalLeft = Control(physical_id=9, name="VLeft Servo")
+# 操作者ごとのサーボのシリアルポート (None は Control.SERIAL_PORT を共有)
+# 別々のポートに分けると、ポートごとの書き込みスレッドで並行して送信される
+SERVO_PORTS = {
+    "user_1": os.environ.get("SERVO_SERIAL_PORT_USER_1"),
+    "user_2": os.environ.get("SERVO_SERIAL_PORT_USER_2")
+}
+
+servoHorizontalRight = Control(physical_id=5, name="HRight Servo", port=SERVO_PORTS["user_1"], connect=not SERVO_PROCESS_MODE)
+servoVerticalRight = Control(physical_id=7, name="VRight Servo", port=SERVO_PORTS["user_1"], connect=not SERVO_PROCESS_MODE)
+servoHorizontalLeft = Control(physical_id=13, name="HLeft Servo", port=SERVO_PORTS["user_2"], connect=not SERVO_PROCESS_MODE)
+servoVerticalLeft = Control(physical_id=9, name="VLeft Servo", port=SERVO_PORTS["user_2"], connect=not SERVO_PROCESS_MODE)
 
 USER_SERVO_MAP = {
     "user_1": {
@@ -785,101 +1006,412 @@ USER_SERVO_MAP = {
 }
 
 current_angles = {5: 0, 7: 0, 13: 0, 9: 0}
+# サーボの応答から読み戻した実際の角度 (未受信は None)
+measured_angles = {5: None, 7: None, 13: None, 9: None}
 movement_states = {5: "stop", 7: "stop", 13: "stop", 9: "stop"}
+# 目標角度モードの目標 ("increase" の向きを正とする角度)。None の軸は movement_states で動かす
+# 届いた目標は最新の1つだけを残し、古いものは上書きで捨てる
+servo_setpoints = {5: None, 7: None, 13: None, 9: None}
 servo_lock = threading.Lock()
 
-def move_servo(physical_id, servo_instance, angle):
+SERVO_TICK_INTERVAL = 0.01  # 制御周期 (100Hz)
+SERVO_SPEED = 40.0          # 巡航角速度 (度/秒)。旧実装の 0.4度/ティック @100Hz に相当
+SERVO_ACCEL = 400.0         # 加速度 (度/秒^2)
+SERVO_DECEL = 600.0         # 減速度 (度/秒^2)
+SERVO_SETPOINT_SPEED = 120.0  # 目標角度モードで目標へ向かう最高角速度 (度/秒)
+
+# 制御ループ上のID → 実際に駆動するサーボ (旧 if/elif と同じ対応)
+SERVO_TARGETS = {
+    7: servoHorizontalRight,
+    5: servoVerticalRight,
+    9: servoHorizontalLeft,
+    13: servoVerticalLeft
+}
+
+# 停止中のサーボの位置を読み戻す間隔 (ティック)
+SERVO_READBACK_EVERY = 10
+# 全軸が停止して制御ループが眠っている間に、1軸ずつ位置を読み戻す間隔 (秒)
+SERVO_IDLE_READBACK_INTERVAL = 0.25
+
+# コマンド受信 → 状態反映 → 制御ループ → シリアル書き込み の区間ごとの遅延
+# (別プロセスモードでは受信 → 反映 の区間のみ)
+servo_latency = ServoLatencyTracker()
+# フェーズ切り替え時に、遅延の p50/p95/p99 をメトリクスCSVにも書き出す
+SERVO_LATENCY_CSV = os.environ.get("SERVO_LATENCY_CSV") == "1"
+
+# 全軸の角度・速度・方向・可動範囲を配列で持つ台形速度プロファイル
+# ID 7, 9 は "increase" で角度が減る (上下方向)
+servo_profile = MotionProfile(
+    physical_ids=list(movement_states.keys()),
+    inverted_ids=(7, 9),
+    cruise_velocity=SERVO_SPEED,
+    acceleration=SERVO_ACCEL,
+    deceleration=SERVO_DECEL,
+    min_angle=-40.0,
+    max_angle=40.0,
+    setpoint_velocity=SERVO_SETPOINT_SPEED
+)
+
+# 位置が変わったサーボだけを、ポートごとのバス帯域の範囲内で送るスケジューラ
+# (1ティック分のフレームはポートごとにまとめて1回の write で送信される)
+servo_scheduler = ServoCommandScheduler(tick_interval=SERVO_TICK_INTERVAL)
+# 締め切り基準の固定周期タイマー (ジッタ統計付き)
+servo_timer = FixedRateTimer(interval=SERVO_TICK_INTERVAL)
+# /ws/servo にコマンドが届いたときに制御ループを起こすイベント
+servo_wakeup = threading.Event()
+
+def build_servo_process_spec():
+    """別プロセスの制御ループに渡す設定 (pickle 可能な値だけ)"""
+    return {
+        "ids": servo_profile.ids,
+        "servos": [
+            {"loop_id": p_id, "servo_id": servo.physical_id, "name": servo.name, "port": servo.bus.port}
+            for p_id, servo in SERVO_TARGETS.items()
+        ],
+        "inverted_ids": (7, 9),
+        "cruise_velocity": SERVO_SPEED,
+        "acceleration": SERVO_ACCEL,
+        "deceleration": SERVO_DECEL,
+        "min_angle": -40.0,
+        "max_angle": 40.0,
+        "setpoint_velocity": SERVO_SETPOINT_SPEED,
+        "tick_interval": SERVO_TICK_INTERVAL,
+        "readback_every": SERVO_READBACK_EVERY,
+        "idle_readback_interval": SERVO_IDLE_READBACK_INTERVAL
+    }
+
+def servo_last_written(physical_id):
+    """制御ループ上のIDのサーボに、最後にフレームを書き込んだ時刻"""
+    servo = SERVO_TARGETS[physical_id]
+    return servo.bus.last_written.get(servo.physical_id)
+
+def log_servo_latency(robot=None):
+    """遅延の統計をユーザー・軸・区間ごとにメトリクスCSVへ書き出す"""
+    for user_id, axes in servo_latency.get_stats().items():
+        for axis, stages in axes.items():
+            for stage in LATENCY_STAGES:
+                stats = stages[stage]
+                if not stats["count"]: continue
+                log_event(
+                    user_id,
+                    f"SERVO_LATENCY_{stage.upper()}",
+                    axis,
+                    f"{stats['p50_ms']}/{stats['p95_ms']}/{stats['p99_ms']}",
+                    robot=robot
+                )
+
+def move_servo(physical_id, servo_instance, angle, bus=None):
     with servo_lock:
         if servo_instance:
             angle = max(-40, min(angle, 40))
-            servo_instance.move(angle)
+            servo_instance.move(angle, bus)
             current_angles[physical_id] = angle
 
+def read_servo_feedback():
+    """各ポートの書き込みスレッドが受信した応答から、実際の角度を更新する"""
+    with servo_lock:
+        for p_id, servo in SERVO_TARGETS.items():
+            reading = servo.bus.measured.get(servo.physical_id)
+            if reading is not None:
+                measured_angles[p_id] = position_to_angle(reading[0])
+
 def servo_thread_loop():
+    servo_timer.start()
+    tick_count = 0
+    idle_polls = 0
     while True:
+        # 全軸が停止中なら、コマンドが届くまで固定周期をやめて眠る
+        servo_wakeup.clear()
+        with servo_lock:
+            servo_profile.set_commands(movement_states)
+            servo_profile.set_setpoints(servo_setpoints.values())
+            is_active = servo_profile.is_active()
+        if not is_active:
+            if not servo_timer.idle_until(servo_wakeup, timeout=SERVO_IDLE_READBACK_INTERVAL):
+                # 眠っている間も一定間隔で1軸ずつ位置を読み戻す (/servo/angles の実測値を古くしない)
+                idle_polls += 1
+                try:
+                    read_servo_feedback()
+                    servo_scheduler.poll(SERVO_TARGETS[servo_profile.ids[idle_polls % len(servo_profile.ids)]])
+                    servo_scheduler.dispatch()
+                except Exception as e:
+                    print(f"Servo Loop Error: {e}")
+                continue
+        # 次の締め切りまで待ち、実際の経過時間から移動量を決める
+        dt = servo_timer.wait()
         try:
+            # 前ティックの応答は書き込みスレッドが受信済みなので、待たずに反映する
+            read_servo_feedback()
+            # 前ティックまでに送ったフレームの書き込み時刻で、遅延の計測を締める
+            servo_latency.mark_written(servo_last_written)
+
+            # 全軸の台形プロファイルを1回の配列演算で進める (目標角度モードの軸は目標へ補間)
             with servo_lock:
-                states = dict(movement_states)
-            for physical_id, direction in states.items():
-                if direction == "stop": continue
-                
-                target_servo = None
-                if physical_id == 7: target_servo = servoHorizontalRight
-                elif physical_id == 5: target_servo = servoVerticalRight
-                elif physical_id == 9: target_servo = servoHorizontalLeft
-                elif physical_id == 13: target_servo = servoVerticalLeft
-                
-                if target_servo:
-                    current_angle = current_angles.get(physical_id, 0)
-                    step = 0.4 
-                    is_vertical = (physical_id == 7 or physical_id == 9)
-                    if direction == "increase":
-                        if is_vertical: current_angle -= step 
-                        else: current_angle += step 
-                    elif direction == "decrease":
-                        if is_vertical: current_angle += step 
-                        else: current_angle -= step 
-                    move_servo(physical_id, target_servo, current_angle)
+                servo_profile.set_commands(movement_states)
+                servo_profile.set_setpoints(servo_setpoints.values())
+                servo_latency.mark_loop()
+                angles, moving = servo_profile.step(dt)
+            for i in np.flatnonzero(moving):
+                physical_id = servo_profile.ids[i]
+                move_servo(physical_id, SERVO_TARGETS[physical_id], float(angles[i]), servo_scheduler)
+
+            # 停止中のサーボは順番に位置を再送して、現在位置を応答させる
+            tick_count += 1
+            if tick_count % SERVO_READBACK_EVERY == 0:
+                i = (tick_count // SERVO_READBACK_EVERY) % len(servo_profile.ids)
+                if not moving[i]:
+                    servo_scheduler.poll(SERVO_TARGETS[servo_profile.ids[i]])
+
+            # 変化のあったサーボ分のフレームを、ポートごとに1回の write で送信
+            servo_scheduler.dispatch()
         except Exception as e:
             print(f"Servo Loop Error: {e}")
-        time.sleep(0.01)
+
+@app.get("/servo/timing")
+async def servo_timing_endpoint():
+    """サーボ制御ループの周期ジッタとオーバーランの統計を返す"""
+    if servo_process:
+        return servo_process.get_timing_stats()
+    return servo_timer.get_stats()
+
+@app.get("/servo/angles")
+async def servo_angles_endpoint():
+    """指令角度と、サーボから読み戻した実際の角度・その差 (遅れ) を返す"""
+    if servo_process:
+        commanded = servo_process.read_angles()
+        measured = servo_process.read_measured()
+    else:
+        with servo_lock:
+            commanded = dict(current_angles)
+            measured = dict(measured_angles)
+    lag = {
+        p_id: (round(commanded[p_id] - angle, 2) if angle is not None else None)
+        for p_id, angle in measured.items()
+    }
+    return {"commanded": commanded, "measured": measured, "lag": lag}
+
+# /ws/servo の受信キューの上限 (接続ごと)
+SERVO_INBOUND_QUEUE_SIZE = 64
+# 全接続の受信・重複・まとめ・破棄の件数
+servo_inbound_stats = new_inbound_stats()
+
+def apply_servo_inputs(entries):
+    """
+    受信キューがまとめたコマンド・目標角度 ([(user_id, axis, command, angle, received_at), ...]) を
+    1回のロックで反映する (目標角度モードは軸ごとに最新の目標だけを保持し、制御ループが補間して追従する)
+    """
+    updates = []
+    for user_id, axis, command, angle, received_at in entries:
+        if user_id not in USER_SERVO_MAP: continue
+        target_servo = USER_SERVO_MAP[user_id].get(axis)
+        if target_servo:
+            if command == "setpoint":
+                angle = max(-40.0, min(float(angle), 40.0))
+            updates.append((target_servo.physical_id, command, angle, (user_id, axis), received_at))
+    if not updates: return
+
+    with servo_lock:
+        for p_id, command, angle, key, received_at in updates:
+            if command == "setpoint":
+                movement_states[p_id] = "stop"
+                servo_setpoints[p_id] = angle
+            else:
+                movement_states[p_id] = command
+                servo_setpoints[p_id] = None
+            servo_latency.mark_applied(p_id, key, received_at)
+    servo_wakeup.set()
+    if servo_process:
+        for p_id, command, angle, key, received_at in updates:
+            if command == "setpoint":
+                servo_process.set_setpoint(p_id, angle)
+            else:
+                servo_process.set_command(p_id, command)
+
+# 角度の配信レート (Hz) の既定値と上限
+SERVO_TELEMETRY_RATE = 20.0
+SERVO_TELEMETRY_MAX_RATE = 100.0
+
+def read_servo_angles():
+    """ユーザー・軸ごとの指令角度 (目標角度モードと同じく "increase" の向きを正とする)"""
+    if servo_process:
+        commanded = servo_process.read_angles()
+    else:
+        with servo_lock:
+            commanded = dict(current_angles)
+    angles = {}
+    for user_id, servos in USER_SERVO_MAP.items():
+        for axis, servo in servos.items():
+            sign = float(servo_profile.sign[servo_profile.index[servo.physical_id]])
+            angles[(user_id, axis)] = round(float(commanded[servo.physical_id]) * sign, 2) + 0.0  # -0.0 を 0.0 に
+    return angles
+
+def log_task_error(task):
+    """バックグラウンドタスクが例外で終わったら表示する (誰も await しないタスクの失敗を握りつぶさない)"""
+    if task.cancelled(): return
+    error = task.exception()
+    if error is not None:
+        print(f"🔥 Task '{task.get_name()}' failed: {error!r}")
+
+async def push_servo_angles(websocket, binary, rate):
+    """
+    購読中のクライアントへ、変化した角度だけを1ティック1メッセージにまとめて送る
+    JSON: {"type": "servo_angles", "angles": {"user_1": {"horizontal": 12.3}}}
+    バイナリ: 目標角度と同じ3バイト形式を変化した軸の数だけ並べたもの
+    """
+    interval = 1.0 / rate
+    last_sent = {}
+    next_tick = time.monotonic()
+    while True:
+        angles = read_servo_angles()
+        changed = {key: angle for key, angle in angles.items() if last_sent.get(key) != angle}
+        if changed:
+            last_sent.update(changed)
+            if binary:
+                await websocket.send_bytes(b"".join(
+                    encode_setpoint(user_id, axis, angle) for (user_id, axis), angle in changed.items()
+                ))
+            else:
+                payload = {}
+                for (user_id, axis), angle in changed.items():
+                    payload.setdefault(user_id, {})[axis] = angle
+                await websocket.send_json({"type": "servo_angles", "angles": payload})
+
+        # 締め切り基準で待つ (送信が遅れた場合は次の締め切りを今から数え直す)
+        next_tick = max(next_tick + interval, time.monotonic())
+        await asyncio.sleep(next_tick - time.monotonic())
+
+@app.get("/servo/latency")
+async def servo_latency_endpoint():
+    """コマンド受信からシリアル書き込みまでの区間ごとの遅延 (p50/p95/p99) をユーザー・軸ごとに返す"""
+    return {"latency": servo_latency.get_stats(), "expired": servo_latency.expired}
+
+@app.get("/servo/inbound")
+async def servo_inbound_endpoint():
+    """/ws/servo の受信件数と、重複・まとめ・キューあふれで捨てた件数を返す"""
+    return servo_inbound_stats
 
 @app.websocket("/ws/servo")
 async def websocket_servo_endpoint(websocket: WebSocket):
-    await websocket.accept()
-    print("✅ Servo Client Connected")
+    # クライアントがバイナリ形式のサブプロトコルを提示していれば、それを選択して応答する
+    offered = websocket.scope.get("subprotocols", [])
+    subprotocol = BINARY_SUBPROTOCOL if BINARY_SUBPROTOCOL in offered else None
+    await websocket.accept(subprotocol=subprotocol)
+    print(f"✅ Servo Client Connected ({'binary' if subprotocol else 'json'})")
+    # 操作回数を集計する実験セッション (/ws/servo?robot=rig_b)。サーボ自体はこのプロセスの1組を共有する
+    robot = fleet.get(websocket.query_params.get("robot")) or fleet.default
+
+    # 接続ごとの受信キュー: 同じコマンドの連打は捨て、1ティック内は軸ごとに最新だけを反映する
+    inbound = ServoInboundQueue(
+        apply=apply_servo_inputs,
+        # ★ METRICS: サーボ操作の集計 (逐一ログは停止)
+        # 実験開始で metrics は作り直されるので、呼ぶたびにロボットから引く
+        on_input=lambda user_id, axis, command: robot.metrics.record_servo_input(user_id, axis, command),
+        min_interval=SERVO_TICK_INTERVAL,
+        maxsize=SERVO_INBOUND_QUEUE_SIZE,
+        totals=servo_inbound_stats
+    )
+    applier = asyncio.create_task(inbound.run(), name="servo inbound")
+    applier.add_done_callback(log_task_error)
+    telemetry = None
+    clock = register_client_clock(websocket, "servo", robot=robot)
+    pinger = asyncio.create_task(run_pinger(websocket, clock, CLOCK_PING_INTERVAL))
     try:
         while True:
-            data = await websocket.receive_json()
-            user_id = data.get("user_id")
-            axis = data.get("axis") 
-            command = data.get("command") 
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+
+            data = message.get("bytes")
+            if data is not None:
+                # バイナリ形式: 1バイト = 1コマンド、3バイト = 目標角度
+                for user_id, axis, command, angle in decode_commands(data):
+                    inbound.put(user_id, axis, command, angle)
+                continue
 
-            # ★ METRICS: サーボ操作の集計 (逐一ログは停止)
-            metrics.record_servo_input(user_id, axis, command)
-            # log_event(user_id, "SERVO_INPUT", axis, command)
+            received_ms = now_ms()
+            data = json.loads(message["text"])
+            if data.get("action") == "PONG":
+                clock.handle_pong(data)
+            elif data.get("action") == "PING":
+                await websocket.send_json(make_pong(data, received_ms))
+            elif data.get("subscribe") == "angles":
+                # {"subscribe": "angles", "rate": 20} で角度の配信を開始 (rate 0 で停止)
+                # rate が数値でなければ無視する (配信中ならそのまま続ける)
+                try:
+                    rate = float(data.get("rate", SERVO_TELEMETRY_RATE))
+                except (TypeError, ValueError):
+                    rate = math.nan
+                if not math.isfinite(rate):
+                    await websocket.send_json({"type": "ERROR", "message": f"Invalid rate: {data.get('rate')!r}"})
+                    continue
+                if telemetry:
+                    telemetry.cancel()
+                    telemetry = None
+                rate = min(rate, SERVO_TELEMETRY_MAX_RATE)
+                if rate > 0:
+                    telemetry = asyncio.create_task(
+                        push_servo_angles(websocket, subprotocol is not None, rate), name="servo telemetry"
+                    )
+                    telemetry.add_done_callback(log_task_error)
+            elif "setpoint" in data:
+                # {"user_id": ..., "axis": ..., "setpoint": 角度}。数値でなければ受け付けない
+                setpoint = parse_setpoint(data["setpoint"])
+                if setpoint is None:
+                    await websocket.send_json({"type": "ERROR", "message": f"Invalid setpoint: {data['setpoint']!r}"})
+                    continue
+                inbound.put(data.get("user_id"), data.get("axis"), "setpoint", setpoint)
+            else:
+                inbound.put(data.get("user_id"), data.get("axis"), data.get("command"))
+                client_clocks[websocket]["user_id"] = data.get("user_id")
 
-            if user_id not in USER_SERVO_MAP: continue
-            target_servos = USER_SERVO_MAP[user_id]
-            target_servo = target_servos.get(axis)
-            
-            if target_servo:
-                p_id = target_servo.physical_id
-                with servo_lock:
-                    movement_states[p_id] = command
-            
     except WebSocketDisconnect:
-        print("❌ Servo Client Disconnected")
+        print(f"❌ Servo Client Disconnected {inbound.stats}")
     except Exception as e:
         print(f"Servo WS Error: {e}")
+    finally:
+        applier.cancel()
+        pinger.cancel()
+        if telemetry:
+            telemetry.cancel()
+        inbound.flush()
+        unregister_client_clock(websocket)
 
 @app.on_event("startup")
 async def startup_event():
-    global kachaka_client
+    global servo_process
     print("🚀 Server Starting (Baseline - Single User Select Mode)...")
     print("⚙️ Initializing Servos to Origin (0)...")
-    try:
-        initial_servos = [
-            (5, servoHorizontalRight),
-            (7, servoVerticalRight),
-            (13, servoHorizontalLeft),
-            (9, servoVerticalLeft)
-        ]
-        for p_id, servo in initial_servos:
-            move_servo(p_id, servo, 0)
-        time.sleep(0.5)
-    except Exception as e:
-        print(f"⚠️ Servo Init Error: {e}")
+    if SERVO_PROCESS_MODE:
+        # 制御ループは別プロセスで動かす (原点への初期化も子プロセスが行う)
+        servo_process = ServoProcess(build_servo_process_spec())
+        servo_process.start()
+    else:
+        try:
+            initial_servos = [
+                (5, servoHorizontalRight),
+                (7, servoVerticalRight),
+                (13, servoHorizontalLeft),
+                (9, servoVerticalLeft)
+            ]
+            for p_id, servo in initial_servos:
+                move_servo(p_id, servo, 0)
+            time.sleep(0.5)
+        except Exception as e:
+            print(f"⚠️ Servo Init Error: {e}")
         
-    threading.Thread(target=servo_thread_loop, daemon=True).start()
-    try:
-        kachaka_client = kachaka_api.KachakaApiClient(f"{KACHAKA_IP}:26400")
-        print(f"✅ Connected to Kachaka! Ver: {kachaka_client.get_robot_version()}")
-    except Exception as e:
-        print(f"🔥 Kachaka connect failed: {e}")
-    
-    asyncio.create_task(process_kachaka_queue())
-    print("✅ Server Ready")
+        threading.Thread(target=servo_thread_loop, daemon=True).start()
+    # ロボットごとに接続し、経路の実行・地点キャッシュ・コマンド状態の監視を別々のタスクで動かす
+    # 過去のメトリクスCSVはバックグラウンドで読む (読み終わるまでは見込み時間 (ETA) が付かない)
+    asyncio.create_task(ingest_travel_times(), name="travel time logs").add_done_callback(log_task_error)
+    await fleet.connect_all()
+    fleet.start_all(process_kachaka_queue)
+    print(f"✅ Server Ready ({len(fleet)} robot(s): {', '.join(robot.robot_id for robot in fleet)})")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    fleet.stop_all()
+    if servo_process:
+        servo_process.stop()
 
 if __name__ == "__main__":
     import uvicorn